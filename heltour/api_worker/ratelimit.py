@@ -0,0 +1,95 @@
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+from django_redis import get_redis_connection
+
+from heltour import settings
+
+# Updates the bucket and returns the number of seconds to wait before trying again (0 if a token was taken)
+_BUCKET_SCRIPT = '''
+local now, op, arg = tonumber(ARGV[1]), ARGV[2], tonumber(ARGV[3])
+local initial_rate, min_rate, max_rate, burst = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'rate', 'blocked_until')
+local rate = tonumber(state[3]) or initial_rate
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+local blocked_until = tonumber(state[4]) or 0
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if op == 'acquire' then
+    if now < blocked_until then
+        wait = blocked_until - now
+    elseif tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+elseif op == 'release' then
+    tokens = math.min(burst, tokens + 1)
+elseif op == 'success' then
+    rate = math.min(max_rate, rate + arg)
+elseif op == 'throttled' then
+    rate = math.max(min_rate, rate / 2)
+    tokens = 0
+    blocked_until = math.max(blocked_until, now + arg)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now, 'rate', rate, 'blocked_until', blocked_until)
+return tostring(wait)
+'''
+
+class TokenBucket:
+    '''Limits the rate of requests across every process sharing a redis key
+
+    Arguments:
+    key -- the redis key of the bucket's state
+
+    Requests take tokens, which refill at the current rate up to LICHESS_API_BURST. The rate adapts to the server:
+    each success adds LICHESS_API_RATE_INCREASE requests per second (up to LICHESS_API_MAX_RATE), and each 429
+    response halves it (down to LICHESS_API_MIN_RATE), empties the bucket and pauses all requests for the
+    Retry-After time, or LICHESS_API_THROTTLE_PAUSE seconds if the server didn't send one.
+    '''
+    def __init__(self, key):
+        self.key = key
+        self._script = None
+
+    '''Blocks until a request can be made'''
+    def acquire(self):
+        while True:
+            wait = self._call('acquire')
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    '''Returns a token taken by acquire that wasn't used for a request'''
+    def release(self):
+        self._call('release')
+
+    def success(self):
+        self._call('success', settings.LICHESS_API_RATE_INCREASE)
+
+    def throttled(self, retry_after=None):
+        self._call('throttled', retry_after if retry_after is not None else settings.LICHESS_API_THROTTLE_PAUSE)
+
+    def rate(self):
+        rate = get_redis_connection('default').hget(self.key, 'rate')
+        return float(rate) if rate is not None else settings.LICHESS_API_RATE
+
+    def _call(self, op, arg=0):
+        if self._script is None:
+            self._script = get_redis_connection('default').register_script(_BUCKET_SCRIPT)
+        args = [time.time(), op, arg, settings.LICHESS_API_RATE, settings.LICHESS_API_MIN_RATE, settings.LICHESS_API_MAX_RATE,
+                settings.LICHESS_API_BURST]
+        return float(self._script(keys=[self.key], args=args))
+
+def retry_after(response):
+    '''Returns the number of seconds given by a response's Retry-After header, or None'''
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time.time())
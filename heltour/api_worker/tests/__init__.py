@@ -0,0 +1,16 @@
+import fakeredis
+
+def use_fake_redis(testcase, *modules):
+    '''Points the given modules' redis connection at an empty in-memory server for the duration of the test
+
+    Returns the connection.
+    '''
+    conn = fakeredis.FakeStrictRedis()
+    for module in modules:
+        testcase.addCleanup(setattr, module, 'get_redis_connection', module.get_redis_connection)
+        module.get_redis_connection = lambda alias='default': conn
+        if hasattr(module, '_scripts'):
+            # Scripts are registered with the connection they were first used with
+            testcase.addCleanup(setattr, module, '_scripts', module._scripts)
+            module._scripts = {}
+    return conn
@@ -0,0 +1,98 @@
+import time
+from email.utils import formatdate
+
+from django.test import SimpleTestCase
+from heltour import settings
+from heltour.api_worker import ratelimit
+from heltour.api_worker.ratelimit import TokenBucket, retry_after
+from heltour.api_worker.tests import use_fake_redis
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+class TokenBucketTestCase(SimpleTestCase):
+    def setUp(self):
+        use_fake_redis(self, ratelimit)
+        self.clock = FakeClock()
+        self.addCleanup(setattr, ratelimit, 'time', ratelimit.time)
+        ratelimit.time = self.clock
+        for name, value in [('LICHESS_API_RATE', 0.5), ('LICHESS_API_MIN_RATE', 0.05), ('LICHESS_API_MAX_RATE', 2.0),
+                            ('LICHESS_API_RATE_INCREASE', 0.25), ('LICHESS_API_BURST', 2)]:
+            self.addCleanup(setattr, settings, name, getattr(settings, name))
+            setattr(settings, name, value)
+        self.bucket = TokenBucket('test:ratelimit')
+
+    def test_burst(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.assertEqual([], self.clock.sleeps)
+
+        # Then one token every 1 / rate seconds
+        self.bucket.acquire()
+        self.assertEqual([2.0], self.clock.sleeps)
+
+    def test_release(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.bucket.release()
+
+        self.bucket.acquire()
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_throttled(self):
+        self.bucket.throttled(30)
+
+        self.assertEqual(0.25, self.bucket.rate())
+        self.bucket.acquire()
+        self.assertEqual([30], self.clock.sleeps)
+
+        # The bucket refilled during the pause, and then refills at the halved rate
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.assertEqual([30, 4.0], self.clock.sleeps)
+
+    def test_throttled_without_retry_after(self):
+        self.bucket.throttled(None)
+
+        self.bucket.acquire()
+        self.assertEqual([settings.LICHESS_API_THROTTLE_PAUSE], self.clock.sleeps)
+
+    def test_backoff_and_recovery(self):
+        for _ in range(10):
+            self.bucket.throttled(0)
+        self.assertEqual(0.05, self.bucket.rate())
+
+        for expected in [0.3, 0.55, 0.8]:
+            self.bucket.success()
+            self.assertAlmostEqual(expected, self.bucket.rate())
+        for _ in range(10):
+            self.bucket.success()
+        self.assertEqual(2.0, self.bucket.rate())
+
+class RetryAfterTestCase(SimpleTestCase):
+    def test_seconds(self):
+        self.assertEqual(120, retry_after(FakeResponse({'Retry-After': '120'})))
+        self.assertEqual(0, retry_after(FakeResponse({'Retry-After': '-5'})))
+
+    def test_http_date(self):
+        value = formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(60, retry_after(FakeResponse({'Retry-After': value})), delta=2)
+        value = formatdate(time.time() - 60, usegmt=True)
+        self.assertEqual(0, retry_after(FakeResponse({'Retry-After': value})))
+
+    def test_missing(self):
+        self.assertIsNone(retry_after(FakeResponse({})))
+        self.assertIsNone(retry_after(FakeResponse({'Retry-After': 'soon'})))
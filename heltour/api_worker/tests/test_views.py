@@ -0,0 +1,64 @@
+import json
+
+from django.test import SimpleTestCase, RequestFactory
+from heltour import settings
+from heltour.api_worker import ratelimit, views, worker
+from heltour.api_worker.tests import use_fake_redis
+from heltour.tournament import httpclient
+
+class FakeResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+class FakeSession:
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return FakeResponse(200, '{"id": "a"}')
+
+class LichessApiCallTestCase(SimpleTestCase):
+    def setUp(self):
+        self.conn = use_fake_redis(self, worker, ratelimit, views)
+        self.session = FakeSession()
+        self.addCleanup(setattr, httpclient, 'session', httpclient.session)
+        httpclient.session = lambda name: self.session
+        self.addCleanup(setattr, settings, 'LICHESS_API_CACHE_TIMEOUT', settings.LICHESS_API_CACHE_TIMEOUT)
+        settings.LICHESS_API_CACHE_TIMEOUT = 10
+
+    def call(self, path, **params):
+        return views.lichess_api_call(RequestFactory().get('/lichessapi/' + path, params), path).content
+
+    def run_worker(self):
+        while True:
+            claimed = worker._claim_work()
+            if claimed is None:
+                return
+            job_id, job, attempts = claimed
+            views._do_lichess_api_call(job_id, json.loads(job), attempts)
+
+    def test_identical_requests(self):
+        first_key = self.call('api/user/a', priority=1)
+        second_key = self.call('api/user/a')
+        self.assertNotEqual(first_key, second_key)
+
+        self.run_worker()
+
+        self.assertEqual([('GET', 'https://en.lichess.org/api/user/a')], self.session.requests)
+        self.assertEqual(['{"id": "a"}'], self.conn.lrange(first_key, 0, -1))
+        self.assertEqual(['{"id": "a"}'], self.conn.lrange(second_key, 0, -1))
+
+        # Later identical requests get the cached response
+        third_key = self.call('api/user/a')
+        self.assertEqual(['{"id": "a"}'], self.conn.lrange(third_key, 0, -1))
+        self.assertEqual(1, len(self.session.requests))
+
+    def test_different_requests(self):
+        self.call('api/user/a')
+        self.call('api/user/a', nb=10)
+
+        self.run_worker()
+
+        self.assertEqual(2, len(self.session.requests))
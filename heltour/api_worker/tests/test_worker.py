@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+
+from django.test import SimpleTestCase
+from heltour import settings
+from heltour.api_worker import worker
+from heltour.api_worker.tests import use_fake_redis
+
+class WorkerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.conn = use_fake_redis(self, worker)
+
+    def queue(self, priority, name, **kwargs):
+        job_id = worker.queue_work(priority, {'name': name}, **kwargs)
+        # Jobs with the same priority are ordered by the millisecond they were queued
+        time.sleep(0.002)
+        return job_id
+
+    def claim(self):
+        claimed = worker._claim_work()
+        if claimed is None:
+            return None
+        job_id, job, attempts = claimed
+        return job_id, json.loads(job), attempts
+
+    def test_priority_order(self):
+        self.queue(0, 'first')
+        self.queue(0, 'second')
+        self.queue(1, 'urgent')
+        self.queue(-1, 'background')
+
+        names = [self.claim()[1]['name'] for _ in range(4)]
+
+        self.assertEqual(['urgent', 'first', 'second', 'background'], names)
+        self.assertIsNone(self.claim())
+
+    def test_claim_and_complete(self):
+        job_id = self.queue(0, 'a', waiter='result:1')
+
+        claimed_id, job, attempts = self.claim()
+        self.assertEqual(job_id, claimed_id)
+        self.assertEqual('a', job['name'])
+        self.assertEqual(1, attempts)
+        self.assertEqual({'queued': 0, 'processing': 1}, worker.queue_stats())
+
+        self.assertEqual(['result:1'], worker.complete_work(job_id, job))
+        self.assertEqual({'queued': 0, 'processing': 0}, worker.queue_stats())
+        for key in (worker.JOBS_KEY, worker.SCORES_KEY, worker.ATTEMPTS_KEY):
+            self.assertEqual(0, self.conn.hlen(key))
+
+    def test_claims_are_exclusive(self):
+        job_ids = [self.queue(0, str(n)) for n in range(20)]
+        claimed_ids = []
+
+        def claim_all():
+            while True:
+                claimed = worker._claim_work()
+                if claimed is None:
+                    return
+                claimed_ids.append(claimed[0])
+        threads = [threading.Thread(target=claim_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(job_ids), sorted(claimed_ids))
+
+    def test_expired_claim(self):
+        timeout = settings.API_WORKER_VISIBILITY_TIMEOUT
+        self.addCleanup(setattr, settings, 'API_WORKER_VISIBILITY_TIMEOUT', timeout)
+        first_id = self.queue(0, 'first')
+        self.queue(0, 'second')
+
+        settings.API_WORKER_VISIBILITY_TIMEOUT = -1
+        self.claim()
+        settings.API_WORKER_VISIBILITY_TIMEOUT = timeout
+
+        # The job goes back to its place at the front of the queue
+        job_id, job, attempts = self.claim()
+        self.assertEqual(first_id, job_id)
+        self.assertEqual(2, attempts)
+
+    def test_requeue(self):
+        first_id = self.queue(0, 'first')
+        self.queue(0, 'second')
+        job_id, job, attempts = self.claim()
+
+        worker.requeue_work(job_id, job)
+
+        self.assertEqual((first_id, 2), self.claim()[::2])
+
+    def test_dedupe(self):
+        job_id = self.queue(-1, 'a', dedupe_key='key', waiter='result:1')
+        self.queue(0, 'b')
+
+        # Joining the job with a higher priority moves it up the queue
+        self.assertEqual(job_id, self.queue(1, 'a', dedupe_key='key', waiter='result:2'))
+        self.assertEqual({'queued': 2, 'processing': 0}, worker.queue_stats())
+        claimed_id, job, _ = self.claim()
+        self.assertEqual(job_id, claimed_id)
+
+        # Requests can join a claimed job until it's completed
+        self.assertEqual(job_id, self.queue(0, 'a', dedupe_key='key', waiter='result:3'))
+        self.assertEqual(['result:1', 'result:2', 'result:3'], worker.complete_work(job_id, job))
+        self.assertIsNone(self.conn.get(worker.INFLIGHT_KEY_PREFIX + 'key'))
+        self.assertNotEqual(job_id, self.queue(0, 'a', dedupe_key='key'))
+
+    def test_keys_expire(self):
+        job_id = self.queue(0, 'a', dedupe_key='key', waiter='result:1')
+
+        self.assertTrue(0 < self.conn.ttl(worker.INFLIGHT_KEY_PREFIX + 'key') <= worker.KEY_TIMEOUT)
+        self.assertTrue(0 < self.conn.ttl(worker.WAITERS_KEY_PREFIX + job_id) <= worker.KEY_TIMEOUT)
@@ -3,4 +3,5 @@ import views
 
 urlpatterns = [
     url(r'^lichessapi/(?P<path>.+)$', views.lichess_api_call, name='lichess_api_call'),
+    url(r'^status/$', views.queue_status, name='queue_status'),
 ]
@@ -1,37 +1,92 @@
+import hashlib
+import json
+import logging
+import ratelimit
 import requests
-import time
 import worker
-from django.core.cache import cache
-from django.http.response import HttpResponse
+from heltour import settings
+from heltour.tournament import httpclient
+from django.http.response import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.utils.crypto import get_random_string
+from django_redis import get_redis_connection
 
-def _do_lichess_api_call(redis_key, path, params, priority, max_retries, retry_count=0):
-    url = "https://en.lichess.org/%s" % path
-    r = requests.get(url, params)
+def _push_results(redis_keys, result):
+    # Each client is blocked popping from its list, so it gets the result as soon as it's pushed. The lists expire in
+    # case the client has given up.
+    pipe = get_redis_connection('default').pipeline()
+    for redis_key in redis_keys:
+        pipe.rpush(redis_key, result)
+        pipe.expire(redis_key, 60)
+    pipe.execute()
 
-    if r.status_code == 200:
+logger = logging.getLogger(__name__)
+
+# Shared by every worker thread and process
+_rate_limiter = ratelimit.TokenBucket('lichessapi:ratelimit')
+
+def _do_lichess_api_call(job_id, job, attempts):
+    if attempts > job['max_retries'] + 1:
+        # Every previous claim expired without the job being completed or retried
+        _push_results(worker.complete_work(job_id, job), '')
+        return
+
+    # The worker has already waited for the rate limiter
+    url = "https://en.lichess.org/%s" % job['path']
+    try:
+        r = httpclient.session('lichess').request(job.get('method', 'GET'), url, params=job['params'], data=job.get('data'),
+                                                  headers={'Accept': job.get('accept') or '*/*'})
+    except requests.RequestException as e:
+        logger.warning('Error calling %s: %s' % (url, e))
+        r = None
+
+    if r is not None and r.status_code == 200:
         # Success
-        cache.set(redis_key, r.text, timeout=60)
-        time.sleep(2)
+        _rate_limiter.success()
+        if settings.LICHESS_API_CACHE_TIMEOUT:
+            get_redis_connection('default').set(_response_cache_key(job['dedupe_key']), r.text, ex=settings.LICHESS_API_CACHE_TIMEOUT)
+        _push_results(worker.complete_work(job_id, job), r.text)
         return
 
+    if r is not None and r.status_code == 429:
+        # Too many requests
+        _rate_limiter.throttled(ratelimit.retry_after(r))
+
     # Failure
-    if retry_count >= max_retries:
-        cache.set(redis_key, '', timeout=60)
+    if attempts > job['max_retries']:
+        _push_results(worker.complete_work(job_id, job), '')
     else:
         # Retry
-        worker.queue_work(priority, _do_lichess_api_call, redis_key, path, params, priority, max_retries, retry_count + 1)
-
-    if r.status_code == 429:
-        # Too many requests
-        time.sleep(60)
-    else:
-        time.sleep(2)
+        worker.requeue_work(job_id, job)
 
+# Only called by other heltour processes. POST requests forward their body (e.g. the usernames for a bulk lookup), and
+# the Accept header is forwarded to select the response format of endpoints that have several.
+@csrf_exempt
 def lichess_api_call(request, path):
     params = request.GET.dict()
     priority = int(params.pop('priority', 0))
     max_retries = int(params.pop('max_retries', 3))
-    redis_key = get_random_string(length=16)
-    worker.queue_work(priority, _do_lichess_api_call, redis_key, path, params, priority, max_retries)
+    data = request.body if request.method == 'POST' else None
+    accept = request.META.get('HTTP_ACCEPT')
+    redis_key = 'lichessapi:result:%s' % get_random_string(length=16)
+
+    # Identical requests share the same lichess call and cached response
+    request_key = hashlib.sha1(json.dumps([request.method, path, sorted(params.items()), data, accept])).hexdigest()
+    if settings.LICHESS_API_CACHE_TIMEOUT:
+        cached = get_redis_connection('default').get(_response_cache_key(request_key))
+        if cached is not None:
+            _push_results([redis_key], cached)
+            return HttpResponse(redis_key)
+    job = {'method': request.method, 'path': path, 'params': params, 'data': data, 'accept': accept, 'max_retries': max_retries}
+    worker.queue_work(priority, job, dedupe_key=request_key, waiter=redis_key)
     return HttpResponse(redis_key)
+
+def _response_cache_key(request_key):
+    return 'lichessapi:response:%s' % request_key
+
+def queue_status(request):
+    return JsonResponse(dict(worker.queue_stats(), rate=_rate_limiter.rate()))
+
+if settings.HELTOUR_APP == 'api_worker':
+    # Only the API worker process runs jobs, not e.g. tests that import this module
+    worker.start(_do_lichess_api_call, _rate_limiter)
@@ -1,15 +1,215 @@
-import Queue
+import json
+import logging
 import threading
+import time
 
-def _run_worker():
-    while True:
-        _, fn, args = _work_queue.get()
-        fn(*args)
+from django.utils.crypto import get_random_string
+from django_redis import get_redis_connection
+
+from heltour import settings
+
+logger = logging.getLogger(__name__)
+
+# Pending work is kept in redis so that it survives restarts and can be shared by several worker processes:
+# - QUEUE_KEY is a sorted set of job ids, ordered by priority and then by the time they were queued
+# - PROCESSING_KEY is a sorted set of the job ids that have been claimed, scored by when their claim expires
+# - JOBS_KEY, SCORES_KEY and ATTEMPTS_KEY are hashes of each job's JSON, its score in QUEUE_KEY (which is where it's
+#   put back if its claim expires) and the number of times it has been claimed
+# - INFLIGHT_KEY_PREFIX + a dedupe key is the id of the queued or claimed job with that key
+# - WAITERS_KEY_PREFIX + a job id is a list of the waiters (e.g. result keys) to give the job's result to
+# A job is removed when it's completed. If a worker dies or hangs before completing it, the claim expires and the job
+# is queued again. The dedupe keys and waiter lists also expire after KEY_TIMEOUT seconds (refreshed when a request
+# joins the job), so they can't pile up if a job is lost.
+QUEUE_KEY = 'lichessapi:queue'
+PROCESSING_KEY = 'lichessapi:processing'
+JOBS_KEY = 'lichessapi:jobs'
+ATTEMPTS_KEY = 'lichessapi:attempts'
+SCORES_KEY = 'lichessapi:scores'
+INFLIGHT_KEY_PREFIX = 'lichessapi:inflight:'
+WAITERS_KEY_PREFIX = 'lichessapi:waiters:'
+KEY_TIMEOUT = 3600
+# Pushed to when work is queued so that idle workers don't have to poll
+WAKE_KEY = 'lichessapi:wake'
+
+# Joins the queued or claimed job with the same dedupe key if there is one, moving it up the queue if the new
+# request has a higher priority. Otherwise queues a new job.
+_QUEUE_SCRIPT = '''
+local job_id, job, score, dedupe_key, waiter = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4], ARGV[5]
+local waiters_prefix, inflight_key, key_timeout = ARGV[6], ARGV[7] .. dedupe_key, ARGV[8]
+if dedupe_key ~= '' then
+    local existing_id = redis.call('GET', inflight_key)
+    if existing_id and redis.call('HEXISTS', KEYS[2], existing_id) == 1 then
+        redis.call('EXPIRE', inflight_key, key_timeout)
+        if waiter ~= '' then
+            redis.call('RPUSH', waiters_prefix .. existing_id, waiter)
+            redis.call('EXPIRE', waiters_prefix .. existing_id, key_timeout)
+        end
+        local current_score = redis.call('HGET', KEYS[5], existing_id)
+        if current_score and tonumber(current_score) > score then
+            redis.call('HSET', KEYS[5], existing_id, score)
+            if redis.call('ZSCORE', KEYS[1], existing_id) then
+                redis.call('ZADD', KEYS[1], score, existing_id)
+            end
+        end
+        return existing_id
+    end
+    redis.call('SET', inflight_key, job_id, 'EX', key_timeout)
+end
+redis.call('HSET', KEYS[2], job_id, job)
+redis.call('HSET', KEYS[5], job_id, score)
+redis.call('ZADD', KEYS[1], score, job_id)
+if waiter ~= '' then
+    redis.call('RPUSH', waiters_prefix .. job_id, waiter)
+    redis.call('EXPIRE', waiters_prefix .. job_id, key_timeout)
+end
+redis.call('LPUSH', KEYS[4], 1)
+redis.call('LTRIM', KEYS[4], 0, 99)
+return job_id
+'''
+
+# Removes a job and returns its waiters. This is atomic with _QUEUE_SCRIPT, so every waiter that joins the job is
+# returned here.
+_COMPLETE_SCRIPT = '''
+local job_id, dedupe_key = ARGV[1], ARGV[2]
+redis.call('ZREM', KEYS[1], job_id)
+redis.call('HDEL', KEYS[2], job_id)
+redis.call('HDEL', KEYS[3], job_id)
+redis.call('HDEL', KEYS[4], job_id)
+local inflight_key = ARGV[4] .. dedupe_key
+if dedupe_key ~= '' and redis.call('GET', inflight_key) == job_id then
+    redis.call('DEL', inflight_key)
+end
+local waiters_key = ARGV[3] .. job_id
+local waiters = redis.call('LRANGE', waiters_key, 0, -1)
+redis.call('DEL', waiters_key)
+return waiters
+'''
+
+_CLAIM_SCRIPT = '''
+local now, claim_expiry = ARGV[1], ARGV[2]
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], id)
+    local score = redis.call('HGET', KEYS[5], id)
+    if score then
+        redis.call('ZADD', KEYS[1], score, id)
+    end
+end
+local ids = redis.call('ZRANGE', KEYS[1], 0, 0)
+if #ids == 0 then
+    return false
+end
+local id = ids[1]
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], claim_expiry, id)
+local attempts = redis.call('HINCRBY', KEYS[4], id, 1)
+return {id, redis.call('HGET', KEYS[3], id), attempts}
+'''
+
+_lock = threading.Lock()
+_worker_threads = []
+_scripts = {}
+
+def _script(source):
+    # Scripts are registered once per process and sent by hash after the first call
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = get_redis_connection('default').register_script(source)
+    return script
+
+def queue_work(priority, job, dedupe_key=None, waiter=None):
+    '''Adds a job (a JSON-serializable dict) to the queue, with higher priorities processed first
 
-_work_queue = Queue.PriorityQueue()
-_worker_thread = threading.Thread(target=_run_worker)
-_worker_thread.daemon = True
-_worker_thread.start()
+    If a job with the same dedupe_key is already queued or being processed, no new job is queued and the waiter is
+    added to the existing job instead. complete_work returns the waiters of a job.
+
+    Returns the job id.
+    '''
+    # Scores are ordered by priority and then by time, in milliseconds (well within a double's exact range)
+    score = -priority * 10 ** 13 + int(time.time() * 1000)
+    job = dict(job, score=score, dedupe_key=dedupe_key or '')
+    return _script(_QUEUE_SCRIPT)(keys=[QUEUE_KEY, JOBS_KEY, ATTEMPTS_KEY, WAKE_KEY, SCORES_KEY],
+                                  args=[get_random_string(length=16), json.dumps(job), score, dedupe_key or '', waiter or '',
+                                        WAITERS_KEY_PREFIX, INFLIGHT_KEY_PREFIX, KEY_TIMEOUT])
+
+def requeue_work(job_id, job):
+    '''Puts a claimed job back in the queue at its position, e.g. to retry it'''
+    conn = get_redis_connection('default')
+    # The score is raised if a request with a higher priority joined the job
+    score = conn.hget(SCORES_KEY, job_id) or job['score']
+    pipe = conn.pipeline()
+    pipe.zrem(PROCESSING_KEY, job_id)
+    pipe.zadd(QUEUE_KEY, **{job_id: float(score)})
+    pipe.lpush(WAKE_KEY, 1)
+    pipe.ltrim(WAKE_KEY, 0, 99)
+    pipe.execute()
+
+def complete_work(job_id, job=None):
+    '''Removes a claimed job
+
+    Returns the list of waiters given to queue_work for the job.
+    '''
+    dedupe_key = job.get('dedupe_key', '') if job is not None else ''
+    return _script(_COMPLETE_SCRIPT)(keys=[PROCESSING_KEY, JOBS_KEY, ATTEMPTS_KEY, SCORES_KEY],
+                                     args=[job_id, dedupe_key, WAITERS_KEY_PREFIX, INFLIGHT_KEY_PREFIX])
+
+def queue_stats():
+    conn = get_redis_connection('default')
+    return {
+        'queued': conn.zcard(QUEUE_KEY),
+        'processing': conn.zcard(PROCESSING_KEY),
+    }
+
+def start(handler, rate_limiter=None):
+    '''Starts API_WORKER_THREADS threads that claim jobs and pass them to handler(job_id, job, attempts)
+
+    The handler must call complete_work or requeue_work for the job. attempts is the number of times the job has
+    been claimed, including retries and claims that expired. If a rate limiter is given, each thread waits in
+    rate_limiter.acquire() before claiming a job, so that waiting doesn't count towards the claim's timeout, and
+    calls rate_limiter.release() if there turns out to be no job to pass to the handler.
+    '''
+    with _lock:
+        if _worker_threads:
+            return
+        for _ in range(settings.API_WORKER_THREADS):
+            thread = threading.Thread(target=_run_worker, args=(handler, rate_limiter))
+            thread.daemon = True
+            thread.start()
+            _worker_threads.append(thread)
+
+def _claim_work():
+    # Returns (job id, job JSON, attempts) for the next job, or None if there's none (e.g. another thread claimed it
+    # first). The job JSON is None if the job was removed while its claim was expiring.
+    now = time.time()
+    return _script(_CLAIM_SCRIPT)(keys=[QUEUE_KEY, PROCESSING_KEY, JOBS_KEY, ATTEMPTS_KEY, SCORES_KEY],
+                                  args=[now, now + settings.API_WORKER_VISIBILITY_TIMEOUT])
+
+def _run_worker(handler, rate_limiter):
+    conn = get_redis_connection('default')
+    while True:
+        try:
+            if conn.zcard(QUEUE_KEY) == 0 and conn.zcount(PROCESSING_KEY, '-inf', time.time()) == 0:
+                # Wait until work is queued, checking for expired claims every few seconds
+                conn.blpop(WAKE_KEY, 5)
+                continue
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            claimed = _claim_work()
+            if claimed is None:
+                # Another thread claimed the job first
+                _release(rate_limiter)
+                continue
+            job_id, job, attempts = claimed
+            if job is None:
+                complete_work(job_id)
+                _release(rate_limiter)
+                continue
+            handler(job_id, json.loads(job), attempts)
+        except Exception:
+            # The job's claim will expire and it will be retried
+            logger.exception('Error processing API worker job')
+            time.sleep(1)
 
-def queue_work(priority, fn, *args):
-    _work_queue.put((-priority, fn, args))
+def _release(rate_limiter):
+    # The token wasn't used for a request, so another thread can use it
+    if rate_limiter is not None:
+        rate_limiter.release()
@@ -65,6 +65,26 @@ INSTALLED_APPS = [
 COMMENTS_APP = 'heltour.comments'
 
 API_WORKER_HOST = 'http://localhost:8780'
+# Seconds before a job claimed by an API worker is retried if the worker hasn't finished it
+API_WORKER_VISIBILITY_TIMEOUT = 120
+# Threads per API worker process. Requests to lichess are limited by the rate settings below, not the thread count.
+API_WORKER_THREADS = 4
+# Requests per second to lichess, shared by all API worker processes. The rate starts at LICHESS_API_RATE, increases
+# by LICHESS_API_RATE_INCREASE with each successful request and halves with each 429 response.
+LICHESS_API_RATE = 0.5
+LICHESS_API_MIN_RATE = 0.05
+LICHESS_API_MAX_RATE = 2.0
+LICHESS_API_RATE_INCREASE = 0.01
+LICHESS_API_BURST = 2
+# Seconds to pause all requests after a 429 response without a Retry-After header (lichess asks for a minute)
+LICHESS_API_THROTTLE_PAUSE = 60
+# Seconds to reuse successful lichess responses for identical requests (0 to disable)
+LICHESS_API_CACHE_TIMEOUT = 10
+
+# Outgoing HTTP requests (lichess, slack and the API worker)
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+HTTP_MAX_CONNECTIONS_PER_HOST = 10
 
 MIDDLEWARE_CLASSES = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -159,10 +179,16 @@ DEFAULT_FROM_EMAIL = 'noreply@lichess4545.com'
 
 BROKER_URL = 'redis://localhost:6379/2'
 
+# Ratings are refreshed in small batches every RATING_UPDATE_INTERVAL. Players in seasons that aren't completed (and
+# their alternates) are refreshed every RATING_UPDATE_ACTIVE_AGE, and everyone else every RATING_UPDATE_DORMANT_AGE.
+RATING_UPDATE_INTERVAL = timedelta(minutes=5)
+RATING_UPDATE_ACTIVE_AGE = timedelta(minutes=30)
+RATING_UPDATE_DORMANT_AGE = timedelta(days=7)
+
 CELERYBEAT_SCHEDULE = {
 #     'update-ratings': {
 #         'task': 'heltour.tournament.tasks.update_player_ratings',
-#         'schedule': timedelta(minutes=30),
+#         'schedule': RATING_UPDATE_INTERVAL,
 #         'args': ()
 #     },
     'update-tv-state': {
@@ -238,12 +264,25 @@ CACHEOPS = {
 GOOGLE_SERVICE_ACCOUNT_KEYFILE_PATH = '/etc/heltour/gspread.conf'
 SLACK_API_TOKEN_FILE_PATH = '/etc/heltour/slack-token.conf'
 JAVAFO_COMMAND = 'java -jar /etc/heltour/javafo.jar'
+# Optional Nailgun server that keeps a JVM with javafo.jar warm between pairing runs, e.g.
+# 'java -cp /etc/heltour/nailgun-server.jar:/etc/heltour/javafo.jar com.facebook.nailgun.NGServer 127.0.0.1:2114'
+# When unset or unreachable, JAVAFO_COMMAND is run in a new process for each pairing
+JAVAFO_DAEMON_COMMAND = None
+JAVAFO_DAEMON_ADDRESS = ('127.0.0.1', 2114)
+JAVAFO_DAEMON_MAIN_CLASS = 'javafo.JaVaFo'
+JAVAFO_DAEMON_STARTUP_TIMEOUT = 10
+# The pairing engine used for swiss leagues: 'javafo', 'python' (in-process, doesn't need Java) or 'search' (runs
+# JaVaFo and the python engine at once and picks the best result found within PAIRING_SEARCH_DEADLINE seconds)
+PAIRING_ENGINE = 'javafo'
+PAIRING_SEARCH_DEADLINE = 60
 
 # Testing overrides
 import sys
 TESTING = 'test' in sys.argv
 if TESTING:
     CACHEOPS = {}
+    CELERY_ALWAYS_EAGER = True
+    CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
 
 # Host-based settings overrides.
 import platform
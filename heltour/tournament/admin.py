@@ -1,6 +1,6 @@
 from django.contrib import admin, messages
 from django.utils import timezone
-from heltour.tournament import lichessapi, slackapi, views, forms
+from heltour.tournament import lichessapi, slackapi, views, forms, tasks, simulation
 from heltour.tournament.models import *
 from reversion.admin import VersionAdmin
 from django.conf.urls import url
@@ -20,7 +20,7 @@ from datetime import timedelta
 from django_comments.models import Comment
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, JsonResponse
 from django.utils.http import urlquote
 
 # Customize which sections are visible
@@ -92,7 +92,8 @@ class SeasonAdmin(VersionAdmin):
     list_display = ('__unicode__', 'league',)
     list_display_links = ('__unicode__',)
     list_filter = ('league',)
-    actions = ['update_board_order_by_rating', 'recalculate_scores', 'verify_data', 'review_nominated_games', 'manage_players', 'round_transition']
+    actions = ['update_board_order_by_rating', 'recalculate_scores', 'verify_data', 'review_nominated_games', 'manage_players', 'round_transition',
+               'simulate_pairings']
     change_form_template = 'tournament/admin/change_form_with_comments.html'
 
     def get_urls(self):
@@ -107,6 +108,9 @@ class SeasonAdmin(VersionAdmin):
             url(r'^(?P<object_id>[0-9]+)/round_transition/$',
                 permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.round_transition_view)),
                 name='round_transition'),
+            url(r'^(?P<object_id>[0-9]+)/simulate_pairings/$',
+                permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.simulate_pairings_view)),
+                name='simulate_pairings'),
             url(r'^(?P<object_id>[0-9]+)/review_nominated_games/$',
                 permission_required('tournament.review_nominated_games')(self.admin_site.admin_view(self.review_nominated_games_view)),
                 name='review_nominated_games'),
@@ -298,6 +302,47 @@ class SeasonAdmin(VersionAdmin):
 
         return render(request, 'tournament/admin/round_transition.html', context)
 
+    def simulate_pairings(self, request, queryset):
+        if queryset.count() > 1:
+            self.message_user(request, 'Pairings can only be simulated one season at a time.', messages.ERROR)
+            return
+        if queryset[0].league.competitor_type == 'team':
+            self.message_user(request, 'Pairings can only be simulated for lone seasons.', messages.ERROR)
+            return
+        return redirect('admin:simulate_pairings', object_id=queryset[0].pk)
+
+    def simulate_pairings_view(self, request, object_id):
+        season = get_object_or_404(Season, pk=object_id)
+        if season.league.competitor_type == 'team':
+            self.message_user(request, 'Pairings can only be simulated for lone seasons.', messages.ERROR)
+            return redirect('admin:tournament_season_changelist')
+
+        # Simulating doesn't change anything, so the form is submitted with GET and results can be linked to
+        remaining_rounds = max(season.round_set.filter(is_completed=False).count(), 1)
+        engine_names = sorted(pairinggen.PAIRING_ENGINES)
+        if 'round_count' in request.GET:
+            form = forms.SimulatePairingsForm(remaining_rounds, simulation.SIMULATED_RESULT_OPTIONS, engine_names, request.GET)
+        else:
+            form = forms.SimulatePairingsForm(remaining_rounds, simulation.SIMULATED_RESULT_OPTIONS, engine_names)
+
+        simulated_rounds = None
+        if form.is_bound and form.is_valid():
+            engine_class = pairinggen.get_pairing_engine_class(form.cleaned_data['engine'] or None)
+            simulated_rounds = simulation.SeasonSimulation(season).run(form.cleaned_data['round_count'], form.cleaned_data['result_mode'],
+                                                                       apply_changes=form.cleaned_data['apply_changes'], engine_class=engine_class)
+
+        context = {
+            'has_permission': True,
+            'opts': self.model._meta,
+            'site_url': '/',
+            'original': season,
+            'title': 'Simulate pairings',
+            'form': form,
+            'simulated_rounds': simulated_rounds,
+        }
+
+        return render(request, 'tournament/admin/simulate_pairings.html', context)
+
     def _time_from_now(self, delta):
         if delta.days > 0:
             if delta.days == 1:
@@ -595,6 +640,18 @@ class RoundAdmin(VersionAdmin):
             url(r'^(?P<object_id>[0-9]+)/review_pairings/$',
                 permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.review_pairings_view)),
                 name='review_pairings'),
+            url(r'^(?P<object_id>[0-9]+)/export_trf/$',
+                permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.export_trf_view)),
+                name='export_trf'),
+            url(r'^(?P<object_id>[0-9]+)/pairing_job/(?P<job_id>[0-9]+)/$',
+                permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.pairing_job_view)),
+                name='pairing_job'),
+            url(r'^(?P<object_id>[0-9]+)/pairing_job/(?P<job_id>[0-9]+)/status/$',
+                permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.pairing_job_status_view)),
+                name='pairing_job_status'),
+            url(r'^(?P<object_id>[0-9]+)/pairing_cache/$',
+                permission_required('tournament.generate_pairings')(self.admin_site.admin_view(self.pairing_cache_view)),
+                name='pairing_cache'),
         ]
         return my_urls + urls
 
@@ -610,20 +667,22 @@ class RoundAdmin(VersionAdmin):
         if request.method == 'POST':
             form = forms.GeneratePairingsForm(request.POST)
             if form.is_valid():
-                try:
-                    pairinggen.generate_pairings(round_, overwrite=form.cleaned_data['overwrite_existing'])
-                    round_.publish_pairings = False
-                    round_.save()
-                    self.message_user(request, 'Pairings generated.', messages.INFO)
-                    return redirect('admin:review_pairings', object_id)
-                except pairinggen.PairingsExistException:
+                overwrite = form.cleaned_data['overwrite_existing']
+                fail_stale_pairing_jobs(round_)
+                active_job = PairingJob.objects.filter(round=round_, status__in=('queued', 'running')).nocache().first()
+                if active_job is not None:
+                    self.message_user(request, 'Pairings are already being generated for the selected round.', messages.WARNING)
+                    return redirect('admin:pairing_job', object_id, active_job.pk)
+                if not overwrite and (round_.teampairing_set.exists() or round_.loneplayerpairing_set.exists()):
                     if not round_.publish_pairings:
                         self.message_user(request, 'Unpublished pairings already exist.', messages.WARNING)
                         return redirect('admin:review_pairings', object_id)
                     self.message_user(request, 'Pairings already exist for the selected round.', messages.ERROR)
-                except pairinggen.PairingHasResultException:
-                    self.message_user(request, 'Pairings with results can\'t be overwritten.', messages.ERROR)
-                return redirect('admin:generate_pairings', object_id=round_.pk)
+                    return redirect('admin:generate_pairings', object_id=round_.pk)
+                # Run in the background since JaVaFo can take longer than the web server's request timeout
+                job = PairingJob.objects.create(round=round_, overwrite=overwrite)
+                tasks.run_pairing_job.apply_async(args=[job.pk])
+                return redirect('admin:pairing_job', object_id, job.pk)
         else:
             form = forms.GeneratePairingsForm()
 
@@ -638,6 +697,66 @@ class RoundAdmin(VersionAdmin):
 
         return render(request, 'tournament/admin/generate_pairings.html', context)
 
+    def pairing_job_view(self, request, object_id, job_id):
+        round_ = get_object_or_404(Round, pk=object_id)
+        job = get_object_or_404(PairingJob.objects.nocache(), pk=job_id, round=round_)
+
+        if request.method == 'POST' and 'cancel' in request.POST:
+            # Jobs that haven't started yet are cancelled immediately; running jobs stop at their next check. Orphaned
+            # jobs will never check, so they're failed instead.
+            if fail_stale_pairing_jobs(round_) > 0 and job.is_stale():
+                self.message_user(request, 'The job had stopped responding and has been marked as failed.', messages.INFO)
+                return redirect('admin:pairing_job', object_id, job.pk)
+            if PairingJob.objects.filter(pk=job.pk, status='queued').update(status='cancelled', finished=timezone.now()) == 0:
+                PairingJob.objects.filter(pk=job.pk).update(cancel_requested=True)
+            self.message_user(request, 'Cancellation requested.', messages.INFO)
+            return redirect('admin:pairing_job', object_id, job.pk)
+
+        context = {
+            'has_permission': True,
+            'opts': self.model._meta,
+            'site_url': '/',
+            'original': round_,
+            'title': 'Generating pairings',
+            'job': job,
+        }
+        return render(request, 'tournament/admin/pairing_job.html', context)
+
+    def pairing_job_status_view(self, request, object_id, job_id):
+        job = get_object_or_404(PairingJob.objects.nocache(), pk=job_id, round_id=object_id)
+        return JsonResponse({
+            'status': job.status,
+            'status_display': job.get_status_display(),
+            'elapsed_seconds': job.elapsed_seconds(),
+            'engine': job.engine,
+            'error': job.error,
+            'cancel_requested': job.cancel_requested,
+        })
+
+    def pairing_cache_view(self, request, object_id):
+        round_ = get_object_or_404(Round, pk=object_id)
+
+        if request.method == 'POST' and 'purge' in request.POST:
+            PairingCacheEntry.objects.filter(round=round_).delete()
+            self.message_user(request, 'Pairing cache purged.', messages.INFO)
+            return redirect('admin:pairing_cache', object_id)
+
+        context = {
+            'has_permission': True,
+            'opts': self.model._meta,
+            'site_url': '/',
+            'original': round_,
+            'title': 'Pairing cache',
+            'entries': PairingCacheEntry.objects.filter(round=round_).order_by('-date_created').nocache(),
+        }
+        return render(request, 'tournament/admin/pairing_cache.html', context)
+
+    def export_trf_view(self, request, object_id):
+        round_ = get_object_or_404(Round, pk=object_id)
+        response = HttpResponse(pairinggen.export_trf(round_), content_type='text/plain')
+        response['Content-Disposition'] = 'attachment; filename="%s-%s-round-%d.trfx"' % (round_.season.league.tag, round_.season.tag, round_.number)
+        return response
+
     def review_pairings_view(self, request, object_id):
         round_ = get_object_or_404(Round, pk=object_id)
 
@@ -741,6 +860,21 @@ class RoundAdmin(VersionAdmin):
             return render(request, 'tournament/admin/review_lone_pairings.html', context)
 
 
+#-------------------------------------------------------------------------------
+@admin.register(PairingJob)
+class PairingJobAdmin(VersionAdmin):
+    list_display = ('__unicode__', 'status', 'engine', 'started', 'finished')
+    list_filter = ('status', 'round__season')
+    raw_id_fields = ('round',)
+
+#-------------------------------------------------------------------------------
+@admin.register(PairingCacheEntry)
+class PairingCacheEntryAdmin(VersionAdmin):
+    list_display = ('__unicode__', 'round', 'flags', 'hit_count', 'last_hit', 'date_created')
+    list_filter = ('engine', 'round__season')
+    search_fields = ('key',)
+    raw_id_fields = ('round',)
+
 #-------------------------------------------------------------------------------
 @admin.register(PlayerLateRegistration)
 class PlayerLateRegistrationAdmin(VersionAdmin):
@@ -782,6 +916,7 @@ class PlayerAdmin(VersionAdmin):
             rating, games_played = lichessapi.get_user_classical_rating_and_games_played(player.lichess_username, priority=1)
             player.rating = rating
             player.games_played = games_played
+            player.rating_updated = timezone.now()
             player.save()
         self.message_user(request, 'Rating(s) updated', messages.INFO)
 #         except:
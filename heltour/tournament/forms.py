@@ -4,6 +4,7 @@ from captcha.fields import ReCaptchaField
 
 from .models import *
 from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator
 from heltour import settings
 import captcha
 
@@ -149,6 +150,19 @@ class RoundTransitionForm(forms.Form):
             self.fields['generate_pairings'] = forms.BooleanField(initial=True, required=False, label='Generate pairings for round %d' % round_to_open.number)
             self.fields['round_to_open'] = forms.IntegerField(initial=round_to_open.number, widget=forms.HiddenInput)
 
+class SimulatePairingsForm(forms.Form):
+    round_count = forms.IntegerField(min_value=1, initial=1, label='Rounds to simulate')
+    result_mode = forms.ChoiceField(choices=(), label='Results')
+    engine = forms.ChoiceField(choices=(), required=False)
+    apply_changes = forms.BooleanField(initial=True, required=False, label='Perform late registrations and withdrawls')
+
+    def __init__(self, remaining_rounds, result_options, engine_names, *args, **kwargs):
+        super(SimulatePairingsForm, self).__init__(*args, **kwargs)
+        self.fields['round_count'].max_value = remaining_rounds
+        self.fields['round_count'].validators.append(MaxValueValidator(remaining_rounds))
+        self.fields['result_mode'].choices = result_options
+        self.fields['engine'].choices = [('', 'Default')] + [(name, name) for name in engine_names]
+
 class NominateForm(forms.Form):
     game_link = forms.URLField(required=False)
 
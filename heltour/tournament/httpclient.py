@@ -0,0 +1,39 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from heltour import settings
+
+# Sessions are per process, since connections opened before a fork (e.g. in the celery or gunicorn master) can't be
+# shared with the children
+_lock = threading.Lock()
+_sessions = {}
+
+class PooledSession(requests.Session):
+    '''A requests.Session that keeps connections alive and applies the default timeouts
+
+    At most HTTP_MAX_CONNECTIONS_PER_HOST connections are opened to each host. Further requests from other threads wait
+    for a free connection.
+    '''
+    def __init__(self):
+        super(PooledSession, self).__init__()
+        adapter = HTTPAdapter(pool_maxsize=settings.HTTP_MAX_CONNECTIONS_PER_HOST, pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+        return super(PooledSession, self).request(*args, **kwargs)
+
+def session(name):
+    '''Returns this process's shared session with the given name (e.g. the API it's used for)'''
+    key = (name, os.getpid())
+    s = _sessions.get(key)
+    if s is None:
+        with _lock:
+            s = _sessions.get(key)
+            if s is None:
+                s = _sessions[key] = PooledSession()
+    return s
@@ -0,0 +1,143 @@
+import atexit
+import os
+import shlex
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from heltour import settings
+
+# Keeps a JVM running javafo.jar warm between pairing runs. The daemon is a Nailgun server
+# (https://github.com/facebook/nailgun) with javafo.jar on its classpath, so each run is a request
+# over a local socket instead of a full JVM start-up. The server process is started on demand by
+# whichever process needs it first and shared by every process that can reach its address.
+
+_CHUNK_HEADER = struct.Struct('>iB')
+
+_lock = threading.Lock()
+_proc = None
+
+def is_enabled():
+    return bool(getattr(settings, 'JAVAFO_DAEMON_COMMAND', None))
+
+def run(args, cwd=None, is_cancelled=None):
+    '''Runs JaVaFo in the daemon with the given command-line arguments
+
+    Returns (exit code, stdout), or None if is_cancelled returned True before the run finished.
+    Raises JavafoDaemonError if the daemon can't be reached or started.
+    '''
+    sock = _connect()
+    try:
+        return NailgunConnection(sock).call(settings.JAVAFO_DAEMON_MAIN_CLASS, args, cwd or os.getcwd(), is_cancelled)
+    except (socket.error, struct.error) as e:
+        raise JavafoDaemonError('Lost connection to the JaVaFo daemon: %s' % e)
+    finally:
+        sock.close()
+
+def _connect():
+    try:
+        return socket.create_connection(settings.JAVAFO_DAEMON_ADDRESS, timeout=1)
+    except socket.error:
+        pass
+    with _lock:
+        _start()
+        deadline = time.time() + settings.JAVAFO_DAEMON_STARTUP_TIMEOUT
+        while True:
+            try:
+                return socket.create_connection(settings.JAVAFO_DAEMON_ADDRESS, timeout=1)
+            except socket.error as e:
+                if _proc.poll() is not None:
+                    raise JavafoDaemonError('JaVaFo daemon exited with code %s' % _proc.returncode)
+                if time.time() >= deadline:
+                    raise JavafoDaemonError('Timeout connecting to the JaVaFo daemon: %s' % e)
+                time.sleep(0.1)
+
+def _start():
+    global _proc
+    if _proc is not None and _proc.poll() is None:
+        # Already started by this process and still booting
+        return
+    try:
+        with open(os.devnull, 'w') as devnull:
+            _proc = subprocess.Popen(shlex.split(settings.JAVAFO_DAEMON_COMMAND), stdout=devnull, stderr=devnull, close_fds=True)
+    except OSError as e:
+        raise JavafoDaemonError('Could not start the JaVaFo daemon: %s' % e)
+    atexit.register(_stop, _proc, os.getpid())
+
+def _stop(proc, owner_pid):
+    # Forked children (e.g. celery workers) inherit the atexit handler but don't own the daemon
+    if os.getpid() == owner_pid and proc.poll() is None:
+        proc.terminate()
+
+class NailgunConnection:
+    '''Speaks the Nailgun client protocol over a connected socket
+
+    Arguments:
+    sock -- a socket connected to a Nailgun server
+    heartbeat_interval -- seconds between heartbeats while waiting for the command to finish
+    '''
+    def __init__(self, sock, heartbeat_interval=1.0):
+        self.sock = sock
+        self.heartbeat_interval = heartbeat_interval
+
+    '''Runs a command on the server
+
+    Returns (exit code, stdout), or None if is_cancelled returned True before the command finished. The server
+    stops the command when the connection is closed.
+    '''
+    def call(self, command, args, cwd, is_cancelled=None):
+        for arg in args:
+            self._send_chunk('A', arg)
+        self._send_chunk('D', cwd)
+        self._send_chunk('C', command)
+
+        stdout = []
+        self.sock.settimeout(self.heartbeat_interval)
+        while True:
+            try:
+                chunk_type, payload = self._read_chunk()
+            except socket.timeout:
+                if is_cancelled is not None and is_cancelled():
+                    return None
+                # Newer servers stop commands whose clients go quiet
+                self._send_chunk('H', '')
+                continue
+            if chunk_type == '1':
+                stdout.append(payload)
+            elif chunk_type == 'S':
+                # JaVaFo doesn't read stdin
+                self._send_chunk('.', '')
+            elif chunk_type == 'X':
+                return int(payload.strip()), ''.join(stdout)
+
+    def _send_chunk(self, chunk_type, payload):
+        self.sock.sendall(_CHUNK_HEADER.pack(len(payload), ord(chunk_type)) + payload)
+
+    def _read_chunk(self):
+        header = self._read_exactly(_CHUNK_HEADER.size)
+        length, chunk_type = _CHUNK_HEADER.unpack(header)
+        # Once the header has arrived, wait for the rest of the chunk rather than heartbeating mid-chunk
+        self.sock.settimeout(None)
+        try:
+            return chr(chunk_type), self._read_exactly(length)
+        finally:
+            self.sock.settimeout(self.heartbeat_interval)
+
+    def _read_exactly(self, length):
+        data = ''
+        while len(data) < length:
+            try:
+                received = self.sock.recv(length - len(data))
+            except socket.timeout:
+                if data:
+                    continue
+                raise
+            if not received:
+                raise socket.error('Connection closed by the Nailgun server')
+            data += received
+        return data
+
+class JavafoDaemonError(Exception):
+    pass
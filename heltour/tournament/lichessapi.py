@@ -1,31 +1,36 @@
-import requests
-import time
 import json
 from django.core.cache import cache
+from django_redis import get_redis_connection
 
 from heltour import settings
+from heltour.tournament import httpclient
 
-def _apicall(url, check_interval=0.1, timeout=120):
-    # Make a request to the local API worker to put the result of a lichess API call into the redis cache
-    r = requests.get(url)
+# The most users or games lichess returns from one bulk lookup
+_USERS_PER_REQUEST = 300
+_GAMES_PER_REQUEST = 300
+
+def _apicall(url, timeout=120, data=None):
+    return _wait_for_result(_queue_apicall(url, data), url, timeout)
+
+def _queue_apicall(url, data=None, accept=None):
+    # Make a request to the local API worker to push the result of a lichess API call onto a redis list. Returns
+    # the key of the list, which may not exist yet.
+    method = 'GET' if data is None else 'POST'
+    headers = {'Accept': accept} if accept is not None else None
+    r = httpclient.session('apiworker').request(method, url, data=data, headers=headers)
     if r.status_code != 200:
         # Retry once
-        r = requests.get(url)
+        r = httpclient.session('apiworker').request(method, url, data=data, headers=headers)
         if r.status_code != 200:
             raise ApiWorkerError('API worker returned HTTP %s for %s' % (r.status_code, url))
-    # This is the key we'll use to obtain the result, which may not be set yet
-    redis_key = r.text
+    return r.text
 
-    # Wait until the result is set in redis (with a timeout)
-    time_spent = 0
-    while True:
-        result = cache.get(redis_key)
-        if result is not None:
-            return result
-        time.sleep(check_interval)
-        time_spent += check_interval
-        if time_spent >= timeout:
-            raise ApiWorkerError('Timeout for %s' % url)
+def _wait_for_result(redis_key, url, timeout=120):
+    # Block until the result is pushed (with a timeout) instead of polling for it
+    result = get_redis_connection('default').blpop(redis_key, timeout)
+    if result is None:
+        raise ApiWorkerError('Timeout for %s' % url)
+    return result[1].decode('utf-8')
 
 def get_user_classical_rating_and_games_played(lichess_username, priority=0, max_retries=3):
     url = '%s/lichessapi/api/user/%s?priority=%s&max_retries=%s' % (settings.API_WORKER_HOST, lichess_username, priority, max_retries)
@@ -36,6 +41,36 @@ def get_user_classical_rating_and_games_played(lichess_username, priority=0, max
     classical = user_info['perfs']['classical']
     return (classical['rating'], classical['games'])
 
+def get_users_classical_rating_and_games_played(lichess_usernames, priority=0, max_retries=3, progress=None, on_error=None):
+    '''Looks up users with lichess's bulk user endpoint, in as few requests as possible
+
+    Yields (username, rating, games played) for each user that was found, with the username in lowercase. The requests
+    for every chunk of users are queued at once, and progress(users looked up, total users) is called as each finishes.
+    If a chunk fails, on_error(usernames in the chunk, error) is called and the other chunks are still looked up, or
+    ApiWorkerError is raised if on_error isn't given.
+    '''
+    url = '%s/lichessapi/api/users?priority=%s&max_retries=%s' % (settings.API_WORKER_HOST, priority, max_retries)
+    chunks = [lichess_usernames[i:i + _USERS_PER_REQUEST] for i in range(0, len(lichess_usernames), _USERS_PER_REQUEST)]
+    redis_keys = [_queue_apicall(url, data=','.join(chunk)) for chunk in chunks]
+    done = 0
+    for chunk, redis_key in zip(chunks, redis_keys):
+        try:
+            result = _wait_for_result(redis_key, url)
+            if result == '':
+                raise ApiWorkerError('API failure')
+        except ApiWorkerError as e:
+            if on_error is None:
+                raise
+            on_error(chunk, e)
+        else:
+            for user_info in json.loads(result):
+                classical = user_info.get('perfs', {}).get('classical')
+                if classical is not None:
+                    yield (user_info['id'], classical['rating'], classical['games'])
+        done += len(chunk)
+        if progress is not None:
+            progress(done, len(lichess_usernames))
+
 def enumerate_user_classical_rating_and_games_played(lichess_team_name, priority=0, max_retries=3):
     page = 1
     while True:
@@ -71,5 +106,22 @@ def get_game_meta(gameid, priority=0, max_retries=3):
         raise ApiWorkerError('API failure')
     return json.loads(result)
 
+def get_game_metas(gameids, priority=0, max_retries=3):
+    '''Looks up games with lichess's multi-game export, in as few requests as possible
+
+    Yields the metadata (without moves) of each game that was found. Like get_users_classical_rating_and_games_played,
+    the requests for every chunk of games are queued at once. Raises ApiWorkerError if a chunk fails.
+    '''
+    url = '%s/lichessapi/games/export/_ids?moves=false&priority=%s&max_retries=%s' % (settings.API_WORKER_HOST, priority, max_retries)
+    chunks = [gameids[i:i + _GAMES_PER_REQUEST] for i in range(0, len(gameids), _GAMES_PER_REQUEST)]
+    redis_keys = [_queue_apicall(url, data=','.join(chunk), accept='application/x-ndjson') for chunk in chunks]
+    for redis_key in redis_keys:
+        result = _wait_for_result(redis_key, url)
+        if result == '':
+            raise ApiWorkerError('API failure')
+        for line in result.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
 class ApiWorkerError(Exception):
     pass
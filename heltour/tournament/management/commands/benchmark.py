@@ -0,0 +1,162 @@
+import random
+import resource
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.test.utils import CaptureQueriesContext
+from heltour import settings
+from heltour.tournament import pairinggen, views
+from heltour.tournament.models import *
+
+class Command(BaseCommand):
+    help = 'Benchmarks score calculation and pairing generation on synthetic seasons. ' \
+           'All generated data is rolled back afterwards unless --keep is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', default='50,500,5000', help='Comma-separated list of season sizes to benchmark')
+        parser.add_argument('--rounds', type=int, default=8, help='Number of rounds per season')
+        parser.add_argument('--boards', type=int, default=6, help='Number of boards per team in team seasons')
+        parser.add_argument('--league-type', choices=['team', 'lone', 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=4545, help='Random seed for the generated seasons and results')
+        parser.add_argument('--no-pairings', action='store_true', help='Skip the pairing generation benchmark')
+        parser.add_argument('--engine', choices=sorted(pairinggen.PAIRING_ENGINES), help='Pairing engine to use instead of PAIRING_ENGINE')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated seasons in the database')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        if options['engine']:
+            settings.PAIRING_ENGINE = options['engine']
+        competitor_types = ['team', 'lone'] if options['league_type'] == 'both' else [options['league_type']]
+
+        self.stdout.write('%-32s %8s %6s %10s %8s %10s' % ('path', 'players', 'rounds', 'time (s)', 'queries', 'peak +MB'))
+        for player_count in [int(n) for n in options['players'].split(',')]:
+            for competitor_type in competitor_types:
+                try:
+                    with transaction.atomic():
+                        if competitor_type == 'team':
+                            self._benchmark_team_season(player_count)
+                        else:
+                            self._benchmark_lone_season(player_count)
+                        if not options['keep']:
+                            transaction.set_rollback(True)
+                except Exception as e:
+                    self.stderr.write('Error benchmarking %s season with %d players: %s' % (competitor_type, player_count, e))
+
+    def _measure(self, name, player_count, fn):
+        # The process's own peak (ru_maxrss) is set by whatever used the most memory so far, e.g. generating the
+        # season, so the memory column is the peak growth over the memory in use when the path started instead. It's
+        # sampled every few milliseconds, which can miss very brief spikes.
+        start_rss = _rss_mb()
+        peak_rss = [start_rss]
+        done = threading.Event()
+        def sample_rss():
+            while not done.wait(0.005):
+                peak_rss[0] = max(peak_rss[0], _rss_mb())
+        sampler = threading.Thread(target=sample_rss)
+        sampler.daemon = True
+        if start_rss is not None:
+            sampler.start()
+
+        start = time.time()
+        error = None
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                with transaction.atomic():
+                    fn()
+            except Exception as e:
+                error = e
+        elapsed = time.time() - start
+        done.set()
+        if start_rss is not None:
+            sampler.join()
+            peak_growth = '%10.1f' % (max(peak_rss[0], _rss_mb()) - start_rss)
+        else:
+            peak_growth = '%10s' % 'n/a'
+        line = '%-32s %8d %6d %10.3f %8d %s' % (name, player_count, self.options['rounds'], elapsed, len(queries), peak_growth)
+        if error is not None:
+            line += '  (failed: %s)' % error
+        self.stdout.write(line)
+
+    def _create_season(self, competitor_type, player_count):
+        tag = 'benchmark-%s-%d-%d' % (competitor_type, player_count, int(time.time()))
+        league = League.objects.create(name=tag, tag=tag, competitor_type=competitor_type, pairing_type='swiss-dutch', is_active=False)
+        boards = self.options['boards'] if competitor_type == 'team' else None
+        season = Season.objects.create(league=league, name=tag, tag=tag, rounds=self.options['rounds'], boards=boards)
+        players = [Player(lichess_username='%s-%d' % (tag, n), rating=self.random.randint(1000, 2400)) for n in range(player_count)]
+        Player.objects.bulk_create(players)
+        players = list(Player.objects.filter(lichess_username__startswith='%s-' % tag).order_by('-rating'))
+        return season, players
+
+    def _random_result(self):
+        return self.random.choice(['1-0', '1-0', '0-1', '0-1', '1/2-1/2', '1X-0F', '0F-1X'])
+
+    def _benchmark_team_season(self, player_count):
+        boards = self.options['boards']
+        season, players = self._create_season('team', player_count)
+        rounds = list(season.round_set.order_by('number'))
+
+        teams = []
+        for n in range(1, player_count // boards + 1):
+            team = Team.objects.create(season=season, number=n, name='Team %d' % n)
+            TeamScore.objects.create(team=team)
+            teams.append(team)
+        TeamMember.objects.bulk_create([TeamMember(team=team, player=players[(team.number - 1) * boards + b - 1], board_number=b)
+                                        for team in teams for b in range(1, boards + 1)])
+
+        # Play every round but the last with random pairings and results
+        team_pairings = []
+        for round_ in rounds[:-1]:
+            shuffled = list(teams)
+            self.random.shuffle(shuffled)
+            for i in range(len(shuffled) // 2):
+                white_points = self.random.randint(0, boards * 2) / 2.0
+                team_pairings.append(TeamPairing(round=round_, pairing_order=i + 1, white_team=shuffled[i * 2], black_team=shuffled[i * 2 + 1],
+                                                 white_points=white_points, black_points=boards - white_points))
+        TeamPairing.objects.bulk_create(team_pairings)
+        Round.objects.filter(pk__in=[r.pk for r in rounds[:-1]]).update(is_completed=True)
+
+        season = Season.objects.get(pk=season.pk)
+        self._measure('Season.calculate_scores (team)', player_count, season.calculate_scores)
+        if not self.options['no_pairings']:
+            last_round = Round.objects.get(pk=rounds[-1].pk)
+            self._measure('generate_pairings (team)', player_count, lambda: pairinggen.generate_pairings(last_round))
+
+    def _benchmark_lone_season(self, player_count):
+        season, players = self._create_season('lone', player_count)
+        rounds = list(season.round_set.order_by('number'))
+
+        season_players = [SeasonPlayer(season=season, player=p, seed_rating=p.rating) for p in players]
+        SeasonPlayer.objects.bulk_create(season_players)
+        LonePlayerScore.objects.bulk_create([LonePlayerScore(season_player=sp) for sp in SeasonPlayer.objects.filter(season=season)])
+
+        # Play every round but the last with random pairings and results
+        for round_ in rounds[:-1]:
+            shuffled = list(players)
+            self.random.shuffle(shuffled)
+            for i in range(len(shuffled) // 2):
+                pairing = LonePlayerPairing(round=round_, pairing_order=i + 1, white=shuffled[i * 2], black=shuffled[i * 2 + 1],
+                                            result=self._random_result())
+                # Skip PlayerPairing.save() to avoid per-pairing score and rank updates while generating data
+                models.Model.save(pairing)
+            if len(shuffled) % 2 == 1:
+                PlayerBye.objects.create(round=round_, player=shuffled[-1], type='full-point-pairing-bye')
+        Round.objects.filter(pk__in=[r.pk for r in rounds[:-1]]).update(is_completed=True)
+
+        season = Season.objects.get(pk=season.pk)
+        self._measure('Season.calculate_scores (lone)', player_count, season.calculate_scores)
+        self._measure('lone_player_pairing_rank_dict', player_count, lambda: lone_player_pairing_rank_dict(season))
+        self._measure('_lone_player_scores', player_count, lambda: views._lone_player_scores(season))
+        if not self.options['no_pairings']:
+            last_round = Round.objects.get(pk=rounds[-1].pk)
+            self._measure('generate_pairings (lone)', player_count, lambda: pairinggen.generate_pairings(last_round))
+
+# Returns the memory the process is currently using in MB, or None if it isn't available (it's read from /proc on Linux)
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1024.0 / 1024.0
+    except (IOError, OSError):
+        return None
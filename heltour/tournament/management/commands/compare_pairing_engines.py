@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from heltour.tournament import pairinggen
+from heltour.tournament.models import *
+
+class Command(BaseCommand):
+    help = 'Re-pairs the completed rounds of historical seasons with each pairing engine and compares the results ' \
+           'with each other and with the pairings that were actually used.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('season_ids', nargs='+', type=int)
+        parser.add_argument('--engines', default='javafo,python', help='Comma-separated list of engines to compare (the first is the reference)')
+
+    def handle(self, *args, **options):
+        engine_names = options['engines'].split(',')
+        for name in engine_names:
+            if name not in pairinggen.PAIRING_ENGINES:
+                raise CommandError('Unknown pairing engine: %s' % name)
+
+        self.stdout.write('%-30s %5s %-8s %8s %6s %7s %10s %10s %9s %9s' %
+                          ('season', 'round', 'engine', 'time (s)', 'pairs', 'repeats', 'score diff', 'colour err', 'vs actual', 'vs %s' % engine_names[0]))
+        for season_id in options['season_ids']:
+            season = Season.objects.select_related('league').get(pk=season_id)
+            for round_ in season.round_set.filter(is_completed=True).order_by('number'):
+                players, actual_pairs = self._round_input(round_)
+                if len(players) < 2:
+                    continue
+                reference_pairs = None
+                for name in engine_names:
+                    engine = pairinggen.get_pairing_engine_class(name)(season.rounds, players)
+                    # Time the engine itself rather than the pairing cache
+                    engine.use_cache = False
+                    start = time.time()
+                    try:
+                        pairs = engine.run()
+                    except Exception as e:
+                        self.stdout.write('%-30s %5d %-8s failed: %s' % (season.tag[:30], round_.number, name, e))
+                        continue
+                    elapsed = time.time() - start
+                    if reference_pairs is None:
+                        reference_pairs = pairs
+                    quality = pairinggen.PairingQuality(players, pairs)
+                    self.stdout.write('%-30s %5d %-8s %8.3f %6d %7d %10.1f %10d %8.0f%% %8.0f%%' % (
+                        season.tag[:30], round_.number, name, elapsed, len(pairs), quality.repeat_count,
+                        quality.score_difference, quality.color_error_count,
+                        self._agreement(pairs, actual_pairs), self._agreement(pairs, reference_pairs)))
+
+    def _round_input(self, round_):
+        # Rebuilds the engine input from before the round was played, and returns it with the pairings that were used
+        if round_.season.league.competitor_type == 'team':
+            actual = list(round_.teampairing_set.select_related('white_team__teamscore', 'black_team__teamscore'))
+            teams = [t for p in actual for t in (p.white_team, p.black_team)]
+            previous_pairings = TeamPairing.objects.filter(round__season=round_.season, round__number__lt=round_.number) \
+                                                   .select_related('white_team', 'black_team').order_by('round__number')
+            engine = pairinggen.DutchTeamPairingSystem(engine_class=pairinggen.JavafoInstance).engine_instance(round_, teams, previous_pairings)
+            actual_pairs = [[p.white_team, p.black_team] for p in actual]
+        else:
+            actual = list(round_.loneplayerpairing_set.select_related('white', 'black').nocache())
+            byes = list(round_.playerbye_set.filter(type='full-point-pairing-bye').select_related('player'))
+            paired_players = {p for pairing in actual for p in (pairing.white, pairing.black)} | {b.player for b in byes}
+            season_players = SeasonPlayer.objects.filter(season=round_.season, player__in=paired_players) \
+                                                 .select_related('player', 'loneplayerscore').nocache()
+            previous_pairings = LonePlayerPairing.objects.filter(round__season=round_.season, round__number__lt=round_.number) \
+                                                         .select_related('round', 'white', 'black').order_by('round__number').nocache()
+            previous_byes = PlayerBye.objects.filter(round__season=round_.season, round__number__lt=round_.number) \
+                                             .select_related('round', 'player').order_by('round__number')
+            engine = pairinggen.DutchLonePairingSystem(engine_class=pairinggen.JavafoInstance) \
+                               .engine_instance(round_, list(season_players), previous_pairings, previous_byes)
+            actual_pairs = [[p.white, p.black] for p in actual] + [[b.player, None] for b in byes]
+
+        # Current scores and standings include later rounds, so score from the history and seed by rating
+        players = engine.players
+        for p in players:
+            p.score = sum(pairing.score or 0 for pairing in p.pairings)
+        players.sort(key=lambda p: (-p.score, -(getattr(p.player, 'rating', None) or getattr(p.player, 'seed_rating', None) or 0)))
+        return players, actual_pairs
+
+    def _agreement(self, pairs, other_pairs):
+        # The percentage of pairings (ignoring colours) that also appear in the other pairings
+        if not pairs:
+            return 0
+        other = {frozenset(pair) for pair in other_pairs}
+        return 100.0 * sum(1 for pair in pairs if frozenset(pair) in other) / len(pairs)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 01:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import heltour.tournament.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournament', '0101_alternateassignment_replaced_player'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LonePlayerScoreSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_modified', models.DateTimeField(auto_now=True)),
+                ('rank', models.PositiveIntegerField()),
+                ('points', heltour.tournament.models.ScoreField(default=0)),
+                ('tiebreak1', heltour.tournament.models.ScoreField(default=0)),
+                ('tiebreak2', heltour.tournament.models.ScoreField(default=0)),
+                ('tiebreak3', heltour.tournament.models.ScoreField(default=0)),
+                ('tiebreak4', heltour.tournament.models.ScoreField(default=0)),
+                ('perf_rating', models.PositiveIntegerField(blank=True, null=True)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tournament.Round')),
+                ('season_player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tournament.SeasonPlayer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TeamScoreSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_modified', models.DateTimeField(auto_now=True)),
+                ('rank', models.PositiveIntegerField()),
+                ('match_count', models.PositiveIntegerField(default=0)),
+                ('match_points', models.PositiveIntegerField(default=0)),
+                ('game_points', heltour.tournament.models.ScoreField(default=0)),
+                ('playoff_score', models.PositiveIntegerField(default=0)),
+                ('head_to_head', models.PositiveIntegerField(default=0)),
+                ('games_won', models.PositiveIntegerField(default=0)),
+                ('sb_score', heltour.tournament.models.ScoreField(default=0)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tournament.Round')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tournament.Team')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='teamscoresnapshot',
+            unique_together=set([('team', 'round')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='loneplayerscoresnapshot',
+            unique_together=set([('season_player', 'round')]),
+        ),
+    ]
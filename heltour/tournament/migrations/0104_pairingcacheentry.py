@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 02:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournament', '0103_pairingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairingCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_modified', models.DateTimeField(auto_now=True)),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('engine', models.CharField(max_length=255)),
+                ('engine_version', models.CharField(max_length=1023)),
+                ('flags', models.CharField(max_length=255)),
+                ('trf', models.TextField()),
+                ('output', models.TextField()),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('last_hit', models.DateTimeField(blank=True, null=True)),
+                ('round', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tournament.Round')),
+            ],
+            options={
+                'verbose_name_plural': 'pairing cache entries',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournament', '0104_pairingcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='rating_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 10:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournament', '0105_player_rating_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loneplayerscoresnapshot',
+            name='rating',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -7,7 +7,11 @@ from django.core.validators import RegexValidator
 from datetime import timedelta
 from django.utils import timezone
 from django import forms as django_forms
+from django.db.models import Case, When, Value
+from django.core.cache import cache
 from collections import namedtuple, defaultdict
+from cacheops import invalidate_model
+from tiebreaks import LoneScoreMatrix
 import re
 
 # Helper function to find an item in a list by its properties
@@ -23,6 +27,37 @@ def _getnestedattr(obj, k):
         obj = getattr(obj, k2)
     return obj
 
+# Helper function to write the given fields of many objects at once.
+# This issues one UPDATE statement per batch inside a single transaction and then invalidates the model's cache once.
+# Note: No signals are sent, so save() logic and versioning are skipped. Pass invalidate=False to invalidate the cache
+#       yourself, e.g. after an enclosing transaction commits.
+def bulk_update(model, objs, fields, batch_size=500, invalidate=True):
+    objs = list(objs)
+    if len(objs) == 0:
+        return
+    date_modified = timezone.now()
+    with transaction.atomic():
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            updates = {'date_modified': date_modified}
+            for name in fields:
+                field = model._meta.get_field(name)
+                whens = [When(pk=obj.pk, then=Value(getattr(obj, name), output_field=field)) for obj in batch]
+                updates[name] = _TypedCase(*whens, output_field=field)
+            model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    for obj in objs:
+        obj.date_modified = date_modified
+    if invalidate:
+        invalidate_model(model)
+
+# Postgres types a CASE whose values are all NULL as text, which can't be assigned to e.g. an integer column, so the
+# CASE is cast to the column's type there (like Django 1.10's Cast). Other databases don't need it, and sqlite would
+# turn dates into numbers.
+class _TypedCase(Case):
+    def as_postgresql(self, compiler, connection):
+        sql, params = self.as_sql(compiler, connection)
+        return 'CAST(%s AS %s)' % (sql, self.output_field.db_type(connection)), params
+
 # Represents a positive number in increments of 0.5 (0, 0.5, 1, etc.)
 class ScoreField(models.PositiveIntegerField):
 
@@ -159,23 +194,94 @@ class Season(_BaseModel):
                     if prize.rank <= len(eligible_players):
                         SeasonPrizeWinner.objects.create(season_prize=prize, player=eligible_players[prize.rank - 1])
 
-    def calculate_scores(self):
+    def schedule_score_calculation(self, round_number=None):
+        # Scores are calculated by a background task after a short delay, so a burst of result changes only triggers
+        # a single calculation. Each change bumps the season's score version, and the scores stay stale until a
+        # calculation that started after the change has finished.
+        # The calculation starts from the earliest changed round, or from the start if any change didn't give one.
+        cache.set(self._changed_round_key(round_number or 0), True, None)
+        version_key = 'season_scores_version_%d' % self.pk
+        cache.add(version_key, 0, None)
+        cache.incr(version_key)
+        self._enqueue_score_calculation()
+
+    '''Schedules a score calculation if the scores are stale, e.g. because the scheduled task was lost'''
+    def resume_score_calculation(self):
+        if self.scores_are_stale():
+            self._enqueue_score_calculation()
+
+    def _changed_round_key(self, round_number):
+        return 'season_scores_changed_round_%d_%d' % (self.pk, round_number)
+
+    def _enqueue_score_calculation(self):
+        if cache.add('season_scores_scheduled_%d' % self.pk, True, 60 * 5):
+            # Imported here to avoid a circular import
+            from heltour.tournament.tasks import calculate_season_scores
+            calculate_season_scores.apply_async(args=[self.pk], countdown=SCORE_CALCULATION_DELAY)
+
+    def scores_are_stale(self):
+        version = cache.get('season_scores_version_%d' % self.pk) or 0
+        return version > (cache.get('season_scores_calculated_%d' % self.pk) or 0)
+
+    '''Calculates the scores from the earliest changed round and marks every change made before the calculation
+    started as counted
+    '''
+    def calculate_stale_scores(self):
+        version = cache.get('season_scores_version_%d' % self.pk) or 0
+        # Changes from this point on are picked up by the next calculation. If a change's round is cleared here
+        # before its version is counted, the next calculation doesn't find any rounds and starts from the start.
+        round_keys = {self._changed_round_key(n): n for n in range(0, self.rounds + 1)}
+        changed_rounds = [round_keys[k] for k in cache.get_many(round_keys.keys())]
+        cache.delete_many(round_keys.keys())
+        # Round 0 stands for a change without a round
+        from_round = min(changed_rounds) if changed_rounds else 0
+        self.calculate_scores(from_round or None)
+        # Never move backwards, in case a calculation that started earlier finishes later
+        calculated_key = 'season_scores_calculated_%d' % self.pk
+        if version > (cache.get(calculated_key) or 0):
+            cache.set(calculated_key, version, None)
+
+    '''Calculates the current scores and the standings snapshot of each completed round
+
+    from_round -- the number of the earliest round whose results may have changed. The standings after earlier rounds
+                  are read from their snapshots instead of being recalculated.
+    '''
+    def calculate_scores(self, from_round=None):
         if self.league.competitor_type == 'team':
-            self._calculate_team_scores()
+            self._calculate_team_scores(from_round or 1)
         else:
-            self._calculate_lone_scores()
+            self._calculate_lone_scores(from_round or 1)
 
-    def _calculate_team_scores(self):
+    def _calculate_team_scores(self, from_round):
         # Note: The scores are calculated in a particular way to allow easy adding of new tiebreaks
         score_dict = {}
 
+        teams = list(Team.objects.filter(season=self).nocache())
+        completed_rounds = list(self.round_set.filter(is_completed=True).order_by('number').nocache())
+
+        # The standings after the rounds before from_round stay as they are in their snapshots. If any are missing
+        # (e.g. the scores have never been calculated), they're all recalculated.
+        earlier_rounds = [r for r in completed_rounds if r.number < from_round]
+        if earlier_rounds:
+            earlier_count = TeamScoreSnapshot.objects.filter(team__season=self, round__in=earlier_rounds).nocache().count()
+            if earlier_count != len(teams) * len(earlier_rounds):
+                from_round = 1
+
+        # Index the pairings for each round by team id so each lookup below is a dict access instead of a list scan
+        white_index = defaultdict(dict)
+        black_index = defaultdict(dict)
+        for p in TeamPairing.objects.filter(round__season=self, round__is_completed=True).nocache():
+            white_index[p.round_id][p.white_team_id] = p
+            black_index[p.round_id][p.black_team_id] = p
+
         last_round = None
-        for round_ in self.round_set.filter(is_completed=True).order_by('number'):
-            round_pairings = round_.teampairing_set.all()
-            for team in Team.objects.filter(season=self):
-                white_pairing = find(round_pairings, white_team_id=team.id)
-                black_pairing = find(round_pairings, black_team_id=team.id)
-                is_playoffs = round_.number > self.rounds - self.playoffs
+        for round_ in completed_rounds:
+            round_white_pairings = white_index[round_.id]
+            round_black_pairings = black_index[round_.id]
+            is_playoffs = round_.number > self.rounds - self.playoffs
+            for team in teams:
+                white_pairing = round_white_pairings.get(team.id)
+                black_pairing = round_black_pairings.get(team.id)
 
                 def increment_score(round_opponent, round_points, round_opponent_points, round_wins):
                     playoff_score, match_count, match_points, game_points, games_won, _, _, _, _ = score_dict[(team.pk, last_round.number)] if last_round is not None else (0, 0, 0, 0, 0, 0, 0, None, 0)
@@ -187,7 +293,6 @@ class Season(_BaseModel):
                             game_points += self.boards / 2
                     else:
                         if is_playoffs:
-                            print 'Playoff', round_points
                             if round_points > round_opponent_points:
                                 playoff_score += 2 ** (self.rounds - round_.number)
                             # TODO: Handle ties/tiebreaks somehow?
@@ -210,143 +315,114 @@ class Season(_BaseModel):
                     increment_score(None, 0, 0, 0)
             last_round = round_
 
-        # Precalculate groups of tied teams for the tiebreaks
-        tied_team_map = defaultdict(set)
-        for team in Team.objects.filter(season=self):
-            score_state = score_dict[(team.pk, last_round.number)]
-            tied_team_map[(score_state.match_points, score_state.game_points)].add(team.pk)
-
-        team_scores = TeamScore.objects.filter(team__season=self)
-        for score in team_scores:
-            if last_round is None:
-                score.playoff_score = 0
-                score.match_count = 0
-                score.match_points = 0
-                score.game_points = 0
-                score.head_to_head = 0
-                score.games_won = 0
-                score.sb_score = 0
-            else:
-                score_state = score_dict[(score.team_id, last_round.number)]
-                score.playoff_score = score_state.playoff_score
-                score.match_count = score_state.match_count
-                score.match_points = score_state.match_points
-                score.game_points = score_state.game_points
-                score.games_won = score_state.games_won
+        def standings_after(round_number):
+            # Precalculate groups of tied teams for the tiebreaks
+            tied_team_map = defaultdict(set)
+            for team in teams:
+                score_state = score_dict[(team.pk, round_number)]
+                tied_team_map[(score_state.match_points, score_state.game_points)].add(team.pk)
+
+            standings = {}
+            for team in teams:
+                score_state = score_dict[(team.pk, round_number)]
+                values = dict.fromkeys(_TEAM_SCORE_FIELDS, 0)
+                values['playoff_score'] = score_state.playoff_score
+                values['match_count'] = score_state.match_count
+                values['match_points'] = score_state.match_points
+                values['game_points'] = score_state.game_points
+                values['games_won'] = score_state.games_won
 
                 # Tiebreak calculations
                 tied_team_set = tied_team_map[(score_state.match_points, score_state.game_points)]
-                score.head_to_head = 0
-                score.sb_score = 0
-                for round_number in range(1, last_round.number + 1):
-                    round_state = score_dict[(score.team_id, round_number)]
+                for n in range(1, round_number + 1):
+                    round_state = score_dict[(team.pk, n)]
                     opponent = round_state.round_opponent
                     if opponent is not None:
                         if round_state.round_match_points == 2:
-                            score.sb_score += score_dict[(round_state.round_opponent, last_round.number)].match_points
+                            values['sb_score'] += score_dict[(round_state.round_opponent, round_number)].match_points
                         elif round_state.round_match_points == 1:
-                            score.sb_score += score_dict[(round_state.round_opponent, last_round.number)].match_points / 2.0
+                            values['sb_score'] += score_dict[(round_state.round_opponent, round_number)].match_points / 2.0
                         if opponent in tied_team_set:
-                            score.head_to_head += round_state.match_points
-            score.save()
-
-    def _calculate_lone_scores(self):
-        season_players = SeasonPlayer.objects.filter(season=self).select_related('loneplayerscore').nocache()
-        seed_rating_dict = {sp.player_id: sp.seed_rating for sp in season_players}
-        score_dict = {}
-        last_round = None
-        for round_ in self.round_set.filter(is_completed=True).order_by('number'):
-            pairings = round_.loneplayerpairing_set.all().nocache()
-            byes = PlayerBye.objects.filter(round=round_)
-            for sp in season_players:
-                white_pairing = find(pairings, white_id=sp.player_id)
-                black_pairing = find(pairings, black_id=sp.player_id)
-                bye = find(byes, player_id=sp.player_id)
-
-                def increment_score(round_opponent, round_score, round_played):
-                    total, mm_total, cumul, perf_total_rating, perf_score, perf_n, _, _ = score_dict[(sp.player_id, last_round.number)] if last_round is not None else (0, 0, 0, 0, 0, 0, None, False)
-                    total += round_score
-                    cumul += total
-                    if round_played:
-                        mm_total += round_score
-                        opp_rating = seed_rating_dict.get(round_opponent, None)
-                        if opp_rating is not None:
-                            perf_total_rating += opp_rating
-                            perf_score += round_score
-                            perf_n += 1
-                    else:
-                        # Special cases for unplayed games
-                        mm_total += 0.5
-                        cumul -= round_score
-                    score_dict[(sp.player_id, round_.number)] = _LoneScoreState(total, mm_total, cumul, perf_total_rating, perf_score, perf_n, round_opponent, round_played)
+                            values['head_to_head'] += round_state.match_points
+                standings[team.pk] = values
+            return standings
 
-                if white_pairing is not None:
-                    increment_score(white_pairing.black_id, white_pairing.white_score() or 0, white_pairing.game_played())
-                elif black_pairing is not None:
-                    increment_score(black_pairing.white_id, black_pairing.black_score() or 0, black_pairing.game_played())
-                elif bye is not None:
-                    increment_score(None, bye.score(), False)
-                else:
-                    increment_score(None, 0, False)
-            last_round = round_
-
-        player_scores = [sp.get_loneplayerscore() for sp in season_players]
+        final_standings = standings_after(last_round.number) if last_round is not None else {}
 
-        for score in player_scores:
-            player_id = score.season_player.player_id
-            if last_round is None:
-                score.points = 0
-                score.tiebreak1 = 0
-                score.tiebreak2 = 0
-                score.tiebreak3 = 0
-                score.tiebreak4 = 0
-            else:
-                score_state = score_dict[(score.season_player.player_id, last_round.number)]
-                score.points = score_state.total
-
-                # Tiebreak calculations
+        changed_scores = []
+        for score in TeamScore.objects.filter(team__season=self).nocache():
+            values = final_standings.get(score.team_id, dict.fromkeys(_TEAM_SCORE_FIELDS, 0))
+            # Only write scores whose values have actually changed
+            if _update_fields(score, values):
+                changed_scores.append(score)
 
-                opponent_scores = []
-                opponent_cumuls = []
-                for round_number in range(1, last_round.number + 1):
-                    round_state = score_dict[(player_id, round_number)]
-                    if round_state.round_played and round_state.round_opponent is not None:
-                        opponent_scores.append(score_dict[(round_state.round_opponent, last_round.number)].mm_total)
-                        opponent_cumuls.append(score_dict[(round_state.round_opponent, last_round.number)].cumul)
-                    else:
-                        opponent_scores.append(0)
-                opponent_scores.sort()
-
-                # TB1: Modified Median
-                median_scores = opponent_scores
-                skip = 2 if last_round.number >= 9 else 1
-                if score.points <= last_round.number / 2.0:
-                    median_scores = median_scores[:-skip]
-                if score.points >= last_round.number / 2.0:
-                    median_scores = median_scores[skip:]
-                score.tiebreak1 = sum(median_scores)
-
-                # TB2: Solkoff
-                score.tiebreak2 = sum(opponent_scores)
-
-                # TB3: Cumulative
-                score.tiebreak3 = score_state.cumul
-
-                # TB4: Cumulative opponent
-                score.tiebreak4 = sum(opponent_cumuls)
-
-                # Performance rating
-                if score_state.perf_n >= 5:
-                    average_opp_rating = int(round(score_state.perf_total_rating / float(score_state.perf_n)))
-                    # Turn the score into a number from 0-100 (0 = 0%, 100 = 100%)
-                    lookup_index = max(min(int(round(100.0 * score_state.perf_score / score_state.perf_n)), 100), 0)
-                    # Use that number to get a rating difference from the FIDE lookup table
-                    dp = fide_dp_lookup[lookup_index]
-                    score.perf_rating = average_opp_rating + dp
-                else:
-                    score.perf_rating = None
+        bulk_update(TeamScore, changed_scores, _TEAM_SCORE_FIELDS)
 
-            score.save()
+        # Save a snapshot of the standings after each completed round from from_round on
+        snapshot_values = {}
+        for round_ in completed_rounds:
+            if round_.number < from_round:
+                continue
+            standings = standings_after(round_.number)
+            ranked = sorted(standings.items(), key=lambda s: tuple(s[1][f] for f in _TEAM_RANK_FIELDS), reverse=True)
+            for rank, (team_id, values) in enumerate(ranked, 1):
+                snapshot_values[(team_id, round_.id)] = dict(values, rank=rank)
+        _save_snapshots(TeamScoreSnapshot, 'team', TeamScoreSnapshot.objects.filter(team__season=self, round__number__gte=from_round).nocache(),
+                        snapshot_values, _TEAM_SCORE_FIELDS + ('rank',))
+
+    def _calculate_lone_scores(self, from_round):
+        season_players = list(SeasonPlayer.objects.filter(season=self).select_related('loneplayerscore', 'player').nocache())
+        if len(season_players) == 0:
+            return
+        completed_rounds = list(self.round_set.filter(is_completed=True).order_by('number').nocache())
+
+        # The standings after the rounds before from_round stay as they are in their snapshots. If any are missing
+        # (e.g. the scores have never been calculated), they're all recalculated.
+        earlier_rounds = [r for r in completed_rounds if r.number < from_round]
+        if earlier_rounds:
+            earlier_count = LonePlayerScoreSnapshot.objects.filter(season_player__season=self, round__in=earlier_rounds).nocache().count()
+            if earlier_count != len(season_players) * len(earlier_rounds):
+                from_round = 1
+
+        # Index the pairings and byes for each round by player id so each lookup below is a dict access instead of a list scan
+        white_index = defaultdict(dict)
+        black_index = defaultdict(dict)
+        bye_index = defaultdict(dict)
+        for p in LonePlayerPairing.objects.filter(round__season=self, round__is_completed=True).nocache():
+            white_index[p.round_id].setdefault(p.white_id, p)
+            black_index[p.round_id].setdefault(p.black_id, p)
+        for bye in PlayerBye.objects.filter(round__season=self, round__is_completed=True).nocache():
+            bye_index[bye.round_id].setdefault(bye.player_id, bye)
+
+        matrix = lone_score_matrix(season_players, completed_rounds, white_index, black_index, bye_index)
+
+        def standings_after(round_count):
+            return lone_standings(matrix.first_rounds(round_count))
+
+        changed_scores = []
+        for sp, values in zip(season_players, standings_after(len(completed_rounds))):
+            score = sp.get_loneplayerscore()
+            # Only write scores whose values have actually changed
+            if _update_fields(score, values):
+                changed_scores.append(score)
+
+        bulk_update(LonePlayerScore, changed_scores, _LONE_SCORE_FIELDS)
+
+        # Save a snapshot of the standings after each completed round from from_round on. Ties are ranked by the
+        # players' ratings as of the round, which are kept from the first time the round's snapshot was saved.
+        existing_snapshots = list(LonePlayerScoreSnapshot.objects.filter(season_player__season=self, round__number__gte=from_round).nocache())
+        snapshot_ratings = {(s.season_player_id, s.round_id): s.rating for s in existing_snapshots}
+        snapshot_values = {}
+        for round_count, round_ in enumerate(completed_rounds, 1):
+            if round_.number < from_round:
+                continue
+            ratings = {sp.pk: snapshot_ratings.get((sp.pk, round_.id), sp.player.rating) for sp in season_players}
+            standings = zip(season_players, standings_after(round_count))
+            ranked = sorted(standings, key=lambda s: tuple(s[1][f] for f in _LONE_RANK_FIELDS) + (ratings[s[0].pk],), reverse=True)
+            for rank, (sp, values) in enumerate(ranked, 1):
+                snapshot_values[(sp.pk, round_.id)] = dict(values, rank=rank, rating=ratings[sp.pk])
+        _save_snapshots(LonePlayerScoreSnapshot, 'season_player', existing_snapshots, snapshot_values,
+                        _LONE_SCORE_FIELDS + ('rank', 'rating'))
 
     def is_started(self):
         return self.start_date is not None and self.start_date < timezone.now()
@@ -365,16 +441,98 @@ class Season(_BaseModel):
     def __unicode__(self):
         return self.name
 
-_TeamScoreState = namedtuple('_TeamScoreState', 'playoff_score, match_count, match_points, game_points, games_won, round_match_points, round_points, round_opponent, round_opponent_points')
-_LoneScoreState = namedtuple('_LoneScoreState', 'total, mm_total, cumul, perf_total_rating, perf_score, perf_n, round_opponent, round_played')
+def lone_score_matrix(season_players, rounds, white_index, black_index, bye_index):
+    '''Builds the LoneScoreMatrix used to calculate the scores and tiebreaks of a lone season
+
+    The indexes map each round id to a dict of the pairings by white player id, by black player id and the byes by
+    player id. The objects in them don't need to be saved, which lets simulations score hypothetical rounds.
+    '''
+    player_index = {sp.player_id: i for i, sp in enumerate(season_players)}
+    round_scores = [[0] * len(rounds) for _ in season_players]
+    round_played = [[False] * len(rounds) for _ in season_players]
+    round_opponents = [[-1] * len(rounds) for _ in season_players]
+    for j, round_ in enumerate(rounds):
+        round_white_pairings = white_index.get(round_.id, {})
+        round_black_pairings = black_index.get(round_.id, {})
+        round_byes = bye_index.get(round_.id, {})
+        for i, sp in enumerate(season_players):
+            white_pairing = round_white_pairings.get(sp.player_id)
+            black_pairing = round_black_pairings.get(sp.player_id)
+            bye = round_byes.get(sp.player_id)
 
-# From https://www.fide.com/component/handbook/?id=174&view=article
-# Used for performance rating calculations
-fide_dp_lookup = [-800, -677, -589, -538, -501, -470, -444, -422, -401, -383, -366, -351, -336, -322, -309, -296, -284, -273, -262, -251,
-                   - 240, -230, -220, -211, -202, -193, -184, -175, -166, -158, -149, -141, -133, -125, -117, -110, -102, -95, -87, -80, -72,
-                   - 65, -57, -50, -43, -36, -29, -21, -14, -7, 0, 7, 14, 21, 29, 36, 43, 50, 57, 65, 72, 80, 87, 95, 102, 110, 117, 125, 133,
-                   141, 149, 158, 166, 175, 184, 193, 202, 211, 220, 230, 240, 251, 262, 273, 284, 296, 309, 322, 336, 351, 366, 383, 401,
-                   422, 444, 470, 501, 538, 589, 677, 800]
+            if white_pairing is not None:
+                round_opponents[i][j] = player_index.get(white_pairing.black_id, -1)
+                round_scores[i][j] = white_pairing.white_score() or 0
+                round_played[i][j] = white_pairing.game_played()
+            elif black_pairing is not None:
+                round_opponents[i][j] = player_index.get(black_pairing.white_id, -1)
+                round_scores[i][j] = black_pairing.black_score() or 0
+                round_played[i][j] = black_pairing.game_played()
+            elif bye is not None:
+                round_scores[i][j] = bye.score()
+
+    seed_ratings = [sp.seed_rating if sp.seed_rating is not None else float('nan') for sp in season_players]
+    return LoneScoreMatrix(round_scores, round_played, round_opponents, seed_ratings)
+
+def lone_standings(matrix):
+    '''Returns a dict of LonePlayerScore field values for each player (row) in a LoneScoreMatrix'''
+    columns = zip(matrix.points(), matrix.modified_median(), matrix.solkoff(), matrix.cumulative(),
+                  matrix.cumulative_opponent(), matrix.performance_rating())
+    standings = []
+    for points, tb1, tb2, tb3, tb4, perf_rating in columns:
+        standings.append({
+            'points': float(points),
+            'tiebreak1': float(tb1), # Modified Median
+            'tiebreak2': float(tb2), # Solkoff
+            'tiebreak3': float(tb3), # Cumulative
+            'tiebreak4': float(tb4), # Cumulative opponent
+            'perf_rating': int(perf_rating) if perf_rating >= 0 else None,
+        })
+    return standings
+
+# The number of seconds to wait for further result changes before recalculating a season's scores
+SCORE_CALCULATION_DELAY = 5
+
+_TEAM_SCORE_FIELDS = ('playoff_score', 'match_count', 'match_points', 'game_points', 'head_to_head', 'games_won', 'sb_score')
+_LONE_SCORE_FIELDS = ('points', 'tiebreak1', 'tiebreak2', 'tiebreak3', 'tiebreak4', 'perf_rating')
+
+# The fields that determine the order of the standings (see TeamScore.__cmp__ and LonePlayerScore.final_standings_sort_key)
+_TEAM_RANK_FIELDS = ('playoff_score', 'match_points', 'game_points', 'head_to_head', 'games_won', 'sb_score')
+_LONE_RANK_FIELDS = ('points', 'tiebreak1', 'tiebreak2', 'tiebreak3', 'tiebreak4')
+
+# Sets the given attribute values on an object and returns whether any of them differ from the previous values
+def _update_fields(obj, values):
+    changed = False
+    for k, v in values.items():
+        if getattr(obj, k) != v:
+            setattr(obj, k, v)
+            changed = True
+    return changed
+
+# Writes the per-round standings snapshots for a season, only touching the rows that were added, changed or removed
+def _save_snapshots(model, owner_field, existing_snapshots, snapshot_values, fields):
+    existing_dict = {(getattr(s, owner_field + '_id'), s.round_id): s for s in existing_snapshots}
+    new_snapshots = []
+    changed_snapshots = []
+    for (owner_id, round_id), values in snapshot_values.items():
+        snapshot = existing_dict.pop((owner_id, round_id), None)
+        if snapshot is None:
+            snapshot = model(round_id=round_id, **values)
+            setattr(snapshot, owner_field + '_id', owner_id)
+            new_snapshots.append(snapshot)
+        elif _update_fields(snapshot, values):
+            changed_snapshots.append(snapshot)
+    with transaction.atomic():
+        # Any remaining snapshots are for rounds that are no longer completed
+        if len(existing_dict) > 0:
+            model.objects.filter(pk__in=[s.pk for s in existing_dict.values()]).delete()
+        model.objects.bulk_create(new_snapshots)
+        bulk_update(model, changed_snapshots, fields, invalidate=False)
+    # Invalidate once the changes are committed, so the old rows can't be cached again in between
+    if len(new_snapshots) > 0 or len(changed_snapshots) > 0 or len(existing_dict) > 0:
+        invalidate_model(model)
+
+_TeamScoreState = namedtuple('_TeamScoreState', 'playoff_score, match_count, match_points, game_points, games_won, round_match_points, round_points, round_opponent, round_opponent_points')
 
 #-------------------------------------------------------------------------------
 class Round(_BaseModel):
@@ -399,11 +557,80 @@ class Round(_BaseModel):
         is_completed_changed = self.pk is None and self.is_completed or self.is_completed != self.initial_is_completed
         super(Round, self).save(*args, **kwargs)
         if is_completed_changed:
-            self.season.calculate_scores()
+            # Calculate immediately since the next round's pairings depend on the scores
+            self.season.calculate_scores(from_round=self.number)
 
     def __unicode__(self):
         return "%s - Round %d" % (self.season, self.number)
 
+PAIRING_JOB_STATUS_OPTIONS = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+    ('cancelled', 'Cancelled'),
+)
+
+#-------------------------------------------------------------------------------
+class PairingJob(_BaseModel):
+    round = models.ForeignKey(Round)
+    overwrite = models.BooleanField(default=False)
+    status = models.CharField(max_length=31, choices=PAIRING_JOB_STATUS_OPTIONS, default='queued')
+    cancel_requested = models.BooleanField(default=False)
+    engine = models.CharField(max_length=255, blank=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    def is_active(self):
+        return self.status in ('queued', 'running')
+
+    '''Whether the job is active but has been queued or running for so long that its worker must have died'''
+    def is_stale(self):
+        return self.is_active() and (self.started or self.date_created) < timezone.now() - PAIRING_JOB_TIMEOUT
+
+    def is_cancel_requested(self):
+        # Read from the DB since the request comes from another process
+        return PairingJob.objects.filter(pk=self.pk, cancel_requested=True).nocache().exists()
+
+    def elapsed_seconds(self):
+        if self.started is None:
+            return None
+        return ((self.finished or timezone.now()) - self.started).total_seconds()
+
+    def __unicode__(self):
+        return "%s - Pairing job %d" % (self.round, self.pk)
+
+# Pairing jobs that have been queued or running for longer than this are assumed to be orphaned, e.g. by a worker
+# crash or a deploy
+PAIRING_JOB_TIMEOUT = timedelta(minutes=30)
+
+# Marks the round's orphaned pairing jobs as failed so that pairings can be generated again
+def fail_stale_pairing_jobs(round_):
+    cutoff = timezone.now() - PAIRING_JOB_TIMEOUT
+    stale_jobs = PairingJob.objects.filter(round=round_).filter(models.Q(status='queued', date_created__lt=cutoff) |
+                                                                models.Q(status='running', started__lt=cutoff))
+    return stale_jobs.update(status='failed', finished=timezone.now(), error='The job stopped responding.')
+
+#-------------------------------------------------------------------------------
+class PairingCacheEntry(_BaseModel):
+    # SHA-256 of the engine version, flags and TRF input
+    key = models.CharField(max_length=64, unique=True)
+    round = models.ForeignKey(Round, blank=True, null=True, on_delete=models.SET_NULL)
+    engine = models.CharField(max_length=255)
+    engine_version = models.CharField(max_length=1023)
+    flags = models.CharField(max_length=255)
+    trf = models.TextField()
+    output = models.TextField()
+    hit_count = models.PositiveIntegerField(default=0)
+    last_hit = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'pairing cache entries'
+
+    def __unicode__(self):
+        return "%s - %s" % (self.engine, self.key[:12])
+
 username_validator = RegexValidator('^[\w-]+$')
 
 #-------------------------------------------------------------------------------
@@ -414,6 +641,7 @@ class Player(_BaseModel):
     lichess_username = models.CharField(max_length=255, validators=[username_validator])
     rating = models.PositiveIntegerField(blank=True, null=True)
     games_played = models.PositiveIntegerField(blank=True, null=True)
+    rating_updated = models.DateTimeField(blank=True, null=True)
     email = models.CharField(max_length=255, blank=True)
     is_active = models.BooleanField(default=True)
     in_slack_group = models.BooleanField(default=False)
@@ -566,14 +794,20 @@ class PlayerBye(_BaseModel):
             else:
                 self.player_rank = None
         super(PlayerBye, self).save(*args, **kwargs)
-        if (round_changed or player_changed or type_changed) and self.round.is_completed:
-            self.round.season.calculate_scores()
+        if round_changed or player_changed or type_changed:
+            # A bye moved from another round affects that round too
+            affected_rounds = [self.round]
+            if self.initial_round_id is not None and self.initial_round_id != self.round_id:
+                affected_rounds += list(Round.objects.filter(pk=self.initial_round_id))
+            completed_numbers = [r.number for r in affected_rounds if r.is_completed]
+            if completed_numbers:
+                self.round.season.schedule_score_calculation(min(completed_numbers))
 
     def delete(self, *args, **kwargs):
         round_ = self.round
         super(PlayerBye, self).delete(*args, **kwargs)
         if round_.is_completed:
-            round_.season.calculate_scores()
+            round_.season.schedule_score_calculation(round_.number)
 
 #-------------------------------------------------------------------------------
 class Team(_BaseModel):
@@ -702,6 +936,27 @@ class TeamScore(_BaseModel):
         return cmp((self.playoff_score, self.match_points, self.game_points, self.head_to_head, self.games_won, self.sb_score),
                    (other.playoff_score, other.match_points, other.game_points, other.head_to_head, other.games_won, other.sb_score))
 
+#-------------------------------------------------------------------------------
+class TeamScoreSnapshot(_BaseModel):
+    '''The standings of a team after a completed round, as calculated by Season.calculate_scores()'''
+    team = models.ForeignKey(Team)
+    round = models.ForeignKey(Round)
+    rank = models.PositiveIntegerField()
+    match_count = models.PositiveIntegerField(default=0)
+    match_points = models.PositiveIntegerField(default=0)
+    game_points = ScoreField(default=0)
+
+    playoff_score = models.PositiveIntegerField(default=0)
+    head_to_head = models.PositiveIntegerField(default=0)
+    games_won = models.PositiveIntegerField(default=0)
+    sb_score = ScoreField(default=0)
+
+    class Meta:
+        unique_together = ('team', 'round')
+
+    def __unicode__(self):
+        return "%s - %s" % (self.round, self.team.name)
+
 #-------------------------------------------------------------------------------
 class TeamPairing(_BaseModel):
     white_team = models.ForeignKey(Team, related_name="pairings_as_white")
@@ -726,7 +981,7 @@ class TeamPairing(_BaseModel):
         points_changed = self.pk is None or self.white_points != self.initial_white_points or self.black_points != self.initial_black_points
         super(TeamPairing, self).save(*args, **kwargs)
         if points_changed and self.round.is_completed:
-            self.round.season.calculate_scores()
+            self.round.season.schedule_score_calculation(self.round.number)
 
     def refresh_points(self):
         self.white_points = 0
@@ -885,7 +1140,7 @@ class PlayerPairing(_BaseModel):
         if hasattr(self, 'loneplayerpairing'):
             lpp = LonePlayerPairing.objects.nocache().get(pk=self.loneplayerpairing.pk)
             if result_changed and lpp.round.is_completed:
-                lpp.round.season.calculate_scores()
+                lpp.round.season.schedule_score_calculation(lpp.round.number)
             # If the players for a PlayerPairing in the current round are edited, then we can update the player ranks
             if (white_changed or black_changed) and lpp.round.publish_pairings and not lpp.round.is_completed:
                 lpp.refresh_ranks()
@@ -913,7 +1168,7 @@ class PlayerPairing(_BaseModel):
             self.teamplayerpairing.team_pairing.refresh_points()
             self.teamplayerpairing.team_pairing.save()
         if round_ is not None:
-            round_.season.calculate_scores()
+            round_.season.schedule_score_calculation(round_.number)
 
 #-------------------------------------------------------------------------------
 class TeamPlayerPairing(PlayerPairing):
@@ -1160,6 +1415,28 @@ class LonePlayerScore(_BaseModel):
     def __unicode__(self):
         return "%s" % (self.season_player)
 
+#-------------------------------------------------------------------------------
+class LonePlayerScoreSnapshot(_BaseModel):
+    '''The standings of a player after a completed round, as calculated by Season.calculate_scores()'''
+    season_player = models.ForeignKey(SeasonPlayer)
+    round = models.ForeignKey(Round)
+    rank = models.PositiveIntegerField()
+    points = ScoreField(default=0)
+    tiebreak1 = ScoreField(default=0)
+    tiebreak2 = ScoreField(default=0)
+    tiebreak3 = ScoreField(default=0)
+    tiebreak4 = ScoreField(default=0)
+
+    perf_rating = models.PositiveIntegerField(blank=True, null=True)
+    # The player's rating as of the round, which breaks ties in the rank
+    rating = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('season_player', 'round')
+
+    def __unicode__(self):
+        return "%s - %s" % (self.round, self.season_player)
+
 def lone_player_pairing_rank_dict(season):
     player_scores = list(enumerate(sorted(LonePlayerScore.objects.filter(season_player__season=season).select_related('season_player').nocache(), key=lambda s: s.pairing_sort_key(), reverse=True), 1))
     return {p.season_player.player_id: n for n, p in player_scores}
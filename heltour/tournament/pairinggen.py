@@ -1,17 +1,36 @@
 from .models import *
 from heltour import settings
-from django.db import transaction
+from heltour.tournament import javafodaemon, swiss
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
+import logging
 import tempfile
+import threading
 import subprocess
 import os
+import time
 
-def generate_pairings(round_, overwrite=False):
+logger = logging.getLogger(__name__)
+
+def generate_pairings(round_, overwrite=False, is_cancelled=None):
+    '''Generates and saves the pairings for a round
+
+    is_cancelled -- an optional function that returns True if the run should be stopped, which raises PairingsCancelledException
+
+    Returns the name of the pairing engine that was used.
+    '''
+    if round_.season.scores_are_stale():
+        # Don't pair based on scores that are about to be recalculated
+        round_.season.calculate_stale_scores()
     if round_.season.league.competitor_type == 'team':
-        _generate_team_pairings(round_, overwrite)
+        return _generate_team_pairings(round_, overwrite, is_cancelled)
     else:
-        _generate_lone_pairings(round_, overwrite)
+        return _generate_lone_pairings(round_, overwrite, is_cancelled)
 
-def _generate_team_pairings(round_, overwrite=False):
+def _generate_team_pairings(round_, overwrite=False, is_cancelled=None):
     with transaction.atomic():
         existing_pairings = TeamPairing.objects.filter(round=round_)
         if existing_pairings.count() > 0:
@@ -20,38 +39,62 @@ def _generate_team_pairings(round_, overwrite=False):
             else:
                 raise PairingsExistException()
 
-        # Sort by seed rating/score
-        teams = Team.objects.filter(season=round_.season, is_active=True).select_related('teamscore').nocache()
-        for team in teams:
-            if team.seed_rating is None:
-                team.seed_rating = team.average_rating()
-                team.save()
-        teams = sorted(teams, key=lambda team: team.get_teamscore().pairing_sort_key(), reverse=True)
-
-        previous_pairings = TeamPairing.objects.filter(round__season=round_.season, round__number__lt=round_.number).order_by('round__number')
+        teams, previous_pairings = _team_pairing_input(round_)
 
         # Run the pairing algorithm
-        pairing_system = DutchTeamPairingSystem()
+        pairing_system = DutchTeamPairingSystem(is_cancelled)
         team_pairings = pairing_system.create_team_pairings(round_, teams, previous_pairings)
 
         # Save the team pairings and create the individual pairings based on the team pairings
+        TeamPairing.objects.bulk_create(team_pairings)
+        # bulk_create doesn't set primary keys, so read the new pairings back
+        team_pairings = TeamPairing.objects.filter(round=round_).order_by('pairing_order').nocache()
+
         board_count = round_.season.boards
+        player_lists = _get_player_lists(round_, teams, board_count)
         for team_pairing in team_pairings:
-            team_pairing.save()
-
-            white_player_list = _get_player_list(team_pairing.white_team, round_, board_count)
-            black_player_list = _get_player_list(team_pairing.black_team, round_, board_count)
+            white_player_list = player_lists[team_pairing.white_team_id]
+            black_player_list = player_lists[team_pairing.black_team_id]
             for board_number in range(1, board_count + 1):
                 white_player = white_player_list[board_number - 1]
                 black_player = black_player_list[board_number - 1]
                 if board_number % 2 == 0:
                     white_player, black_player = black_player, white_player
-                TeamPlayerPairing.objects.create(team_pairing=team_pairing, board_number=board_number, white=white_player, black=black_player)
-
-def _get_player_list(team, round_, board_count):
-    team_members = [TeamMember.objects.filter(team=team, board_number=b).first() for b in range(1, board_count + 1)]
-    alternates = list(AlternateAssignment.objects.filter(round=round_, team=team).order_by('board_number'))
-
+                pairing = TeamPlayerPairing(team_pairing=team_pairing, board_number=board_number, white=white_player, black=black_player)
+                # Multi-table inherited models can't be bulk created, but the points and rank updates in
+                # PlayerPairing.save() aren't needed for new pairings without results
+                models.Model.save(pairing, force_insert=True)
+        return pairing_system.engine
+
+def _team_pairing_input(round_, save_seed_ratings=True):
+    # Sort by seed rating/score
+    teams = Team.objects.filter(season=round_.season, is_active=True).select_related('teamscore').nocache()
+    for team in teams:
+        if team.seed_rating is None:
+            team.seed_rating = team.average_rating()
+            if save_seed_ratings:
+                team.save()
+    teams = sorted(teams, key=lambda team: team.get_teamscore().pairing_sort_key(), reverse=True)
+
+    previous_pairings = TeamPairing.objects.filter(round__season=round_.season, round__number__lt=round_.number) \
+                                   .select_related('white_team', 'black_team').order_by('round__number').nocache()
+    return teams, previous_pairings
+
+def _get_player_lists(round_, teams, board_count):
+    # Load the rosters and alternate assignments for all the teams at once
+    team_members = {(tm.team_id, tm.board_number): tm for tm in TeamMember.objects.filter(team__in=teams).select_related('player').nocache()}
+    alternates = {}
+    for alt in AlternateAssignment.objects.filter(round=round_, team__in=teams).select_related('player', 'replaced_player') \
+                                          .order_by('board_number').nocache():
+        alternates.setdefault(alt.team_id, []).append(alt)
+
+    return {
+        team.pk: _get_player_list([team_members.get((team.pk, b)) for b in range(1, board_count + 1)], alternates.get(team.pk, []))
+        for team in teams
+    }
+
+def _get_player_list(team_members, alternates):
+    # Note: Assumes team_members is ordered by board number and alternates is sorted by board number
     player_list = [tm.player if tm is not None else None for tm in team_members]
 
     for alt in reversed(alternates):
@@ -68,7 +111,7 @@ def _get_player_list(team, round_, board_count):
 
     return player_list
 
-def _generate_lone_pairings(round_, overwrite=False):
+def _generate_lone_pairings(round_, overwrite=False, is_cancelled=None):
     with transaction.atomic():
         existing_pairings = LonePlayerPairing.objects.filter(round=round_)
         if existing_pairings.count() > 0:
@@ -86,23 +129,10 @@ def _generate_lone_pairings(round_, overwrite=False):
         for wd in round_.playerwithdrawl_set.all():
             wd.perform_withdrawl()
 
-        # Sort by seed rating/score
-        season_players = SeasonPlayer.objects.filter(season=round_.season, is_active=True).select_related('player', 'loneplayerscore').nocache()
-        for sp in season_players:
-            if sp.seed_rating is None:
-                sp.seed_rating = sp.player.rating
-                sp.save()
-        season_players = sorted(season_players, key=lambda sp: sp.get_loneplayerscore().pairing_sort_key(), reverse=True)
-
-        # Exclude players with byes
-        current_byes = {bye.player for bye in PlayerBye.objects.filter(round=round_)}
-        season_players = [sp for sp in season_players if sp.player not in current_byes]
-
-        previous_pairings = LonePlayerPairing.objects.filter(round__season=round_.season, round__number__lt=round_.number).order_by('round__number')
-        previous_byes = PlayerBye.objects.filter(round__season=round_.season, round__number__lt=round_.number).order_by('round__number')
+        season_players, previous_pairings, previous_byes = _lone_pairing_input(round_)
 
         # Run the pairing algorithm
-        pairing_system = DutchLonePairingSystem()
+        pairing_system = DutchLonePairingSystem(is_cancelled)
         lone_pairings, byes = pairing_system.create_lone_pairings(round_, season_players, previous_pairings, previous_byes)
 
         # Save the lone pairings
@@ -115,6 +145,41 @@ def _generate_lone_pairings(round_, overwrite=False):
         for bye in byes + list(PlayerBye.objects.filter(round=round_)):
             bye.refresh_rank(rank_dict)
             bye.save()
+        return pairing_system.engine
+
+def _lone_pairing_input(round_, save_seed_ratings=True):
+    # Sort by seed rating/score
+    season_players = SeasonPlayer.objects.filter(season=round_.season, is_active=True).select_related('player', 'loneplayerscore').nocache()
+    for sp in season_players:
+        if sp.seed_rating is None:
+            sp.seed_rating = sp.player.rating
+            if save_seed_ratings:
+                sp.save()
+    season_players = sorted(season_players, key=lambda sp: sp.get_loneplayerscore().pairing_sort_key(), reverse=True)
+
+    # Exclude players with byes
+    current_byes = {bye.player for bye in PlayerBye.objects.filter(round=round_)}
+    season_players = [sp for sp in season_players if sp.player not in current_byes]
+
+    previous_pairings = LonePlayerPairing.objects.filter(round__season=round_.season, round__number__lt=round_.number) \
+                                         .select_related('round', 'white', 'black').order_by('round__number').nocache()
+    previous_byes = PlayerBye.objects.filter(round__season=round_.season, round__number__lt=round_.number) \
+                                     .select_related('round', 'player').order_by('round__number').nocache()
+    return season_players, previous_pairings, previous_byes
+
+def export_trf(round_):
+    '''Returns the TRF input JaVaFo would be given to pair the round
+
+    This is based on the current scores and rosters, without performing any pending registrations or withdrawls, and
+    doesn't modify anything.
+    '''
+    if round_.season.league.competitor_type == 'team':
+        teams, previous_pairings = _team_pairing_input(round_, save_seed_ratings=False)
+        javafo = DutchTeamPairingSystem(engine_class=JavafoInstance).engine_instance(round_, teams, previous_pairings)
+    else:
+        season_players, previous_pairings, previous_byes = _lone_pairing_input(round_, save_seed_ratings=False)
+        javafo = DutchLonePairingSystem(engine_class=JavafoInstance).engine_instance(round_, season_players, previous_pairings, previous_byes)
+    return javafo.trf()
 
 def delete_pairings(round_):
     if round_.season.league.competitor_type == 'team':
@@ -133,7 +198,12 @@ class PairingsExistException(Exception):
 class PairingHasResultException(Exception):
     pass
 
+class PairingsCancelledException(Exception):
+    pass
+
 class PlaceholderTeamPairingSystem:
+    engine = 'Placeholder'
+
     def create_team_pairings(self, round_, teams, previous_pairings):
         # Pair teams in some arbitrary order for testing purposes
         team_pairings = []
@@ -144,14 +214,15 @@ class PlaceholderTeamPairingSystem:
         return team_pairings
 
 class DutchTeamPairingSystem:
-    def create_team_pairings(self, round_, teams, previous_pairings):
-        # Note: Assumes teams is sorted by seed and previous_pairings is sorted by round
+    def __init__(self, is_cancelled=None, engine_class=None):
+        self.is_cancelled = is_cancelled
+        self.engine_class = engine_class or get_pairing_engine_class()
+        self.engine = None
 
-        players = [
-            JavafoPlayer(team, team.teamscore.match_points, list(self._process_pairings(team, previous_pairings))) for team in teams
-        ]
-        javafo = JavafoInstance(round_.season.rounds, players)
-        pairs = javafo.run()
+    def create_team_pairings(self, round_, teams, previous_pairings):
+        engine = self.engine_instance(round_, teams, previous_pairings)
+        pairs = engine.run()
+        self.engine = engine.engine
 
         team_pairings = []
         for i in range(len(pairs)):
@@ -160,6 +231,14 @@ class DutchTeamPairingSystem:
             team_pairings.append(TeamPairing(white_team=white_team, black_team=black_team, round=round_, pairing_order=i + 1))
         return team_pairings
 
+    def engine_instance(self, round_, teams, previous_pairings):
+        # Note: Assumes teams is sorted by seed and previous_pairings is sorted by round
+
+        players = [
+            JavafoPlayer(team, team.teamscore.match_points, list(self._process_pairings(team, previous_pairings))) for team in teams
+        ]
+        return self.engine_class(round_.season.rounds, players, self.is_cancelled, round_)
+
     def _process_pairings(self, team, pairings):
         team_pairings = [p for p in pairings if p.white_team == team or p.black_team == team]
         for p in team_pairings:
@@ -169,17 +248,19 @@ class DutchTeamPairingSystem:
                 yield JavafoPairing(p.white_team, 'black', 1.0 if p.black_points > p.white_points else 0.5 if p.white_points == p.black_points else 0)
 
 class DutchLonePairingSystem:
+    def __init__(self, is_cancelled=None, engine_class=None):
+        self.is_cancelled = is_cancelled
+        self.engine_class = engine_class or get_pairing_engine_class()
+        self.engine = None
+
     def create_lone_pairings(self, round_, season_players, previous_pairings, previous_byes):
-        # Note: Assumes season_players is sorted by seed and previous_pairings/previous_byes are sorted by round
+        engine = self.engine_instance(round_, season_players, previous_pairings, previous_byes)
+        pairs = engine.run()
+        self.engine = engine.engine
+        return self.lone_pairings_from_pairs(round_, pairs)
 
-        players = [
-            JavafoPlayer(
-                         sp.player, sp.get_loneplayerscore().pairing_points(),
-                         list(self._process_pairings(sp, previous_pairings, previous_byes, round_.number, sp.loneplayerscore.late_join_points))
-            ) for sp in season_players
-        ]
-        javafo = JavafoInstance(round_.season.rounds, players)
-        pairs = javafo.run()
+    def lone_pairings_from_pairs(self, round_, pairs):
+        # Returns unsaved pairings and byes for the pairs returned by an engine
         lone_pairings = []
         byes = []
         for i in range(len(pairs)):
@@ -191,14 +272,34 @@ class DutchLonePairingSystem:
                 lone_pairings.append(LonePlayerPairing(white=white, black=black, round=round_, pairing_order=i + 1))
         return lone_pairings, byes
 
-    def _process_pairings(self, sp, pairings, byes, current_round_number, bonus_score):
-        player_pairings = [p for p in pairings if p.white == sp.player or p.black == sp.player]
-        player_byes = [b for b in byes if b.player == sp.player]
+    def engine_instance(self, round_, season_players, previous_pairings, previous_byes):
+        # Note: Assumes season_players is sorted by seed and previous_pairings/previous_byes are sorted by round
+
+        # Index each player's pairings and byes by round number so the history can be built without searching
+        pairings_by_player = {}
+        for p in previous_pairings:
+            pairings_by_player.setdefault(p.white_id, {}).setdefault(p.round.number, p)
+            pairings_by_player.setdefault(p.black_id, {}).setdefault(p.round.number, p)
+        byes_by_player = {}
+        for b in previous_byes:
+            byes_by_player.setdefault(b.player_id, {}).setdefault(b.round.number, b)
+
+        players = [
+            JavafoPlayer(
+                         sp.player, sp.get_loneplayerscore().pairing_points(),
+                         list(self._process_pairings(sp, pairings_by_player.get(sp.player_id, {}), byes_by_player.get(sp.player_id, {}),
+                                                     round_.number, sp.loneplayerscore.late_join_points))
+            ) for sp in season_players
+        ]
+        return self.engine_class(round_.season.rounds, players, self.is_cancelled, round_)
+
+    def _process_pairings(self, sp, player_pairings, player_byes, current_round_number, bonus_score):
+        # Note: player_pairings and player_byes are dicts of the player's pairings/byes by round number
         for n in range(1, current_round_number):
-            p = find(player_pairings, round__number=n)
-            b = find(player_byes, round__number=n)
+            p = player_pairings.get(n)
+            b = player_byes.get(n)
             if p is not None:
-                if p.white == sp.player:
+                if p.white_id == sp.player_id:
                     yield JavafoPairing(p.black, 'white', p.white_score(), forfeit=not p.game_played())
                 else:
                     yield JavafoPairing(p.white, 'black', p.black_score(), forfeit=not p.game_played())
@@ -238,48 +339,113 @@ class JavafoInstance:
     Arguments:
     total_round_count -- number of rounds in the tournament
     players -- a list of JavafoPlayer objects ordered by seed
+    is_cancelled -- an optional function that returns True if the run should be stopped
+    round_ -- the round being paired, which is recorded with the cached output
 
     Each player's list of pairings should be ordered by round number.
     '''
-    def __init__(self, total_round_count, players):
+    # The flags for the first attempt and for the fallback when it doesn't find pairings in time
+    javafo_flags = ('-q 10000', '-w')
+    use_cache = True
+    # Seconds between calls to is_cancelled while JaVaFo is running
+    cancel_check_interval = 1
+
+    def __init__(self, total_round_count, players, is_cancelled=None, round_=None):
         self.total_round_count = total_round_count
         self.players = players
+        self.is_cancelled = is_cancelled
+        self.round_ = round_
+        self.engine = None
+        self.start_numbers = {player.player: n for n, player in enumerate(players, 1)}
+
+    '''Builds the TRF input for javafo.jar
+
+    Returns the contents of the TRF file as a string.
+    '''
+    def trf(self):
+        lines = ['XXR %d' % self.total_round_count]
+        for n, player in enumerate(self.players, 1):
+            line = '001  {0: >3}  {1:74.1f}     '.format(n, player.score)
+            for pairing in player.pairings:
+                opponent_num = self.start_numbers.get(pairing.opponent, '0000')
+                color = 'w' if pairing.color == 'white' else 'b' if pairing.color == 'black' else '-'
+                if pairing.forfeit:
+                    score = '+' if pairing.score == 1 else '-' if pairing.score == 0 else '=' if pairing.score == 0.5 else ' '
+                else:
+                    score = '1' if pairing.score == 1 else '0' if pairing.score == 0 else '=' if pairing.score == 0.5 else ' '
+                if score == ' ':
+                    color = '-'
+                line += '{0: >6} {1} {2}'.format(opponent_num, color, score)
+            lines.append(line)
+        return '\n'.join(lines) + '\n'
 
     '''Runs the Javafo process
 
     Returns a list of JavafoPairingResult objects in the order they should be displayed.
     '''
     def run(self):
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise PairingsCancelledException()
+
+        trf = self.trf()
+        if not self.use_cache:
+            return self._parse_output(self._run_javafo(trf))
+
+        # JaVaFo's output only depends on its input, so identical re-runs can reuse the previous output. It's looked up
+        # for the jar that will run (the daemon's when it's enabled) and stored for the jar that actually ran.
+        entry = PairingCacheEntry.objects.filter(key=self.cache_key(trf)).nocache().first()
+        if entry is not None:
+            PairingCacheEntry.objects.filter(pk=entry.pk).update(hit_count=F('hit_count') + 1, last_hit=timezone.now())
+            self.engine = 'JaVaFo (cached)'
+            return self._parse_output(entry.output)
+
+        output = self._run_javafo(trf)
+        pairs = self._parse_output(output)
+        # Output that didn't pair anyone would only make later runs fail the same way
+        if len(pairs) > 0 or len(self.players) <= 1:
+            self._cache_output(trf, output, daemon=self.engine == 'JaVaFo (daemon)')
+        return pairs
+
+    '''Returns the cache key for the given TRF input (by default the instance's)
+
+    daemon -- whether the key is for JaVaFo run by the daemon, by default if the daemon is enabled
+    '''
+    def cache_key(self, trf=None, daemon=None):
+        if trf is None:
+            trf = self.trf()
+        if daemon is None:
+            daemon = javafodaemon.is_enabled()
+        return hashlib.sha256('\n'.join((_javafo_version(daemon), ' then '.join(self.javafo_flags), trf))).hexdigest()
+
+    def _cache_output(self, trf, output, daemon):
+        try:
+            # Use a savepoint so that a concurrent run caching the same output doesn't break the caller's transaction
+            with transaction.atomic():
+                PairingCacheEntry.objects.create(key=self.cache_key(trf, daemon), round=self.round_,
+                                                 engine='JaVaFo (daemon)' if daemon else 'JaVaFo',
+                                                 engine_version=_javafo_version(daemon), flags=' then '.join(self.javafo_flags),
+                                                 trf=trf, output=output)
+        except IntegrityError:
+            pass
+        # Entries that haven't been used for a while are for rounds that have long been paired
+        cutoff = timezone.now() - PAIRING_CACHE_MAX_AGE
+        PairingCacheEntry.objects.filter(date_created__lt=cutoff).filter(models.Q(last_hit=None) | models.Q(last_hit__lt=cutoff)).delete()
+
+    def _run_javafo(self, trf):
         input_file = tempfile.NamedTemporaryFile(suffix='.trfx')
         output_file_name = input_file.name + ".out.txt"
         try:
-            # Write to input file
-            input_file.write('XXR %d\n' % self.total_round_count)
-            for n, player in enumerate(self.players, 1):
-                line = '001  {0: >3}  {1:74.1f}     '.format(n, player.score)
-                for pairing in player.pairings:
-                    opponent_num = next((num for num, player in enumerate(self.players, 1) if player.player == pairing.opponent), '0000')
-                    color = 'w' if pairing.color == 'white' else 'b' if pairing.color == 'black' else '-'
-                    if pairing.forfeit:
-                        score = '+' if pairing.score == 1 else '-' if pairing.score == 0 else '=' if pairing.score == 0.5 else ' '
-                    else:
-                        score = '1' if pairing.score == 1 else '0' if pairing.score == 0 else '=' if pairing.score == 0.5 else ' '
-                    if score == ' ':
-                        color = '-'
-                    line += '{0: >6} {1} {2}'.format(opponent_num, color, score)
-                line += '\n'
-                input_file.write(line)
+            # JaVaFo only reads its input from a file, so write the whole TRF at once
+            input_file.write(trf)
             input_file.flush()
 
-            self._call_proc(input_file.name, output_file_name, '-q 10000')
-
-            pairs = self._read_output(output_file_name)
-            if len(pairs) == 0 and len(self.players) > 1:
+            for flags in self.javafo_flags:
+                self._call_proc(input_file.name, output_file_name, flags)
+                output = self._read_output(output_file_name)
+                if len(self._parse_output(output)) > 0 or len(self.players) <= 1:
+                    break
                 # Took too long before terminating, use the slower but more deterministic algorithm
-                self._call_proc(input_file.name, output_file_name, '-w')
-                pairs = self._read_output(output_file_name)
-
-            return pairs
+            return output
         finally:
             input_file.close()
             try:
@@ -288,19 +454,245 @@ class JavafoInstance:
                 pass
 
     def _call_proc(self, input_file_name, output_file_name, args):
-        proc = subprocess.Popen('%s %s -p %s %s' % (settings.JAVAFO_COMMAND, input_file_name, output_file_name, args), shell=True, stdout=subprocess.PIPE)
-        stdout = proc.communicate()[0]
+        if javafodaemon.is_enabled():
+            try:
+                result = javafodaemon.run([input_file_name, '-p', output_file_name] + args.split(), is_cancelled=self.is_cancelled)
+                if result is None:
+                    raise PairingsCancelledException()
+                returncode, stdout = result
+                if returncode == 0:
+                    self.engine = 'JaVaFo (daemon)'
+                    return
+                logger.warning('Javafo daemon return code: %s. Output: %s' % (returncode, stdout))
+            except javafodaemon.JavafoDaemonError as e:
+                logger.warning('Javafo daemon unavailable, falling back to a new process: %s' % e)
+        with tempfile.TemporaryFile() as stdout_file:
+            # exec replaces the shell so that killing the process stops JaVaFo itself
+            proc = subprocess.Popen('exec %s %s -p %s %s' % (settings.JAVAFO_COMMAND, input_file_name, output_file_name, args), shell=True, stdout=stdout_file)
+            self._wait(proc)
+            stdout_file.seek(0)
+            stdout = stdout_file.read()
         if proc.returncode != 0:
             raise RuntimeError('Javafo return code: %s. Output: %s' % (proc.returncode, stdout))
+        self.engine = 'JaVaFo'
+
+    def _wait(self, proc, poll_interval=0.05):
+        if self.is_cancelled is None:
+            proc.wait()
+            return
+        next_cancel_check = time.time() + self.cancel_check_interval
+        while proc.poll() is None:
+            if time.time() >= next_cancel_check:
+                if self.is_cancelled():
+                    proc.kill()
+                    proc.wait()
+                    raise PairingsCancelledException()
+                next_cancel_check = time.time() + self.cancel_check_interval
+            time.sleep(poll_interval)
 
     def _read_output(self, output_file_name):
         with open(output_file_name) as output_file:
-            pair_count = int(output_file.readline())
-            pairs = []
-            for _ in range(pair_count):
-                w, b = output_file.readline().split(' ')
-                if int(b) == 0:
-                    pairs.append([self.players[int(w) - 1].player, None])
-                else:
-                    pairs.append([self.players[int(w) - 1].player, self.players[int(b) - 1].player])
-            return pairs
+            return output_file.read()
+
+    def _parse_output(self, output):
+        lines = output.splitlines()
+        pair_count = int(lines[0])
+        pairs = []
+        for line in lines[1:pair_count + 1]:
+            w, b = line.split(' ')
+            if int(b) == 0:
+                pairs.append([self.players[int(w) - 1].player, None])
+            else:
+                pairs.append([self.players[int(w) - 1].player, self.players[int(b) - 1].player])
+        return pairs
+
+# Cached JaVaFo output that hasn't been used for this long is deleted
+PAIRING_CACHE_MAX_AGE = timedelta(days=90)
+
+def _javafo_version(daemon=False):
+    # Includes the size and modification time of any file in the command (i.e. javafo.jar, or the daemon's classpath)
+    # so that upgrading it invalidates cached output
+    if daemon:
+        command = '%s %s' % (settings.JAVAFO_DAEMON_COMMAND, settings.JAVAFO_DAEMON_MAIN_CLASS)
+    else:
+        command = settings.JAVAFO_COMMAND
+    parts = [command]
+    for token in command.split():
+        for path in token.split(os.pathsep):
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                parts.append('%s:%d:%d' % (path, stat.st_size, int(stat.st_mtime)))
+    return ' '.join(parts)
+
+class PythonSwissInstance(swiss.SwissInstance):
+    '''Runs the in-process Swiss engine with the same interface as JavafoInstance'''
+    def run(self):
+        try:
+            return swiss.SwissInstance.run(self)
+        except swiss.SwissCancelledException:
+            raise PairingsCancelledException()
+
+class PairingSearchInstance:
+    '''Runs several pairing strategies at once and picks the best result found before a deadline
+
+    Arguments:
+    total_round_count -- number of rounds in the tournament
+    players -- a list of JavafoPlayer objects ordered by seed
+    is_cancelled -- an optional function that returns True if the run should be stopped
+    round_ -- the round being paired (unused, accepted for compatibility with JavafoInstance)
+
+    Each strategy runs in its own thread. JaVaFo strategies spend their time in a separate java process and the
+    Python engine is the only one that needs the interpreter, so threads run them in parallel without a process pool
+    (which celery's daemonic workers aren't allowed to start). Results are compared with PairingQuality, preferring
+    earlier strategies when they're equally good. Strategies still running at the deadline are stopped, waiting at
+    most stop_timeout seconds for them to kill their JaVaFo processes.
+    '''
+    # (name, engine class, JaVaFo flags)
+    strategies = (
+        ('JaVaFo -w', JavafoInstance, ('-w',)),
+        ('JaVaFo -q 10000', JavafoInstance, ('-q 10000',)),
+        ('Python Swiss', PythonSwissInstance, None),
+    )
+    poll_interval = 0.05
+    cancel_check_interval = 1
+    stop_timeout = 1
+
+    def __init__(self, total_round_count, players, is_cancelled=None, round_=None):
+        self.total_round_count = total_round_count
+        self.players = players
+        self.is_cancelled = is_cancelled
+        self.engine = None
+        self.qualities = {}
+
+    def run(self):
+        stop = threading.Event()
+        results = {}
+        threads = []
+        for name, engine_class, javafo_flags in self.strategies:
+            engine = engine_class(self.total_round_count, self.players, is_cancelled=stop.is_set)
+            if javafo_flags is not None:
+                engine.javafo_flags = javafo_flags
+                engine.cancel_check_interval = self.poll_interval
+                # The cache is keyed by flags and needs a database connection, which isn't shared with the threads
+                engine.use_cache = False
+            thread = threading.Thread(target=self._run_strategy, args=(name, engine, stop, results))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        deadline = time.time() + settings.PAIRING_SEARCH_DEADLINE
+        next_cancel_check = time.time() + self.cancel_check_interval
+        try:
+            while any(t.is_alive() for t in threads) and time.time() < deadline:
+                if self.is_cancelled is not None and time.time() >= next_cancel_check:
+                    if self.is_cancelled():
+                        raise PairingsCancelledException()
+                    next_cancel_check = time.time() + self.cancel_check_interval
+                time.sleep(self.poll_interval)
+        finally:
+            stop.set()
+            stop_deadline = time.time() + self.stop_timeout
+            for t in threads:
+                t.join(max(0, stop_deadline - time.time()))
+
+        best = None
+        for n, (name, _, _) in enumerate(self.strategies):
+            if name not in results:
+                logger.warning('Pairing strategy %s did not finish within %s seconds' % (name, settings.PAIRING_SEARCH_DEADLINE))
+                continue
+            engine_name, pairs = results[name]
+            quality = PairingQuality(self.players, pairs)
+            self.qualities[name] = quality
+            if best is None or (quality.key(), n) < best[0]:
+                best = ((quality.key(), n), engine_name, pairs)
+        if best is None:
+            return []
+        self.engine = best[1]
+        return best[2]
+
+    def _run_strategy(self, name, engine, stop, results):
+        try:
+            pairs = engine.run()
+        except PairingsCancelledException:
+            return
+        except Exception:
+            logger.exception('Pairing strategy %s failed' % name)
+            return
+        if not stop.is_set():
+            results[name] = (engine.engine or name, pairs)
+
+class PairingQuality:
+    '''Measures the defects in a set of pairs returned by a pairing engine
+
+    Arguments:
+    players -- the list of JavafoPlayer objects given to the engine
+    pairs -- the list of [white, black] pairs returned by the engine
+
+    key() orders qualities from best to worst: repeat opponents, unpaired players, colour errors (a colour
+    difference above 2 or the same colour three times in a row), score-group floats and the total score difference.
+    '''
+    def __init__(self, players, pairs):
+        history = {p.player: p for p in players}
+        paired = [p for pair in pairs for p in pair if p is not None]
+        self.unpaired_count = len(players) - len(paired)
+        self.repeat_count = 0
+        self.color_error_count = 0
+        self.float_count = 0
+        self.score_difference = 0
+        for white, black in pairs:
+            if black is None:
+                continue
+            w, b = history[white], history[black]
+            if black in {p.opponent for p in w.pairings}:
+                self.repeat_count += 1
+            if w.score != b.score:
+                self.float_count += 1
+                self.score_difference += abs(w.score - b.score)
+            for player, color in ((w, 'white'), (b, 'black')):
+                colors = [p.color for p in player.pairings if p.opponent is not None and not p.forfeit] + [color]
+                if abs(colors.count('white') - colors.count('black')) > 2 or colors[-3:] == [color] * 3:
+                    self.color_error_count += 1
+
+    def key(self):
+        return (self.repeat_count, self.unpaired_count, self.color_error_count, self.float_count, self.score_difference)
+
+# Engines take the same arguments as JavafoInstance and return pairs from run() in the same format
+PAIRING_ENGINES = {
+    'javafo': JavafoInstance,
+    'python': PythonSwissInstance,
+    'search': PairingSearchInstance,
+}
+
+def get_pairing_engine_class(name=None):
+    return PAIRING_ENGINES[name or getattr(settings, 'PAIRING_ENGINE', 'javafo')]
+
+def parse_trf(trf):
+    '''Parses TRF input in the format written by JavafoInstance.trf
+
+    Returns a JavafoInstance whose players are identified by their start numbers, so that calling trf() on it
+    reproduces the input.
+    '''
+    lines = trf.splitlines()
+    total_round_count = int(lines[0].split()[1])
+    players = []
+    for line in lines[1:]:
+        if not line.startswith('001'):
+            continue
+        start_number = int(line[5:8])
+        score = float(line[10:84])
+        pairings = []
+        for i in range(89, len(line), 10):
+            opponent_num = int(line[i:i + 6])
+            opponent = opponent_num if opponent_num != 0 else None
+            color = {'w': 'white', 'b': 'black'}.get(line[i + 7])
+            score_char = line[i + 9:i + 10] or ' '
+            if score_char in '+-':
+                pairings.append(JavafoPairing(opponent, color, 1 if score_char == '+' else 0, forfeit=True))
+            elif score_char in '10':
+                pairings.append(JavafoPairing(opponent, color, int(score_char)))
+            elif score_char == '=':
+                pairings.append(JavafoPairing(opponent, color, 0.5, forfeit=opponent is None))
+            else:
+                pairings.append(JavafoPairing(opponent, color, None, forfeit=True))
+        players.append(JavafoPlayer(start_number, score, pairings))
+    return JavafoInstance(total_round_count, players)
@@ -0,0 +1,186 @@
+from collections import defaultdict
+
+from heltour.tournament import pairinggen
+from heltour.tournament.models import *
+
+SIMULATED_RESULT_OPTIONS = (
+    ('rating', 'Higher rated player wins'),
+    ('draw', 'All draws'),
+    ('white', 'White wins'),
+)
+
+class SeasonSimulation:
+    '''Simulates the pairings and standings of upcoming rounds in a lone season without saving anything
+
+    Arguments:
+    season -- a lone league season
+
+    The season is loaded once. Each call to run() starts from that snapshot and pairs the rounds after the last completed
+    one in memory, applying late registrations, withdrawls and byes the same way generate_pairings would, filling in
+    hypothetical results and recalculating the standings before pairing the next round. Rounds with published pairings
+    keep them.
+    '''
+    def __init__(self, season):
+        if season.league.competitor_type == 'team':
+            raise ValueError('Only lone seasons can be simulated')
+        self.season = season
+        self.rounds = list(season.round_set.order_by('number').nocache())
+        self.season_players = list(SeasonPlayer.objects.filter(season=season).select_related('player', 'loneplayerscore').nocache())
+        self.pairings = list(LonePlayerPairing.objects.filter(round__season=season).select_related('round', 'white', 'black').nocache())
+        self.byes = list(PlayerBye.objects.filter(round__season=season).select_related('round', 'player').nocache())
+        self.registrations = list(PlayerLateRegistration.objects.filter(round__season=season).select_related('player').order_by('pk').nocache())
+        self.withdrawls = list(PlayerWithdrawl.objects.filter(round__season=season).select_related('player').order_by('pk').nocache())
+
+    '''Simulates the next rounds
+
+    round_count -- the number of rounds to simulate, starting with the first round that isn't completed
+    result_mode -- how to fill in results that aren't in results (see SIMULATED_RESULT_OPTIONS)
+    results -- a dict of {(round number, white player id, black player id): result} for hypothetical results
+    apply_changes -- whether to perform the rounds' late registrations and withdrawls
+    engine_class -- the pairing engine to use, by default the PAIRING_ENGINE setting
+
+    Returns a list of SimulatedRound objects.
+    '''
+    def run(self, round_count=1, result_mode='rating', results=None, apply_changes=True, engine_class=None, is_cancelled=None):
+        results = results or {}
+        rounds_by_id = {r.id: r for r in self.rounds}
+        state = _SimulationState(self)
+        pairing_system = pairinggen.DutchLonePairingSystem(is_cancelled, engine_class)
+
+        simulated_rounds = []
+        upcoming_rounds = [r for r in self.rounds if not r.is_completed][:round_count]
+        for round_ in upcoming_rounds:
+            sim_round = SimulatedRound(round_)
+            if round_.publish_pairings:
+                sim_round.engine = 'Published'
+                sim_round.pairings = [p for p in state.pairings if p.round_id == round_.id]
+            else:
+                # Unpublished pairings would be overwritten when the round is paired
+                state.pairings = [p for p in state.pairings if p.round_id != round_.id]
+                state.byes = [b for b in state.byes if b.round_id != round_.id or b.type != 'full-point-pairing-bye']
+                if apply_changes:
+                    sim_round.registrations = state.register([r for r in self.registrations if r.round_id == round_.id])
+                    sim_round.withdrawls = state.withdraw([w for w in self.withdrawls if w.round_id == round_.id])
+                state.calculate_scores(round_.number - 1)
+
+                # Mirrors _lone_pairing_input
+                current_byes = {b.player_id for b in state.byes if b.round_id == round_.id}
+                season_players = [sp for sp in state.season_players if sp.is_active and sp.player_id not in current_byes]
+                for sp in season_players:
+                    if sp.seed_rating is None:
+                        sp.seed_rating = sp.player.rating
+                season_players.sort(key=lambda sp: sp.loneplayerscore.pairing_sort_key(), reverse=True)
+                previous_pairings = sorted((p for p in state.pairings if rounds_by_id[p.round_id].number < round_.number),
+                                           key=lambda p: rounds_by_id[p.round_id].number)
+                previous_byes = sorted((b for b in state.byes if rounds_by_id[b.round_id].number < round_.number),
+                                       key=lambda b: rounds_by_id[b.round_id].number)
+
+                engine = pairing_system.engine_instance(round_, season_players, previous_pairings, previous_byes)
+                # Cached output is keyed by round and written to the database, so run the engine directly
+                engine.use_cache = False
+                pairs = engine.run()
+                sim_round.engine = engine.engine
+                sim_round.pairings, pairing_byes = pairing_system.lone_pairings_from_pairs(round_, pairs)
+                state.pairings += sim_round.pairings
+                state.byes += pairing_byes
+
+            for p in sim_round.pairings:
+                if not p.result:
+                    p.result = results.get((round_.number, p.white_id, p.black_id)) or _simulated_result(p, result_mode)
+            sim_round.byes = [b for b in state.byes if b.round_id == round_.id]
+            sim_round.standings = state.calculate_scores(round_.number)
+            simulated_rounds.append(sim_round)
+        return simulated_rounds
+
+class SimulatedRound:
+    def __init__(self, round_):
+        self.round = round_
+        self.engine = None
+        self.pairings = []
+        self.byes = []
+        self.registrations = []
+        self.withdrawls = []
+        # A list of (rank, SeasonPlayer, LonePlayerScore) after the round
+        self.standings = []
+
+class _SimulationState:
+    # Copies of the snapshot's objects that a single run can modify
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.rounds = simulation.rounds
+        self.season_players = [_copy(sp) for sp in simulation.season_players]
+        for sp in self.season_players:
+            score = getattr(sp, 'loneplayerscore', None)
+            sp.loneplayerscore = _copy(score) if score is not None else LonePlayerScore(season_player=sp)
+            sp.loneplayerscore.season_player = sp
+        self.pairings = [_copy(p) for p in simulation.pairings]
+        self.byes = list(simulation.byes)
+
+    def register(self, registrations):
+        # Mirrors PlayerLateRegistration.perform_registration
+        season_players = {sp.player_id: sp for sp in self.season_players}
+        for reg in registrations:
+            sp = season_players.get(reg.player_id)
+            if sp is None:
+                sp = SeasonPlayer(season=self.simulation.season, player=reg.player)
+                sp.loneplayerscore = LonePlayerScore(season_player=sp)
+                self.season_players.append(sp)
+                season_players[reg.player_id] = sp
+            sp.is_active = True
+            round_number = find(self.rounds, id=reg.round_id).number
+            for i in range(reg.retroactive_byes):
+                round_ = find(self.rounds, number=round_number - i - 1)
+                if round_ is None:
+                    continue
+                has_pairing = any(p.round_id == round_.id and reg.player_id in (p.white_id, p.black_id) for p in self.pairings)
+                has_bye = any(b.round_id == round_.id and b.player_id == reg.player_id for b in self.byes)
+                if not has_pairing and not has_bye:
+                    self.byes.append(PlayerBye(round=round_, player=reg.player, type='half-point-bye'))
+            sp.loneplayerscore.late_join_points = reg.late_join_points
+        return registrations
+
+    def withdraw(self, withdrawls):
+        # Mirrors PlayerWithdrawl.perform_withdrawl for a round without pairings
+        season_players = {sp.player_id: sp for sp in self.season_players}
+        for wd in withdrawls:
+            sp = season_players.get(wd.player_id)
+            if sp is not None:
+                sp.is_active = False
+        return withdrawls
+
+    def calculate_scores(self, round_count):
+        # Mirrors Season.calculate_scores, counting the simulated rounds up to round_count as completed
+        rounds = [r for r in self.rounds if r.number <= round_count]
+        white_index = defaultdict(dict)
+        black_index = defaultdict(dict)
+        bye_index = defaultdict(dict)
+        for p in self.pairings:
+            white_index[p.round_id].setdefault(p.white_id, p)
+            black_index[p.round_id].setdefault(p.black_id, p)
+        for b in self.byes:
+            bye_index[b.round_id].setdefault(b.player_id, b)
+
+        matrix = lone_score_matrix(self.season_players, rounds, white_index, black_index, bye_index)
+        for sp, values in zip(self.season_players, lone_standings(matrix)):
+            for field, value in values.items():
+                setattr(sp.loneplayerscore, field, value)
+
+        # Later rounds keep changing the scores, so return copies
+        ranked = sorted(self.season_players, key=lambda sp: sp.loneplayerscore.pairing_sort_key(), reverse=True)
+        return [(n, sp, _copy(sp.loneplayerscore)) for n, sp in enumerate(ranked, 1)]
+
+def _copy(obj):
+    # A shallow copy of a model instance that keeps its cached related objects
+    copy = obj.__class__.__new__(obj.__class__)
+    copy.__dict__ = obj.__dict__.copy()
+    return copy
+
+def _simulated_result(pairing, result_mode):
+    if result_mode == 'draw':
+        return '1/2-1/2'
+    if result_mode == 'white':
+        return '1-0'
+    white_rating = pairing.white.rating or 0
+    black_rating = pairing.black.rating or 0
+    return '1-0' if white_rating > black_rating else '0-1' if black_rating > white_rating else '1/2-1/2'
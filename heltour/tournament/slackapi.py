@@ -1,14 +1,24 @@
-import requests
+import os
 from heltour import settings
+from heltour.tournament import httpclient
 from collections import namedtuple
 
+# (path, modification time, token)
+_slack_token = (None, None, None)
+
 def _get_slack_token():
-    with open(settings.SLACK_API_TOKEN_FILE_PATH) as fin:
-        return fin.read().strip()
+    # Only re-read the token file when it changes
+    global _slack_token
+    path = settings.SLACK_API_TOKEN_FILE_PATH
+    mtime = os.path.getmtime(path)
+    if _slack_token[:2] != (path, mtime):
+        with open(path) as fin:
+            _slack_token = (path, mtime, fin.read().strip())
+    return _slack_token[2]
 
 def invite_user(email):
     url = 'https://slack.com/api/users.admin.invite'
-    r = requests.get(url, params={'token': _get_slack_token(), 'email': email})
+    r = httpclient.session('slack').get(url, params={'token': _get_slack_token(), 'email': email})
     json = r.json()
     if not json['ok']:
         if json['error'] == 'already_invited':
@@ -21,7 +31,7 @@ SlackUser = namedtuple('SlackUser', ['name', 'email'])
 
 def get_user_list():
     url = 'https://slack.com/api/users.list'
-    r = requests.get(url, params={'token': _get_slack_token()})
+    r = httpclient.session('slack').get(url, params={'token': _get_slack_token()})
     json = r.json()
     if not json['ok']:
         raise SlackError(json['error'])
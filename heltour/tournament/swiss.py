@@ -0,0 +1,200 @@
+import networkx as nx
+
+# Matching takes cubic time, so larger brackets are first tried with only the edges near each player's Dutch partner
+_SPARSE_BRACKET_SIZE = 40
+_SPARSE_WINDOW = 8
+
+class SwissCancelledException(Exception):
+    pass
+
+class SwissInstance:
+    '''An in-process Dutch Swiss pairing engine
+
+    Arguments:
+    total_round_count -- number of rounds in the tournament
+    players -- a list of JavafoPlayer objects ordered by seed
+    is_cancelled -- an optional function that returns True if the run should be stopped
+    round_ -- the round being paired (unused, accepted for compatibility with JavafoInstance)
+
+    Players are split into score groups and each group is paired with a maximum-cardinality, maximum-weight matching,
+    with any players that can't be paired floating down to the next group. Edge weights rank the criteria in order: the
+    bye going to the lowest player, absolute colour preferences, score differences, other colour preferences, and
+    finally the Dutch top-half vs. bottom-half order. Players never meet twice.
+    '''
+    engine = 'Python Swiss'
+
+    def __init__(self, total_round_count, players, is_cancelled=None, round_=None):
+        self.total_round_count = total_round_count
+        self.players = players
+        self.is_cancelled = is_cancelled
+
+    '''Pairs the next round
+
+    Returns a list of [white, black] pairs in the order they should be displayed, with [player, None] for a bye,
+    or an empty list if no valid pairing exists.
+    '''
+    def run(self):
+        players = [_SwissPlayer(n, p) for n, p in enumerate(self.players)]
+        ranked = sorted(players, key=_SwissPlayer.rank_key)
+
+        groups = []
+        for p in ranked:
+            if groups and groups[-1][0].score == p.score:
+                groups[-1].append(p)
+            else:
+                groups.append([p])
+
+        pairs = []
+        floaters = []
+        for i in range(len(groups) - 1):
+            if self.is_cancelled is not None and self.is_cancelled():
+                raise SwissCancelledException()
+            bracket = floaters + groups[i]
+            bracket_pairs = self._match(bracket)
+            pairs += bracket_pairs
+            paired = {p for pair in bracket_pairs for p in pair}
+            floaters = [p for p in bracket if p not in paired]
+
+        final_pairs = self._match(floaters + (groups[-1] if groups else []), complete=True)
+        if final_pairs is not None and any(b is None and a.had_bye for a, b in final_pairs) and not all(p.had_bye for p in players):
+            # Let a player from a higher score group have the bye instead of giving someone a second one
+            final_pairs = None
+        if final_pairs is None:
+            # Earlier groups were paired in a way that leaves the rest unpairable, so pair everyone at once
+            pairs = self._match(ranked, complete=True)
+            if pairs is None:
+                return []
+        else:
+            pairs += final_pairs
+
+        return self._allocate_colors(pairs)
+
+    def _match(self, bracket, complete=False):
+        # Returns a list of (higher ranked player, lower ranked player or None) tuples, leaving out players who can't be
+        # paired. If complete is True, the lowest player gets a bye if needed and None is returned if anyone is left out.
+        if len(bracket) > _SPARSE_BRACKET_SIZE:
+            pairs = self._match_with_window(bracket, complete, _SPARSE_WINDOW)
+            if pairs is not None and sum(1 if b is None else 2 for a, b in pairs) >= len(bracket) - 1:
+                return pairs
+        return self._match_with_window(bracket, complete, None)
+
+    def _match_with_window(self, bracket, complete, window):
+        candidates = sorted(bracket, key=_SwissPlayer.rank_key)
+        positions = {p: n for n, p in enumerate(candidates)}
+        group_sizes = {}
+        for p in candidates:
+            group_sizes[p.score] = group_sizes.get(p.score, 0) + 1
+        max_score_diff = int(round(4 * self.total_round_count)) + 1
+
+        edges = []
+        for n, a in enumerate(candidates):
+            for b in candidates[n + 1:]:
+                if b.player in a.opponents or a.player in b.opponents:
+                    continue
+                (pref_a, strength_a), (pref_b, strength_b) = a.color_preference(), b.color_preference()
+                color_conflict = pref_a is not None and pref_a == pref_b
+                score_diff = int(round(2 * abs(a.score - b.score)))
+                if a.score == b.score:
+                    # Dutch system: the top half of a score group is paired against the bottom half in order
+                    distance = abs((positions[b] - positions[a]) - group_sizes[a.score] // 2)
+                    if window is not None and distance > window:
+                        continue
+                    order = len(candidates) - distance
+                else:
+                    # Players floating down are paired with the highest ranked players they can be
+                    if window is not None and positions[b] - positions[a] > 2 * window:
+                        continue
+                    order = len(candidates) - positions[b]
+                edges.append((a, b, (
+                    0,
+                    0 if color_conflict and strength_a == 3 and strength_b == 3 else 1,
+                    max_score_diff ** 2 - score_diff ** 2,
+                    0 if color_conflict else 1,
+                    order,
+                )))
+        if complete and len(candidates) % 2 == 1:
+            # Lower scores get the bye first, then lower rankings, preferring players who haven't had one
+            for a in candidates:
+                edges.append((a, None, ((0 if a.had_bye else max_score_diff) + max_score_diff - int(round(2 * a.score)),
+                                        1, max_score_diff ** 2, 1, positions[a])))
+
+        graph = nx.Graph()
+        graph.add_nodes_from(candidates)
+        for a, b, weight in zip(*_weigh(edges, len(candidates) // 2 + 1)):
+            graph.add_edge(a, b if b is not None else 'bye', weight=weight)
+        mate = nx.max_weight_matching(graph, maxcardinality=True)
+        if not isinstance(mate, dict):
+            mate = dict(list(mate) + [(b, a) for a, b in mate])
+
+        pairs = []
+        for p in candidates:
+            other = mate.get(p)
+            if other is None:
+                if complete:
+                    return None
+                continue
+            if other == 'bye':
+                pairs.append((p, None))
+            elif positions[p] < positions[other]:
+                pairs.append((p, other))
+        return pairs
+
+    def _allocate_colors(self, pairs):
+        pairs = sorted(pairs, key=lambda pair: (pair[1] is None, pair[0].rank_key()))
+        results = []
+        for board_number, (a, b) in enumerate(pairs, 1):
+            if b is None:
+                results.append([a.player, None])
+                continue
+            (pref_a, strength_a), (pref_b, strength_b) = a.color_preference(), b.color_preference()
+            if pref_a is None and pref_b is None:
+                # No history, so alternate colours down the boards starting with white for the top player
+                a_is_white = board_number % 2 == 1
+            elif pref_a is not None and (pref_a != pref_b or strength_a >= strength_b):
+                # The higher ranked player wins ties between equally strong preferences
+                a_is_white = pref_a == 'white'
+            else:
+                a_is_white = pref_b == 'black'
+            results.append([a.player, b.player] if a_is_white else [b.player, a.player])
+        return results
+
+def _weigh(edges, max_edge_count):
+    # Combines each edge's tuple of criteria into a single integer weight, where each criterion outweighs the total of
+    # all the less important criteria over a whole matching
+    if not edges:
+        return [], [], []
+    layer_count = len(edges[0][2])
+    maximums = [max(e[2][n] for e in edges) for n in range(layer_count)]
+    multipliers = [1] * layer_count
+    for n in range(layer_count - 2, -1, -1):
+        multipliers[n] = multipliers[n + 1] * (max_edge_count * maximums[n + 1] + 1)
+    weights = [sum(value * multiplier for value, multiplier in zip(e[2], multipliers)) for e in edges]
+    return [e[0] for e in edges], [e[1] for e in edges], weights
+
+class _SwissPlayer:
+    def __init__(self, index, javafo_player):
+        self.index = index
+        self.player = javafo_player.player
+        self.score = javafo_player.score
+        pairings = javafo_player.pairings
+        self.opponents = {p.opponent for p in pairings if p.opponent is not None}
+        colors = [p.color for p in pairings if p.opponent is not None and not p.forfeit and p.color in ('white', 'black')]
+        self.color_diff = colors.count('white') - colors.count('black')
+        self.last_colors = colors[-2:]
+        # Players who have had a bye or a forfeit win shouldn't get a pairing bye
+        self.had_bye = any(p.score == 1 and (p.opponent is None or p.forfeit) for p in pairings)
+
+    def rank_key(self):
+        return (-self.score, self.index)
+
+    def color_preference(self):
+        '''Returns (color, strength) where strength is 3 for absolute, 2 for strong and 1 for mild preferences'''
+        if self.color_diff < -1 or self.last_colors == ['black', 'black']:
+            return 'white', 3
+        if self.color_diff > 1 or self.last_colors == ['white', 'white']:
+            return 'black', 3
+        if self.color_diff != 0:
+            return ('white' if self.color_diff < 0 else 'black'), 2
+        if self.last_colors:
+            return ('white' if self.last_colors[-1] == 'black' else 'black'), 1
+        return None, 0
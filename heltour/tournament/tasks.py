@@ -1,58 +1,167 @@
 from heltour.tournament.models import *
-from heltour.tournament import lichessapi, slackapi
+from heltour.tournament import lichessapi, slackapi, pairinggen
 from heltour.celery import app
 from celery.utils.log import get_task_logger
+from django.core.cache import cache
+from django.utils import timezone
+from heltour import settings
+import math
+from collections import defaultdict
 
 logger = get_task_logger(__name__)
 
-# Disabled for now because of rate-limiting
-lichess_teams = [] # ['lichess4545-league']
-
 @app.task(bind=True)
 def update_player_ratings(self):
-    players = Player.objects.all()
-    player_dict = {p.lichess_username: p for p in players}
-
-    # Query players from the bulk user endpoint based on our lichess teams
-    for team_name in lichess_teams:
-        for username, rating, games_played in lichessapi.enumerate_user_classical_rating_and_games_played(team_name, 0):
-            # Remove the player from the dict
-            p = player_dict.pop(username, None)
-            if p is not None:
-                p.rating, p.games_played = rating, games_played
-                p.save()
-
-    # Any players not found above will be queried individually
-    for username, p in player_dict.items():
-        try:
-            p.rating, p.games_played = lichessapi.get_user_classical_rating_and_games_played(username, 0)
-            p.save()
-        except Exception as e:
-            logger.warning('Error getting rating for %s: %s' % (username, e))
-
-    logger.info('Updated ratings for %d players', len(players))
+    now = timezone.now()
+    players = _players_due_for_rating_update(now)
+    player_dict = {p.lichess_username.lower(): p for p in players}
+
+    def report_progress(current, total):
+        self.update_state(state='PROGRESS', meta={'current': current, 'total': total})
+        logger.info('Looked up ratings for %d of %d players', current, total)
+
+    failed_usernames = set()
+    def chunk_failed(usernames, error):
+        # Still update the players in the other chunks. These ones stay due, so they're looked up again next run.
+        logger.warning('Error looking up ratings for %d players: %s', len(usernames), error)
+        failed_usernames.update(usernames)
+
+    # Query players from the bulk user endpoint, a few hundred at a time
+    changed_players = []
+    found_count = 0
+    for username, rating, games_played in lichessapi.get_users_classical_rating_and_games_played(list(player_dict.keys()), 0,
+                                                                                                progress=report_progress,
+                                                                                                on_error=chunk_failed):
+        # Remove the player from the dict
+        p = player_dict.pop(username.lower(), None)
+        if p is not None:
+            found_count += 1
+            # Only write players whose rating has actually changed
+            if (p.rating, p.games_played) != (rating, games_played):
+                p.rating, p.games_played, p.rating_updated = rating, games_played, now
+                changed_players.append(p)
+
+    # Any players not found above have closed their accounts or haven't played classical
+    not_found_count = len(set(player_dict) - failed_usernames)
+    if not_found_count:
+        logger.info('No classical rating found for %d players', not_found_count)
+
+    # Every player that was looked up waits its turn again. The timestamp alone doesn't change anything that's
+    # displayed, so it's written without invalidating the cache.
+    changed_pks = {p.pk for p in changed_players}
+    Player.objects.filter(pk__in=[p.pk for p in players if p.pk not in changed_pks
+                                  and p.lichess_username.lower() not in failed_usernames]).update(rating_updated=now)
+    bulk_update(Player, changed_players, ['rating', 'games_played', 'rating_updated'])
+
+    logger.info('Updated ratings for %d players (%d changed)', found_count, len(changed_players))
+
+# Returns the players whose ratings should be refreshed in this run, most important first. Players in seasons that
+# aren't completed are due every RATING_UPDATE_ACTIVE_AGE and everyone else every RATING_UPDATE_DORMANT_AGE. Each run
+# takes about one interval's share of each group, so that the lookups are spread evenly instead of all falling due at
+# once.
+def _players_due_for_rating_update(now):
+    current_player_ids = set(SeasonPlayer.objects.filter(season__is_completed=False, is_active=True).values_list('player_id', flat=True))
+    current_player_ids |= set(Alternate.objects.filter(season_player__season__is_completed=False)
+                                               .values_list('season_player__player_id', flat=True))
+    players = list(Player.objects.all().nocache())
+
+    interval = settings.RATING_UPDATE_INTERVAL.total_seconds()
+    active_age = settings.RATING_UPDATE_ACTIVE_AGE.total_seconds()
+    dormant_age = settings.RATING_UPDATE_DORMANT_AGE.total_seconds()
+    active_count = sum(1 for p in players if p.pk in current_player_ids)
+    batch_size = int(math.ceil(active_count * interval / active_age + (len(players) - active_count) * interval / dormant_age))
+
+    def is_due(p):
+        if p.rating_updated is None:
+            return True
+        # Runs don't start at exactly the same second, so allow up to an interval early rather than a whole interval late
+        max_age = active_age if p.pk in current_player_ids else dormant_age
+        return (now - p.rating_updated).total_seconds() > max_age - interval
+
+    due = [p for p in players if is_due(p)]
+    # Current players first, then the ones that were never updated, then the stalest
+    due.sort(key=lambda p: (p.pk not in current_player_ids, p.rating_updated is not None, p.rating_updated))
+    return due[:batch_size]
 
 @app.task(bind=True)
 def update_tv_state(self):
     games_to_update = PlayerPairing.objects.filter(result='', tv_state='default').exclude(game_link='').nocache()
-
+    games_by_id = defaultdict(list)
     for game in games_to_update:
         gameid = get_gameid_from_gamelink(game.game_link)
         if gameid is not None:
-            try:
-                meta = lichessapi.get_game_meta(gameid, priority=1)
-                if 'status' not in meta or meta['status'] != 'started':
+            games_by_id[gameid].append(game)
+
+    # Look the games up a few hundred at a time and hide the ones that have finished
+    finished_games = []
+    try:
+        for meta in lichessapi.get_game_metas(list(games_by_id.keys()), priority=1):
+            if meta.get('status') != 'started':
+                for game in games_by_id.get(meta.get('id'), []):
                     game.tv_state = 'hide'
-                    game.save()
-            except Exception as e:
-                logger.warning('Error updating tv state for %s: %s' % (game.game_link, e))
+                    finished_games.append(game)
+    except Exception as e:
+        # Still hide the games that were found before the error
+        logger.warning('Error updating tv state: %s' % e)
+
+    bulk_update(PlayerPairing, finished_games, ['tv_state'])
 
 @app.task(bind=True)
 def update_slack_users(self):
     slack_users = slackapi.get_user_list()
     name_set = {u.name.lower() for u in slack_users}
-    for p in Player.objects.all():
+    changed_players = []
+    for p in Player.objects.all().nocache():
         in_slack_group = p.lichess_username.lower() in name_set
         if in_slack_group != p.in_slack_group:
             p.in_slack_group = in_slack_group
-            p.save()
+            changed_players.append(p)
+    bulk_update(Player, changed_players, ['in_slack_group'])
+
+@app.task(bind=True)
+def calculate_season_scores(self, season_id):
+    lock_key = 'season_scores_lock_%d' % season_id
+    if not cache.add(lock_key, True, 60 * 5):
+        # Another calculation for this season is still running
+        raise self.retry(countdown=SCORE_CALCULATION_DELAY, max_retries=None)
+    try:
+        # Any changes from this point on will schedule another calculation
+        cache.delete('season_scores_scheduled_%d' % season_id)
+        Season.objects.get(pk=season_id).calculate_stale_scores()
+    finally:
+        cache.delete(lock_key)
+
+@app.task(bind=True)
+def run_pairing_job(self, job_id):
+    job = PairingJob.objects.select_related('round').nocache().get(pk=job_id)
+    if job.status != 'queued':
+        # Cancelled before it started
+        return
+    job.status = 'running'
+    job.started = timezone.now()
+    _save_pairing_job(job)
+
+    try:
+        job.engine = pairinggen.generate_pairings(job.round, overwrite=job.overwrite, is_cancelled=job.is_cancel_requested) or ''
+        round_ = Round.objects.nocache().get(pk=job.round_id)
+        round_.publish_pairings = False
+        round_.save()
+        job.status = 'done'
+    except pairinggen.PairingsCancelledException:
+        job.status = 'cancelled'
+    except pairinggen.PairingsExistException:
+        job.status = 'failed'
+        job.error = 'Pairings already exist for the selected round.'
+    except pairinggen.PairingHasResultException:
+        job.status = 'failed'
+        job.error = 'Pairings with results can\'t be overwritten.'
+    except Exception as e:
+        logger.exception('Error generating pairings for %s' % job.round)
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished = timezone.now()
+    _save_pairing_job(job)
+
+def _save_pairing_job(job):
+    # Don't overwrite cancel_requested, which is set by the admin while the job runs
+    job.save(update_fields=['status', 'engine', 'started', 'finished', 'error', 'date_modified'])
@@ -0,0 +1,61 @@
+import socket
+import struct
+import threading
+
+from django.test import SimpleTestCase
+from heltour.tournament.javafodaemon import NailgunConnection
+
+def _read_chunk(sock):
+    header = ''
+    while len(header) < 5:
+        header += sock.recv(5 - len(header))
+    length, chunk_type = struct.unpack('>iB', header)
+    payload = ''
+    while len(payload) < length:
+        payload += sock.recv(length - len(payload))
+    return chr(chunk_type), payload
+
+def _send_chunk(sock, chunk_type, payload):
+    sock.sendall(struct.pack('>iB', len(payload), ord(chunk_type)) + payload)
+
+class NailgunConnectionTestCase(SimpleTestCase):
+    def _serve(self, heartbeats=0):
+        client_sock, server_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        self.addCleanup(server_sock.close)
+        received = []
+
+        def server():
+            while True:
+                chunk = _read_chunk(server_sock)
+                received.append(chunk)
+                if chunk[0] == 'C':
+                    break
+            _send_chunk(server_sock, 'S', '')
+            received.append(_read_chunk(server_sock))
+            # Keep the client waiting until it has sent the given number of heartbeats
+            for _ in range(heartbeats):
+                received.append(_read_chunk(server_sock))
+            _send_chunk(server_sock, '1', 'Pairing ')
+            _send_chunk(server_sock, '2', 'ignored')
+            _send_chunk(server_sock, '1', 'done')
+            _send_chunk(server_sock, 'X', '3\n')
+
+        thread = threading.Thread(target=server)
+        thread.start()
+        self.addCleanup(thread.join)
+        return client_sock, received
+
+    def test_call(self):
+        sock, received = self._serve()
+        result = NailgunConnection(sock).call('javafo.JaVaFo', ['in.trfx', '-p', 'out.txt'], '/tmp')
+
+        self.assertEqual((3, 'Pairing done'), result)
+        self.assertEqual([('A', 'in.trfx'), ('A', '-p'), ('A', 'out.txt'), ('D', '/tmp'), ('C', 'javafo.JaVaFo'), ('.', '')], received)
+
+    def test_heartbeat(self):
+        sock, received = self._serve(heartbeats=3)
+        result = NailgunConnection(sock, heartbeat_interval=0.05).call('javafo.JaVaFo', [], '/tmp')
+
+        self.assertEqual((3, 'Pairing done'), result)
+        self.assertEqual([('.', ''), ('H', ''), ('H', ''), ('H', '')], received[-4:])
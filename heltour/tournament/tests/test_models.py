@@ -1,7 +1,10 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from heltour.tournament.models import *
 from datetime import datetime
 from django.utils import timezone
+from django.core.cache import cache
 
 def createCommonLeagueData():
     team_count = 4
@@ -100,6 +103,72 @@ class SeasonTestCase(TestCase):
         rounds[0].save()
         self.assertItemsEqual([(1, 2, 2, 0, 2, 0), (1, 0, 1, 0, 1, 0), (1, 1, 1.5, 1, 1, 0.5), (1, 1, 1.5, 1, 1, 0.5)], score_matrix())
 
+    def test_season_calculate_team_scores_unchanged(self):
+        season = Season.objects.get(tag='teamseason')
+        rounds = list(season.round_set.order_by('number'))
+        teams = list(season.team_set.order_by('number'))
+
+        TeamPairing.objects.create(round=rounds[0], pairing_order=0, white_team=teams[0], black_team=teams[1], white_points=2.0, white_wins=2, black_points=0, black_wins=0)
+        rounds[0].is_completed = True
+        rounds[0].save()
+
+        def modified_dates():
+            return [s.date_modified for s in TeamScore.objects.order_by('team__number')]
+
+        before = modified_dates()
+        season.calculate_scores()
+        self.assertEqual(before, modified_dates())
+
+    def test_season_schedule_score_calculation(self):
+        season = Season.objects.get(tag='loneseason')
+        round1 = season.round_set.get(number=1)
+        sp1, sp2 = season.seasonplayer_set.all()[:2]
+        round1.is_completed = True
+        round1.save()
+
+        # Tasks run eagerly during tests, so the scores are calculated right away
+        LonePlayerPairing.objects.create(round=round1, white=sp1.player, black=sp2.player, pairing_order=1, result='1-0')
+        sp1.loneplayerscore.refresh_from_db()
+        self.assertEqual(1, sp1.loneplayerscore.points)
+        self.assertFalse(season.scores_are_stale())
+
+        # Changes are coalesced into the calculation that has already been scheduled
+        self.addCleanup(cache.clear)
+        cache.set('season_scores_scheduled_%d' % season.pk, True)
+        pairing = LonePlayerPairing.objects.get(round=round1)
+        pairing.result = '0-1'
+        pairing.save()
+        sp1.loneplayerscore.refresh_from_db()
+        self.assertEqual(1, sp1.loneplayerscore.points)
+        self.assertTrue(season.scores_are_stale())
+
+        # The scores stay stale until a calculation finishes, even if the scheduled task is lost
+        cache.delete('season_scores_scheduled_%d' % season.pk)
+        self.assertTrue(season.scores_are_stale())
+        season.resume_score_calculation()
+        sp1.loneplayerscore.refresh_from_db()
+        self.assertEqual(0, sp1.loneplayerscore.points)
+        self.assertFalse(season.scores_are_stale())
+
+    def test_season_calculate_stale_scores_concurrent_change(self):
+        season = Season.objects.get(tag='loneseason')
+        self.addCleanup(cache.clear)
+        cache.set('season_scores_scheduled_%d' % season.pk, True)
+        season.schedule_score_calculation()
+
+        # A change made while the calculation is running isn't counted by it
+        calculate_scores = season.calculate_scores
+        def calculate_scores_with_change(from_round=None):
+            calculate_scores(from_round)
+            season.schedule_score_calculation()
+        season.calculate_scores = calculate_scores_with_change
+        season.calculate_stale_scores()
+        self.assertTrue(season.scores_are_stale())
+
+        season.calculate_scores = calculate_scores
+        season.calculate_stale_scores()
+        self.assertFalse(season.scores_are_stale())
+
     def test_season_calculate_lone_scores(self):
         season = Season.objects.get(tag='loneseason')
         rounds = list(season.round_set.order_by('number'))
@@ -133,6 +202,148 @@ class SeasonTestCase(TestCase):
         rounds[2].save()
         self.assertItemsEqual([(2, 2, 2, 5, 2.5), (0.5, 1.5, 4, 1, 7.5), (0.5, 1.5, 4, 1.5, 7.5), (1, 1, 2, 2.5, 2.5)], score_matrix())
 
+    def test_season_score_snapshots(self):
+        season = Season.objects.get(tag='loneseason')
+        rounds = list(season.round_set.order_by('number'))
+        season_players = list(season.seasonplayer_set.order_by('player__lichess_username'))[:2]
+        players = [sp.player for sp in season_players]
+
+        def snapshots(round_):
+            return [(s.season_player, s.rank, s.points) for s in LonePlayerScoreSnapshot.objects.filter(round=round_).order_by('rank')[:2]]
+
+        LonePlayerPairing.objects.create(round=rounds[0], pairing_order=0, white=players[0], black=players[1], result='1-0')
+        LonePlayerPairing.objects.create(round=rounds[1], pairing_order=0, white=players[0], black=players[1], result='0-1')
+        rounds[0].is_completed = True
+        rounds[0].save()
+        self.assertEqual([(season_players[0], 1, 1), (season_players[1], 2, 0)], snapshots(rounds[0]))
+        self.assertEqual([], snapshots(rounds[1]))
+
+        rounds[1].is_completed = True
+        rounds[1].save()
+        self.assertEqual([(season_players[0], 1, 1), (season_players[1], 2, 0)], snapshots(rounds[0]))
+        self.assertEqual([(season_players[0], 1, 1), (season_players[1], 2, 1)], snapshots(rounds[1]))
+
+        round2 = Round.objects.get(pk=rounds[1].pk)
+        round2.is_completed = False
+        round2.save()
+        self.assertEqual([], snapshots(round2))
+
+    def test_season_score_snapshot_ratings(self):
+        season = Season.objects.get(tag='loneseason')
+        round1 = season.round_set.get(number=1)
+        season_players = list(season.seasonplayer_set.order_by('player__lichess_username'))[:2]
+        Player.objects.filter(pk=season_players[0].player_id).update(rating=1500)
+        Player.objects.filter(pk=season_players[1].player_id).update(rating=1600)
+        LonePlayerPairing.objects.create(round=round1, pairing_order=0, white=season_players[0].player, black=season_players[1].player, result='1/2-1/2')
+        round1.is_completed = True
+        round1.save()
+
+        def ranks():
+            return [(s.season_player, s.rank, s.rating) for s in LonePlayerScoreSnapshot.objects.filter(round=round1).order_by('rank')[:2]]
+
+        self.assertEqual([(season_players[1], 1, 1600), (season_players[0], 2, 1500)], ranks())
+
+        # Ties in past rounds are still broken by the ratings at the time
+        Player.objects.filter(pk=season_players[0].player_id).update(rating=1700)
+        season.calculate_scores()
+        self.assertEqual([(season_players[1], 1, 1600), (season_players[0], 2, 1500)], ranks())
+
+    def test_season_calculate_lone_scores_from_round(self):
+        season = Season.objects.get(tag='loneseason')
+        rounds = list(season.round_set.order_by('number'))
+        players = [sp.player for sp in season.seasonplayer_set.order_by('player__lichess_username')][:4]
+        LonePlayerPairing.objects.create(round=rounds[0], pairing_order=0, white=players[0], black=players[1], result='1-0')
+        LonePlayerPairing.objects.create(round=rounds[0], pairing_order=1, white=players[2], black=players[3], result='0-1')
+        LonePlayerPairing.objects.create(round=rounds[1], pairing_order=0, white=players[3], black=players[0], result='1/2-1/2')
+        LonePlayerPairing.objects.create(round=rounds[1], pairing_order=1, white=players[1], black=players[2], result='1-0')
+        for round_ in rounds[:2]:
+            round_.is_completed = True
+            round_.save()
+
+        def standings():
+            scores = [(s.season_player_id, s.points, s.tiebreak1, s.tiebreak2, s.tiebreak3, s.tiebreak4) for s in LonePlayerScore.objects.order_by('pk')]
+            snapshots = [(s.season_player_id, s.round_id, s.rank, s.points, s.tiebreak2) for s in LonePlayerScoreSnapshot.objects.order_by('pk')]
+            return scores, snapshots
+
+        round1_modified = [s.date_modified for s in LonePlayerScoreSnapshot.objects.filter(round=rounds[0])]
+        PlayerPairing.objects.filter(white=players[1], black=players[2]).update(result='0-1')
+        season.calculate_scores(from_round=2)
+        self.assertEqual(round1_modified, [s.date_modified for s in LonePlayerScoreSnapshot.objects.filter(round=rounds[0])])
+
+        incremental = standings()
+        season.calculate_scores()
+        self.assertEqual(incremental, standings())
+
+    def test_season_calculate_team_scores_from_round(self):
+        season = Season.objects.get(tag='teamseason')
+        rounds = list(season.round_set.order_by('number'))
+        teams = list(season.team_set.order_by('number'))
+        TeamPairing.objects.create(round=rounds[0], pairing_order=0, white_team=teams[0], black_team=teams[1], white_points=2, white_wins=2, black_points=0, black_wins=0)
+        TeamPairing.objects.create(round=rounds[0], pairing_order=1, white_team=teams[2], black_team=teams[3], white_points=1, white_wins=1, black_points=1, black_wins=1)
+        TeamPairing.objects.create(round=rounds[1], pairing_order=0, white_team=teams[3], black_team=teams[0], white_points=1.5, white_wins=1, black_points=0.5, black_wins=0)
+        TeamPairing.objects.create(round=rounds[1], pairing_order=1, white_team=teams[1], black_team=teams[2], white_points=1, white_wins=1, black_points=1, black_wins=1)
+        for round_ in rounds[:2]:
+            round_.is_completed = True
+            round_.save()
+
+        def standings():
+            scores = [(s.team_id, s.match_points, s.game_points, s.head_to_head, s.sb_score) for s in TeamScore.objects.order_by('pk')]
+            snapshots = [(s.team_id, s.round_id, s.rank, s.match_points, s.head_to_head, s.sb_score) for s in TeamScoreSnapshot.objects.order_by('pk')]
+            return scores, snapshots
+
+        TeamPairing.objects.filter(round=rounds[1], white_team=teams[1]).update(white_points=2, white_wins=2, black_points=0, black_wins=0)
+        season.calculate_scores(from_round=2)
+        incremental = standings()
+        self.assertEqual(2, TeamScore.objects.get(team=teams[1]).match_points)
+
+        season.calculate_scores()
+        self.assertEqual(incremental, standings())
+
+    def test_season_calculate_team_scores_from_round_unrecorded_change(self):
+        season = Season.objects.get(tag='teamseason')
+        rounds = list(season.round_set.order_by('number'))
+        teams = list(season.team_set.order_by('number'))
+        TeamPairing.objects.create(round=rounds[0], pairing_order=0, white_team=teams[0], black_team=teams[1], white_points=2, white_wins=2, black_points=0, black_wins=0)
+        TeamPairing.objects.create(round=rounds[1], pairing_order=0, white_team=teams[1], black_team=teams[0], white_points=1, white_wins=1, black_points=1, black_wins=1)
+        for round_ in rounds[:2]:
+            round_.is_completed = True
+            round_.save()
+
+        # The round 1 change isn't recorded, so its snapshot is stale. The totals still come from the pairings.
+        TeamPairing.objects.filter(round=rounds[0]).delete()
+        TeamPairing.objects.filter(round=rounds[1]).update(white_points=2, white_wins=2, black_points=0, black_wins=0)
+        season.calculate_scores(from_round=2)
+
+        self.assertEqual(1, TeamScore.objects.get(team=teams[0]).match_points)
+        self.assertEqual(3, TeamScore.objects.get(team=teams[1]).match_points)
+
+    def test_season_result_change_recalculates_from_round(self):
+        season = Season.objects.get(tag='teamseason')
+        rounds = list(season.round_set.order_by('number'))
+        teams = list(season.team_set.order_by('number'))
+        TeamPairing.objects.create(round=rounds[0], pairing_order=0, white_team=teams[0], black_team=teams[1], white_points=2, white_wins=2, black_points=0, black_wins=0)
+        pairing = TeamPairing.objects.create(round=rounds[1], pairing_order=0, white_team=teams[1], black_team=teams[0], white_points=1, white_wins=1, black_points=1, black_wins=1)
+        for round_ in rounds[:2]:
+            round_.is_completed = True
+            round_.save()
+
+        calculated_from = []
+        calculate_scores = Season.calculate_scores
+        def record_calculate_scores(season, from_round=None):
+            calculated_from.append(from_round)
+            calculate_scores(season, from_round)
+        self.addCleanup(setattr, Season, 'calculate_scores', calculate_scores)
+        Season.calculate_scores = record_calculate_scores
+        self.addCleanup(cache.clear)
+
+        # Tasks run eagerly during tests, so the scores are calculated right away
+        pairing.white_points, pairing.white_wins, pairing.black_points, pairing.black_wins = 2, 2, 0, 0
+        pairing.save()
+
+        self.assertEqual([2], calculated_from)
+        self.assertEqual(2, TeamScore.objects.get(team=teams[1]).match_points)
+        self.assertFalse(season.scores_are_stale())
+
 class TeamTestCase(TestCase):
     def setUp(self):
         createCommonLeagueData()
@@ -472,6 +683,26 @@ class PlayerByeTestCase(TestCase):
     def setUp(self):
         createCommonLeagueData()
 
+    def test_playerbye_save_from_round(self):
+        season = Season.objects.get(tag='loneseason')
+        rounds = list(season.round_set.order_by('number'))
+        for round_ in rounds[1:]:
+            round_.is_completed = True
+            round_.save()
+        scheduled = []
+        self.addCleanup(setattr, Season, 'schedule_score_calculation', Season.schedule_score_calculation)
+        Season.schedule_score_calculation = lambda season, round_number=None: scheduled.append(round_number)
+
+        # Only the rounds the bye was added to or moved between are recalculated, from the earliest one
+        bye = PlayerBye.objects.create(round=rounds[2], player=season.seasonplayer_set.all()[0].player, type='half-point-bye')
+        bye.round = rounds[1]
+        bye.save()
+        bye = PlayerBye.objects.get(pk=bye.pk)
+        bye.round = rounds[0]
+        bye.save()
+
+        self.assertEqual([3, 2, 2], scheduled)
+
     def test_playerbye_save_and_delete(self):
         season = Season.objects.get(tag='loneseason')
         round1 = season.round_set.get(number=1)
@@ -522,3 +753,64 @@ class PlayerByeTestCase(TestCase):
 
         bye2.refresh_rank()
         self.assertEqual(1, bye2.player_rank)
+
+class BulkUpdateTestCase(TestCase):
+    def setUp(self):
+        createCommonLeagueData()
+
+    def test_bulk_update(self):
+        scores = list(LonePlayerScore.objects.order_by('season_player__player__lichess_username')[:2])
+        scores[0].points = 1.5
+        scores[0].perf_rating = 1800
+        scores[1].points = 2
+        scores[1].perf_rating = None
+
+        bulk_update(LonePlayerScore, scores, ['points', 'perf_rating'])
+
+        for s in scores:
+            s.refresh_from_db()
+        self.assertEqual(1.5, scores[0].points)
+        self.assertEqual(1800, scores[0].perf_rating)
+        self.assertEqual(2, scores[1].points)
+        self.assertEqual(None, scores[1].perf_rating)
+
+    def test_all_null(self):
+        scores = list(LonePlayerScore.objects.order_by('season_player__player__lichess_username')[:2])
+        for s in scores:
+            s.perf_rating = None
+        # Compile the statement the way it would be for postgres, where a CASE of only NULLs is typed as text
+        vendor = connection.vendor
+        self.addCleanup(setattr, connection, 'vendor', vendor)
+        connection.vendor = 'postgresql'
+
+        with CaptureQueriesContext(connection) as queries:
+            bulk_update(LonePlayerScore, scores, ['perf_rating'])
+
+        connection.vendor = vendor
+        update_sql = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(1, len(update_sql))
+        self.assertIn('"perf_rating" = CAST(CASE', update_sql[0])
+        for s in scores:
+            s.refresh_from_db()
+            self.assertEqual(None, s.perf_rating)
+
+class PairingJobTestCase(TestCase):
+    def setUp(self):
+        createCommonLeagueData()
+        self.round = Season.objects.get(tag='loneseason').round_set.get(number=1)
+
+    def test_fail_stale_pairing_jobs(self):
+        long_ago = timezone.now() - PAIRING_JOB_TIMEOUT - timedelta(minutes=1)
+        # The worker running this job died, so it will never finish or check for cancellation
+        orphaned = PairingJob.objects.create(round=self.round, status='running', started=long_ago, cancel_requested=True)
+        lost = PairingJob.objects.create(round=self.round)
+        PairingJob.objects.filter(pk=lost.pk).update(date_created=long_ago)
+        running = PairingJob.objects.create(round=self.round, status='running', started=timezone.now())
+        self.assertTrue(PairingJob.objects.get(pk=orphaned.pk).is_stale())
+        self.assertFalse(running.is_stale())
+
+        self.assertEqual(2, fail_stale_pairing_jobs(self.round))
+
+        self.assertEqual(['failed', 'failed', 'running'], [PairingJob.objects.get(pk=j.pk).status for j in (orphaned, lost, running)])
+        self.assertFalse(PairingJob.objects.get(pk=orphaned.pk).is_active())
+        self.assertIsNotNone(PairingJob.objects.get(pk=orphaned.pk).finished)
@@ -0,0 +1,184 @@
+import sys
+import time
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from heltour import settings
+from heltour.tournament.models import *
+from heltour.tournament import pairinggen
+from heltour.tournament.pairinggen import *
+
+def create_javafo_instance():
+    players = [
+        JavafoPlayer('a', 1.5, [JavafoPairing('b', 'white', 1), JavafoPairing('c', 'black', 0.5)]),
+        JavafoPlayer('b', 1.0, [JavafoPairing('a', 'black', 0), JavafoPairing(None, None, 1, forfeit=True)]),
+        JavafoPlayer('c', 0.5, [JavafoPairing(None, None, None, forfeit=True), JavafoPairing('a', 'white', 0.5)]),
+    ]
+    return JavafoInstance(3, players)
+
+class JavafoInstanceTestCase(TestCase):
+    def test_trf(self):
+        lines = create_javafo_instance().trf().split('\n')
+
+        self.assertEqual('XXR 3', lines[0])
+        self.assertEqual('001    1  ' + '1.5'.rjust(74) + '     ' + '     2 w 1     3 b =', lines[1])
+        self.assertEqual('001    2  ' + '1.0'.rjust(74) + '     ' + '     1 b 0  0000 - +', lines[2])
+        self.assertEqual('001    3  ' + '0.5'.rjust(74) + '     ' + '  0000 -       1 w =', lines[3])
+        self.assertEqual('', lines[4])
+
+    def test_parse_trf(self):
+        trf = create_javafo_instance().trf()
+        javafo = parse_trf(trf)
+
+        self.assertEqual(3, javafo.total_round_count)
+        self.assertEqual([1, 2, 3], [p.player for p in javafo.players])
+        self.assertEqual([1.5, 1.0, 0.5], [p.score for p in javafo.players])
+        b = javafo.players[1]
+        self.assertEqual([(1, 'black', 0, False), (None, None, 1, True)], [(p.opponent, p.color, p.score, p.forfeit) for p in b.pairings])
+        self.assertEqual(trf, javafo.trf())
+
+class ExportTrfTestCase(TestCase):
+    def test_export_trf(self):
+        league = League.objects.create(name='Lone League', tag='loneleague', competitor_type='lone')
+        season = Season.objects.create(league=league, name='Test Season', tag='loneseason', rounds=3)
+        players = [Player.objects.create(lichess_username='Player%d' % n, rating=2000 - n) for n in range(1, 4)]
+        for p in players:
+            sp = SeasonPlayer.objects.create(season=season, player=p)
+            LonePlayerScore.objects.create(season_player=sp)
+        round1 = season.round_set.get(number=1)
+        round2 = season.round_set.get(number=2)
+        LonePlayerPairing.objects.create(round=round1, pairing_order=1, white=players[0], black=players[1], result='1-0')
+        PlayerBye.objects.create(round=round1, player=players[2], type='full-point-pairing-bye')
+        round1.is_completed = True
+        round1.save()
+
+        javafo = parse_trf(export_trf(round2))
+
+        self.assertEqual(3, javafo.total_round_count)
+        self.assertEqual([1.0, 1.0, 0.0], [p.score for p in javafo.players])
+        self.assertEqual([[(3, 'white', 1, False)], [(None, None, 1, True)], [(1, 'black', 0, False)]],
+                         [[(p.opponent, p.color, p.score, p.forfeit) for p in player.pairings] for player in javafo.players])
+        # Exporting doesn't save seed ratings
+        self.assertEqual(0, SeasonPlayer.objects.filter(season=season).exclude(seed_rating=None).count())
+
+class TeamRosterTestCase(TestCase):
+    def test_get_player_lists(self):
+        league = League.objects.create(name='Team League', tag='teamleague', competitor_type='team')
+        season = Season.objects.create(league=league, name='Test Season', tag='teamseason', rounds=3, boards=2)
+        round1 = season.round_set.get(number=1)
+        players = [Player.objects.create(lichess_username='Player%d' % n) for n in range(1, 6)]
+        team1 = Team.objects.create(season=season, number=1, name='Team 1')
+        team2 = Team.objects.create(season=season, number=2, name='Team 2')
+        TeamMember.objects.create(team=team1, player=players[0], board_number=1)
+        TeamMember.objects.create(team=team1, player=players[1], board_number=2)
+        TeamMember.objects.create(team=team2, player=players[2], board_number=1)
+        AlternateAssignment.objects.create(round=round1, team=team1, board_number=1, player=players[3])
+        AlternateAssignment.objects.create(round=round1, team=team2, board_number=2, player=players[4])
+
+        with self.assertNumQueries(2):
+            player_lists = pairinggen._get_player_lists(round1, [team1, team2], 2)
+
+        self.assertEqual({team1.pk: [players[3], players[1]], team2.pk: [players[2], players[4]]}, player_lists)
+
+class PairingCacheTestCase(TestCase):
+    def setUp(self):
+        javafo_command = settings.JAVAFO_COMMAND
+        daemon_command = settings.JAVAFO_DAEMON_COMMAND
+        self.addCleanup(setattr, settings, 'JAVAFO_COMMAND', javafo_command)
+        self.addCleanup(setattr, settings, 'JAVAFO_DAEMON_COMMAND', daemon_command)
+        settings.JAVAFO_DAEMON_COMMAND = None
+        # Pairs the first two players in the output file given by the -p argument
+        settings.JAVAFO_COMMAND = '%s -c "import sys; open(sys.argv[3], \'w\').write(\'1\\n1 2\\n\')"' % sys.executable
+
+    def test_cache_miss(self):
+        javafo = create_javafo_instance()
+
+        self.assertEqual([['a', 'b']], javafo.run())
+        self.assertEqual('JaVaFo', javafo.engine)
+        entry = PairingCacheEntry.objects.get()
+        self.assertEqual(javafo.cache_key(), entry.key)
+        self.assertEqual(javafo.trf(), entry.trf)
+        self.assertEqual('1\n1 2\n', entry.output)
+        self.assertEqual('-q 10000 then -w', entry.flags)
+
+    def test_cache_hit(self):
+        javafo = create_javafo_instance()
+        PairingCacheEntry.objects.create(key=javafo.cache_key(), engine='JaVaFo', trf=javafo.trf(), output='2\n3 1\n2 0\n')
+
+        self.assertEqual([['c', 'a'], ['b', None]], javafo.run())
+        self.assertEqual('JaVaFo (cached)', javafo.engine)
+        self.assertEqual(1, PairingCacheEntry.objects.get().hit_count)
+
+    def test_cache_key(self):
+        javafo = create_javafo_instance()
+        key = javafo.cache_key()
+        javafo.players[0].score = 2.0
+        self.assertNotEqual(key, javafo.cache_key())
+        javafo.players[0].score = 1.5
+        settings.JAVAFO_COMMAND = 'java -jar javafo2.jar'
+        self.assertNotEqual(key, javafo.cache_key())
+
+    def test_cache_key_daemon(self):
+        javafo = create_javafo_instance()
+        self.assertNotEqual(javafo.cache_key(daemon=False), javafo.cache_key(daemon=True))
+        settings.JAVAFO_DAEMON_COMMAND = 'java -cp javafo2.jar:nailgun.jar com.facebook.nailgun.NGServer'
+        self.assertEqual(javafo.cache_key(daemon=True), javafo.cache_key())
+
+    def test_empty_output_not_cached(self):
+        settings.JAVAFO_COMMAND = '%s -c "import sys; open(sys.argv[3], \'w\').write(\'0\\n\')"' % sys.executable
+        javafo = create_javafo_instance()
+
+        self.assertEqual([], javafo.run())
+        self.assertEqual(0, PairingCacheEntry.objects.count())
+
+    def test_old_entries_pruned(self):
+        old = timezone.now() - pairinggen.PAIRING_CACHE_MAX_AGE - timedelta(days=1)
+        unused = PairingCacheEntry.objects.create(key='unused', engine='JaVaFo', trf='', output='0\n')
+        recently_hit = PairingCacheEntry.objects.create(key='recently hit', engine='JaVaFo', trf='', output='0\n',
+                                                        last_hit=timezone.now())
+        PairingCacheEntry.objects.filter(pk__in=[unused.pk, recently_hit.pk]).update(date_created=old)
+
+        create_javafo_instance().run()
+
+        self.assertFalse(PairingCacheEntry.objects.filter(key='unused').exists())
+        self.assertTrue(PairingCacheEntry.objects.filter(key='recently hit').exists())
+
+class PairingSearchTestCase(TestCase):
+    def setUp(self):
+        javafo_command = settings.JAVAFO_COMMAND
+        deadline = settings.PAIRING_SEARCH_DEADLINE
+        self.addCleanup(setattr, settings, 'JAVAFO_COMMAND', javafo_command)
+        self.addCleanup(setattr, settings, 'PAIRING_SEARCH_DEADLINE', deadline)
+
+    def test_best_result(self):
+        # Pairs the first two players, who have already played each other
+        settings.JAVAFO_COMMAND = '%s -c "import sys; open(sys.argv[3], \'w\').write(\'1\\n1 2\\n\')"' % sys.executable
+        players = create_javafo_instance().players
+        search = PairingSearchInstance(3, players)
+
+        pairs = search.run()
+
+        self.assertEqual('Python Swiss', search.engine)
+        self.assertEqual(['a', None], pairs[-1])
+        self.assertEqual(0, search.qualities['Python Swiss'].repeat_count)
+        self.assertEqual(1, search.qualities['JaVaFo -w'].repeat_count)
+
+    def test_deadline(self):
+        settings.JAVAFO_COMMAND = '%s -c "import time; time.sleep(30)"' % sys.executable
+        settings.PAIRING_SEARCH_DEADLINE = 0.5
+        search = PairingSearchInstance(3, create_javafo_instance().players)
+
+        start = time.time()
+        pairs = search.run()
+
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual('Python Swiss', search.engine)
+        self.assertEqual(2, len(pairs))
+
+    def test_pairing_quality(self):
+        players = create_javafo_instance().players
+
+        quality = PairingQuality(players, [['a', 'b']])
+
+        self.assertEqual((1, 1, 0, 1, 0.5), quality.key())
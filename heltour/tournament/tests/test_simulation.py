@@ -0,0 +1,56 @@
+from django.test import TestCase
+from heltour.tournament.models import *
+from heltour.tournament.pairinggen import PythonSwissInstance
+from heltour.tournament.simulation import SeasonSimulation
+
+class SeasonSimulationTestCase(TestCase):
+    def setUp(self):
+        league = League.objects.create(name='Lone League', tag='loneleague', competitor_type='lone')
+        self.season = Season.objects.create(league=league, name='Test Season', tag='loneseason', rounds=3)
+        self.players = [Player.objects.create(lichess_username='Player%d' % n, rating=2000 - n) for n in range(1, 6)]
+        for p in self.players[:4]:
+            sp = SeasonPlayer.objects.create(season=self.season, player=p)
+            LonePlayerScore.objects.create(season_player=sp)
+        round1 = self.season.round_set.get(number=1)
+        LonePlayerPairing.objects.create(round=round1, pairing_order=1, white=self.players[0], black=self.players[2], result='1-0')
+        LonePlayerPairing.objects.create(round=round1, pairing_order=2, white=self.players[3], black=self.players[1], result='0-1')
+        round1.publish_pairings = True
+        round1.is_completed = True
+        round1.save()
+        round2 = self.season.round_set.get(number=2)
+        PlayerLateRegistration.objects.create(round=round2, player=self.players[4], retroactive_byes=1, late_join_points=0)
+        PlayerWithdrawl.objects.create(round=round2, player=self.players[3])
+
+    def test_run(self):
+        simulation = SeasonSimulation(self.season)
+
+        with self.assertNumQueries(0):
+            rounds = simulation.run(2, 'rating', engine_class=PythonSwissInstance)
+
+        self.assertEqual([2, 3], [r.round.number for r in rounds])
+        round2, round3 = rounds
+        self.assertEqual([self.players[4]], [reg.player for reg in round2.registrations])
+        self.assertEqual([self.players[3]], [wd.player for wd in round2.withdrawls])
+        # The late registration's retroactive bye is in round 1, so round 2 has a pairing bye for one of 4 active players
+        round2_players = {p for pairing in round2.pairings for p in (pairing.white, pairing.black)} | {b.player for b in round2.byes}
+        self.assertEqual(set(self.players[:3] + self.players[4:]), round2_players)
+        round2_pairs = {frozenset((p.white, p.black)) for p in round2.pairings}
+        round3_pairs = {frozenset((p.white, p.black)) for p in round3.pairings}
+        self.assertFalse(round2_pairs & round3_pairs)
+        self.assertFalse({frozenset((self.players[0], self.players[2])), frozenset((self.players[3], self.players[1]))} & (round2_pairs | round3_pairs))
+        # Player1 has the highest rating, so wins every simulated game
+        self.assertEqual((1, self.players[0], 3.0), (round3.standings[0][0], round3.standings[0][1].player, round3.standings[0][2].points))
+
+    def test_nothing_saved(self):
+        SeasonSimulation(self.season).run(2, 'draw', engine_class=PythonSwissInstance)
+
+        self.assertEqual(2, LonePlayerPairing.objects.count())
+        self.assertEqual(0, PlayerBye.objects.count())
+        self.assertEqual(4, SeasonPlayer.objects.filter(season=self.season, is_active=True).count())
+        self.assertEqual(0, SeasonPlayer.objects.exclude(seed_rating=None).count())
+
+    def test_without_changes(self):
+        rounds = SeasonSimulation(self.season).run(1, 'rating', apply_changes=False, engine_class=PythonSwissInstance)
+
+        self.assertEqual(2, len(rounds[0].pairings))
+        self.assertEqual([], rounds[0].byes)
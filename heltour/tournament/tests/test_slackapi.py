@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+from heltour import settings
+from heltour.tournament import slackapi
+
+class SlackTokenTestCase(SimpleTestCase):
+    def setUp(self):
+        token_file_path = settings.SLACK_API_TOKEN_FILE_PATH
+        self.addCleanup(setattr, settings, 'SLACK_API_TOKEN_FILE_PATH', token_file_path)
+        fd, settings.SLACK_API_TOKEN_FILE_PATH = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, settings.SLACK_API_TOKEN_FILE_PATH)
+
+    def _write_token(self, token, mtime):
+        with open(settings.SLACK_API_TOKEN_FILE_PATH, 'w') as f:
+            f.write(token + '\n')
+        os.utime(settings.SLACK_API_TOKEN_FILE_PATH, (mtime, mtime))
+
+    def test_cached_until_changed(self):
+        self._write_token('token1', 1000)
+        self.assertEqual('token1', slackapi._get_slack_token())
+
+        # Same modification time, so the cached token is used
+        self._write_token('token2', 1000)
+        self.assertEqual('token1', slackapi._get_slack_token())
+
+        self._write_token('token2', 2000)
+        self.assertEqual('token2', slackapi._get_slack_token())
@@ -0,0 +1,69 @@
+from django.test import SimpleTestCase
+from heltour.tournament.pairinggen import JavafoPairing, JavafoPlayer, PairingsCancelledException, PythonSwissInstance, \
+                                          get_pairing_engine_class
+from heltour.tournament.swiss import SwissInstance
+
+def _play_round(players, pairs):
+    # Adds the results of a round to the players' histories, with white winning every game
+    by_name = {p.player: p for p in players}
+    for white, black in pairs:
+        if black is None:
+            by_name[white].pairings.append(JavafoPairing(None, None, 1, forfeit=True))
+            by_name[white].score += 1
+            continue
+        by_name[white].pairings.append(JavafoPairing(black, 'white', 1))
+        by_name[white].score += 1
+        by_name[black].pairings.append(JavafoPairing(white, 'black', 0))
+    players.sort(key=lambda p: (-p.score, int(p.player[1:])))
+
+class SwissInstanceTestCase(SimpleTestCase):
+    def test_first_round(self):
+        players = [JavafoPlayer('p%d' % n, 0, []) for n in range(1, 9)]
+
+        pairs = SwissInstance(3, players).run()
+
+        self.assertEqual([['p1', 'p5'], ['p6', 'p2'], ['p3', 'p7'], ['p8', 'p4']], pairs)
+
+    def test_bye(self):
+        players = [JavafoPlayer('p%d' % n, 0, []) for n in range(1, 6)]
+        players[4].pairings.append(JavafoPairing(None, None, 1, forfeit=True))
+        players[4].score = 1
+
+        pairs = SwissInstance(3, players).run()
+
+        # The last player already had a bye, so the next lowest player gets it
+        self.assertEqual(['p4', None], pairs[-1])
+
+    def test_color_preference(self):
+        players = [
+            JavafoPlayer('p1', 1, [JavafoPairing('p3', 'white', 1)]),
+            JavafoPlayer('p2', 1, [JavafoPairing('p4', 'black', 1)]),
+            JavafoPlayer('p3', 0, [JavafoPairing('p1', 'black', 0)]),
+            JavafoPlayer('p4', 0, [JavafoPairing('p2', 'white', 0)]),
+        ]
+
+        pairs = SwissInstance(3, players).run()
+
+        self.assertEqual([['p2', 'p1'], ['p3', 'p4']], pairs)
+
+    def test_no_repeat_pairings(self):
+        players = [JavafoPlayer('p%d' % n, 0, []) for n in range(1, 12)]
+        for _ in range(6):
+            pairs = SwissInstance(6, players).run()
+            self.assertEqual(6, len(pairs))
+            _play_round(players, pairs)
+
+        for p in players:
+            opponents = [pairing.opponent for pairing in p.pairings if pairing.opponent is not None]
+            self.assertEqual(len(opponents), len(set(opponents)))
+            self.assertLessEqual(sum(1 for pairing in p.pairings if pairing.opponent is None), 1)
+
+    def test_cancel(self):
+        players = [JavafoPlayer('p%d' % n, 0, []) for n in range(1, 5)]
+        players[0].score = 1
+
+        with self.assertRaises(PairingsCancelledException):
+            PythonSwissInstance(3, players, is_cancelled=lambda: True).run()
+
+    def test_get_pairing_engine_class(self):
+        self.assertEqual(PythonSwissInstance, get_pairing_engine_class('python'))
@@ -0,0 +1,167 @@
+import json
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from heltour import settings
+from heltour.tournament.models import *
+from heltour.tournament import lichessapi, slackapi, tasks
+
+def create_lone_round():
+    league = League.objects.create(name='Lone League', tag='loneleague', competitor_type='lone')
+    season = Season.objects.create(league=league, name='Test Season', tag='loneseason', rounds=3)
+    for n in range(1, 5):
+        player = Player.objects.create(lichess_username='Player%d' % n, rating=2000 - n)
+        sp = SeasonPlayer.objects.create(season=season, player=player)
+        LonePlayerScore.objects.create(season_player=sp)
+    return season.round_set.get(number=1)
+
+class RunPairingJobTestCase(TestCase):
+    def setUp(self):
+        self.round = create_lone_round()
+
+    def test_cancelled_before_start(self):
+        job = PairingJob.objects.create(round=self.round, status='cancelled')
+        tasks.run_pairing_job(job.pk)
+
+        job = PairingJob.objects.get(pk=job.pk)
+        self.assertEqual('cancelled', job.status)
+        self.assertIsNone(job.started)
+
+    def test_cancelled_while_running(self):
+        job = PairingJob.objects.create(round=self.round, cancel_requested=True)
+        tasks.run_pairing_job(job.pk)
+
+        job = PairingJob.objects.get(pk=job.pk)
+        self.assertEqual('cancelled', job.status)
+        self.assertTrue(job.cancel_requested)
+        self.assertIsNotNone(job.elapsed_seconds())
+        self.assertEqual(0, self.round.loneplayerpairing_set.count())
+
+    def test_pairings_exist(self):
+        players = list(Player.objects.all())
+        LonePlayerPairing.objects.create(round=self.round, pairing_order=1, white=players[0], black=players[1])
+        job = PairingJob.objects.create(round=self.round)
+        tasks.run_pairing_job(job.pk)
+
+        job = PairingJob.objects.get(pk=job.pk)
+        self.assertEqual('failed', job.status)
+        self.assertEqual('Pairings already exist for the selected round.', job.error)
+        self.assertFalse(job.is_active())
+        self.assertIsNotNone(job.finished)
+
+class UpdatePlayerRatingsTestCase(TestCase):
+    def setUp(self):
+        self.players = [Player.objects.create(lichess_username='Player%d' % n, rating=1500) for n in range(1, 4)]
+        self.requested = []
+        def queue_apicall(url, data=None):
+            self.requested.append(data)
+            return data
+        def wait_for_result(redis_key, url, timeout=120):
+            # Lichess returns user ids in lowercase and omits unknown users
+            users = [u for u in redis_key.split(',') if u != 'player3']
+            return json.dumps([{'id': u.lower(), 'perfs': {'classical': {'rating': 1800, 'games': 25}}} for u in users])
+        self._patch(lichessapi, '_queue_apicall', queue_apicall)
+        self._patch(lichessapi, '_wait_for_result', wait_for_result)
+        self._patch(settings, 'RATING_UPDATE_INTERVAL', timedelta(minutes=5))
+        self._patch(settings, 'RATING_UPDATE_ACTIVE_AGE', timedelta(minutes=10))
+        self._patch(settings, 'RATING_UPDATE_DORMANT_AGE', timedelta(minutes=20))
+
+    def _patch(self, obj, name, value):
+        original = getattr(obj, name)
+        setattr(obj, name, value)
+        self.addCleanup(setattr, obj, name, original)
+
+    def test_bulk_lookup(self):
+        self._patch(lichessapi, '_USERS_PER_REQUEST', 2)
+        self._patch(settings, 'RATING_UPDATE_DORMANT_AGE', timedelta(minutes=5))
+
+        tasks.update_player_ratings()
+
+        self.assertEqual(2, len(self.requested))
+        self.assertEqual([(1800, 25), (1800, 25), (1500, None)],
+                         [(p.rating, p.games_played) for p in Player.objects.order_by('lichess_username')])
+        self.assertEqual(0, Player.objects.filter(rating_updated=None).count())
+
+    def test_failed_chunk(self):
+        self._patch(lichessapi, '_USERS_PER_REQUEST', 1)
+        self._patch(settings, 'RATING_UPDATE_DORMANT_AGE', timedelta(minutes=5))
+        wait_for_result = lichessapi._wait_for_result
+        def fail_player2(redis_key, url, timeout=120):
+            if redis_key == 'player2':
+                raise lichessapi.ApiWorkerError('Timeout for %s' % url)
+            return wait_for_result(redis_key, url, timeout)
+        self._patch(lichessapi, '_wait_for_result', fail_player2)
+
+        tasks.update_player_ratings()
+
+        # The other players are still updated, and player2 is looked up first in the next run
+        players = list(Player.objects.order_by('lichess_username'))
+        self.assertEqual([1800, 1500, 1500], [p.rating for p in players])
+        self.assertEqual([False, True, False], [p.rating_updated is None for p in players])
+        tasks.update_player_ratings()
+        self.assertEqual('player2', self.requested[3])
+
+    def test_priority(self):
+        league = League.objects.create(name='Lone League', tag='loneleague', competitor_type='lone')
+        season = Season.objects.create(league=league, name='Test Season', tag='loneseason', rounds=3)
+        SeasonPlayer.objects.create(season=season, player=self.players[2])
+        Player.objects.filter(pk=self.players[0].pk).update(rating_updated=timezone.now() - timedelta(hours=1))
+
+        # 1 active player every 2 runs and 2 dormant players every 4 runs makes 1 player per run
+        tasks.update_player_ratings()
+        tasks.update_player_ratings()
+        tasks.update_player_ratings()
+
+        self.assertEqual(['player3', 'player2', 'player1'], self.requested)
+
+    def test_unchanged_ratings(self):
+        self._patch(settings, 'RATING_UPDATE_DORMANT_AGE', timedelta(minutes=5))
+        Player.objects.filter(pk=self.players[0].pk).update(rating=1800, games_played=25)
+        dates_modified = [p.date_modified for p in Player.objects.order_by('lichess_username')]
+
+        tasks.update_player_ratings()
+
+        players = list(Player.objects.order_by('lichess_username'))
+        self.assertEqual([True, False, True], [p.date_modified == d for p, d in zip(players, dates_modified)])
+        self.assertEqual([1800, 1800, 1500], [p.rating for p in players])
+        self.assertEqual(0, Player.objects.filter(rating_updated=None).count())
+
+class UpdateSlackUsersTestCase(TestCase):
+    def test_changed_players(self):
+        Player.objects.create(lichess_username='Player1', in_slack_group=True)
+        Player.objects.create(lichess_username='Player2')
+        Player.objects.create(lichess_username='Player3')
+        get_user_list = slackapi.get_user_list
+        self.addCleanup(setattr, slackapi, 'get_user_list', get_user_list)
+        slackapi.get_user_list = lambda: [slackapi.SlackUser('player1', ''), slackapi.SlackUser('player2', '')]
+        date_modified = Player.objects.get(lichess_username='Player1').date_modified
+
+        tasks.update_slack_users()
+
+        player1, player2, player3 = Player.objects.order_by('lichess_username')
+        self.assertEqual([True, True, False], [player1.in_slack_group, player2.in_slack_group, player3.in_slack_group])
+        self.assertEqual(date_modified, player1.date_modified)
+
+class UpdateTvStateTestCase(TestCase):
+    def setUp(self):
+        self.round = create_lone_round()
+        players = list(Player.objects.all())
+        for n, gameid in enumerate(['game0001', 'game0002', 'game0003'], 1):
+            LonePlayerPairing.objects.create(round=self.round, pairing_order=n, white=players[0], black=players[1],
+                                             game_link='https://en.lichess.org/%s' % gameid)
+        self.requested = []
+        def queue_apicall(url, data=None, accept=None):
+            self.requested.append(data)
+            return data
+        def wait_for_result(redis_key, url, timeout=120):
+            statuses = {'game0001': 'started', 'game0002': 'mate'}
+            return '\n'.join(json.dumps({'id': g, 'status': statuses[g]}) for g in redis_key.split(',') if g in statuses)
+        for name, value in [('_queue_apicall', queue_apicall), ('_wait_for_result', wait_for_result), ('_GAMES_PER_REQUEST', 2)]:
+            self.addCleanup(setattr, lichessapi, name, getattr(lichessapi, name))
+            setattr(lichessapi, name, value)
+
+    def test_finished_games_hidden(self):
+        tasks.update_tv_state()
+
+        self.assertEqual(2, len(self.requested))
+        self.assertEqual(['default', 'hide', 'default'], [p.tv_state for p in PlayerPairing.objects.order_by('game_link')])
@@ -0,0 +1,27 @@
+from django.test import SimpleTestCase
+from heltour.tournament.tiebreaks import LoneScoreMatrix
+
+class LoneScoreMatrixTestCase(SimpleTestCase):
+    def test_tiebreaks(self):
+        # Player 0 beats 1 then gets a half-point bye, player 1 beats 2, player 2 gets a full-point bye then loses
+        matrix = LoneScoreMatrix([[1, 0.5], [0, 1], [1, 0]],
+                                 [[True, False], [True, True], [False, True]],
+                                 [[1, -1], [0, 2], [-1, 1]],
+                                 [1500, 1600, 1700])
+
+        self.assertEqual([1.5, 1, 1], list(matrix.points()))
+        self.assertEqual([2, 1, 1], list(matrix.cumulative()))
+        self.assertEqual([1, 2, 1], list(matrix.solkoff()))
+        self.assertEqual([1, 0, 0], list(matrix.modified_median()))
+        self.assertEqual([1, 3, 1], list(matrix.cumulative_opponent()))
+
+    def test_performance_rating(self):
+        # Five wins and five losses against 1500s
+        matrix = LoneScoreMatrix([[1, 1, 1, 1, 1, 0, 0, 0, 0, 0]] + [[0] * 10] * 10,
+                                 [[True] * 10] + [[False] * 10] * 10,
+                                 [range(1, 11)] + [[-1] * 10] * 10,
+                                 [1800] + [1500] * 10)
+
+        self.assertEqual(1500, matrix.performance_rating()[0])
+        self.assertEqual(-1, matrix.performance_rating()[1])
+        self.assertEqual(-1, matrix.performance_rating(min_games=11)[0])
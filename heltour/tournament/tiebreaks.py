@@ -0,0 +1,88 @@
+import numpy as np
+
+# From https://www.fide.com/component/handbook/?id=174&view=article
+# Used for performance rating calculations
+fide_dp_lookup = [-800, -677, -589, -538, -501, -470, -444, -422, -401, -383, -366, -351, -336, -322, -309, -296, -284, -273, -262, -251,
+                   - 240, -230, -220, -211, -202, -193, -184, -175, -166, -158, -149, -141, -133, -125, -117, -110, -102, -95, -87, -80, -72,
+                   - 65, -57, -50, -43, -36, -29, -21, -14, -7, 0, 7, 14, 21, 29, 36, 43, 50, 57, 65, 72, 80, 87, 95, 102, 110, 117, 125, 133,
+                   141, 149, 158, 166, 175, 184, 193, 202, 211, 220, 230, 240, 251, 262, 273, 284, 296, 309, 322, 336, 351, 366, 383, 401,
+                   422, 444, 470, 501, 538, 589, 677, 800]
+
+_fide_dp_array = np.array(fide_dp_lookup)
+
+def _round_half_up(a):
+    # Matches Python 2's round() for the non-negative values used here (numpy rounds halves to even)
+    return np.floor(a + 0.5).astype(int)
+
+class LoneScoreMatrix:
+    '''Calculates lone league scores and tiebreaks for all players at once
+
+    Arguments:
+    round_scores -- a players x rounds array of the points each player scored in each round
+    round_played -- a players x rounds boolean array of whether each round's game was actually played
+    round_opponents -- a players x rounds array of opponent indexes (rows of the other arrays), or -1 for no opponent
+    seed_ratings -- an array of each player's seed rating, or NaN if the player has none
+
+    Each tiebreak is an array expression over these, so new tiebreaks can be added as methods.
+    '''
+    def __init__(self, round_scores, round_played, round_opponents, seed_ratings):
+        self.round_scores = np.asarray(round_scores, dtype=float)
+        self.round_played = np.asarray(round_played, dtype=bool)
+        self.round_opponents = np.asarray(round_opponents, dtype=int)
+        self.seed_ratings = np.asarray(seed_ratings, dtype=float)
+        self.player_count, self.round_count = self.round_scores.shape
+
+        self.has_opponent = self.round_played & (self.round_opponents >= 0)
+        # Clamped so the opponent index can be used for lookups; the values for rounds without an opponent are masked out
+        self._opponents = np.maximum(self.round_opponents, 0)
+
+    def first_rounds(self, round_count):
+        '''Returns a LoneScoreMatrix for the standings after the given number of rounds'''
+        return LoneScoreMatrix(self.round_scores[:, :round_count], self.round_played[:, :round_count],
+                               self.round_opponents[:, :round_count], self.seed_ratings)
+
+    def points(self):
+        return self.round_scores.sum(axis=1)
+
+    def median_totals(self):
+        # Unplayed games count as draws for the purposes of the median score
+        return np.where(self.round_played, self.round_scores, 0.5).sum(axis=1)
+
+    def cumulative(self):
+        # The sum of the running score after each round, not counting points from unplayed games
+        running_totals = self.round_scores.cumsum(axis=1).sum(axis=1)
+        return running_totals - np.where(self.round_played, 0, self.round_scores).sum(axis=1)
+
+    def opponent_median_totals(self):
+        return np.where(self.has_opponent, self.median_totals()[self._opponents], 0)
+
+    def modified_median(self):
+        opponent_scores = np.sort(self.opponent_median_totals(), axis=1)
+        points = self.points()
+        skip = 2 if self.round_count >= 9 else 1
+        columns = np.arange(self.round_count)
+        # Players above 50% drop their lowest opponents, players below 50% drop their highest, and players on 50% drop both
+        drop_highest = (points <= self.round_count / 2.0)[:, np.newaxis] & (columns >= self.round_count - skip)
+        drop_lowest = (points >= self.round_count / 2.0)[:, np.newaxis] & (columns < skip)
+        return np.where(drop_highest | drop_lowest, 0, opponent_scores).sum(axis=1)
+
+    def solkoff(self):
+        return self.opponent_median_totals().sum(axis=1)
+
+    def cumulative_opponent(self):
+        return np.where(self.has_opponent, self.cumulative()[self._opponents], 0).sum(axis=1)
+
+    def performance_rating(self, min_games=5):
+        '''Returns an array of performance ratings, with -1 for players with fewer than min_games rated games'''
+        opponent_ratings = self.seed_ratings[self._opponents]
+        rated = self.round_played & (self.round_opponents >= 0) & ~np.isnan(opponent_ratings)
+        perf_n = rated.sum(axis=1)
+        has_perf = perf_n >= min_games
+        perf_n_safe = np.maximum(perf_n, 1).astype(float)
+        perf_total_rating = np.where(rated, opponent_ratings, 0).sum(axis=1)
+        perf_score = np.where(rated, self.round_scores, 0).sum(axis=1)
+
+        average_opp_rating = _round_half_up(perf_total_rating / perf_n_safe)
+        # Turn the score into a number from 0-100 (0 = 0%, 100 = 100%) and use it to get a rating difference from the FIDE lookup table
+        lookup_index = np.clip(_round_half_up(100.0 * perf_score / perf_n_safe), 0, 100)
+        return np.where(has_perf, average_opp_rating + _fide_dp_array[lookup_index], -1)
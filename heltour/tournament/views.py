@@ -533,19 +533,22 @@ class StandingsView(SeasonView):
 
     def team_view(self):
         @cached_as(TeamScore, TeamPairing, *common_team_models)
-        def _view(league_tag, season_tag, is_staff):
+        def _view(league_tag, season_tag, is_staff, scores_stale):
             round_numbers = list(range(1, self.season.rounds + 1))
             team_scores = list(enumerate(sorted(TeamScore.objects.filter(team__season=self.season).select_related('team').nocache(), reverse=True), 1))
             context = {
                 'round_numbers': round_numbers,
                 'team_scores': team_scores,
+                'scores_stale': scores_stale,
             }
             return self.render('tournament/team_standings.html', context)
-        return _view(self.league.tag, self.season.tag, self.request.user.is_staff)
+        # Picks the calculation back up if its task was lost
+        self.season.resume_score_calculation()
+        return _view(self.league.tag, self.season.tag, self.request.user.is_staff, self.season.scores_are_stale())
 
     def lone_view(self, section=None):
         @cached_as(*common_lone_models)
-        def _view(league_tag, season_tag, is_staff):
+        def _view(league_tag, season_tag, is_staff, scores_stale):
             round_numbers = list(range(1, self.season.rounds + 1))
             player_scores = _lone_player_scores(self.season)
 
@@ -571,9 +574,12 @@ class StandingsView(SeasonView):
                 'player_sections': player_sections,
                 'current_section': current_section,
                 'player_highlights': player_highlights,
+                'scores_stale': scores_stale,
             }
             return self.render('tournament/lone_standings.html', context)
-        return _view(self.league.tag, self.season.tag, self.request.user.is_staff)
+        # Picks the calculation back up if its task was lost
+        self.season.resume_score_calculation()
+        return _view(self.league.tag, self.season.tag, self.request.user.is_staff, self.season.scores_are_stale())
 
 def _get_player_highlights(prize_winners):
     return [